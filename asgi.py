@@ -0,0 +1,5 @@
+from chatbot import create_app
+from chatbot.asgi import AsyncChatApp
+
+# Serve with an ASGI server, e.g. `uvicorn asgi:app`
+app = AsyncChatApp(create_app())
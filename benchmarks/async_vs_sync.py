@@ -0,0 +1,101 @@
+"""
+Compares the sync WSGI chat path with the async ASGI path under concurrent load.
+
+Both paths use the stub LLM backend with a fixed latency, so the numbers show how many
+chats one process can keep in flight rather than how fast the model is. The sync path
+is driven by a fixed pool of threads, like a threaded WSGI server with that many
+workers; the async path runs every request as a coroutine on one event loop.
+
+    python benchmarks/async_vs_sync.py --requests 400 --concurrency 200 --workers 8 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import create_chats, create_user, login, make_app, summarize
+from chatbot.asgi import AsyncChatApp
+
+def run_sync(app, cookie, chat_ids, requests, workers):
+    """Sends `requests` chat turns through the WSGI app with `workers` threads."""
+    def one(index):
+        client = app.test_client()
+        client.set_cookie('session', cookie)
+        started = time.perf_counter()
+        response = client.post('/chat', json={'message': f'sync message {index}', 'recent_id': chat_ids[index % len(chat_ids)]})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    return summarize(latencies, time.perf_counter() - started)
+
+async def run_async(asgi_app, cookie, chat_ids, requests, concurrency):
+    """Sends `requests` chat turns through the ASGI app with up to `concurrency` in flight."""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        body = json.dumps({'message': f'async message {index}', 'recent_id': chat_ids[index % len(chat_ids)]}).encode()
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': '/chat', 'query_string': b'', 'scheme': 'http',
+            'headers': [(b'content-type', b'application/json'), (b'cookie', f'session={cookie}'.encode())],
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        async with slots:
+            started = time.perf_counter()
+            await asgi_app(scope, receive, send)
+            assert sent[0]['status'] == 200, sent
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(one(index) for index in range(requests)))
+    return summarize(latencies, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400, help="Chat turns sent per path.")
+    parser.add_argument('--concurrency', type=int, default=200, help="Requests in flight on the async path.")
+    parser.add_argument('--workers', type=int, default=8, help="Threads serving the sync path.")
+    parser.add_argument('--latency', type=float, default=0.5, help="Stub model latency in seconds.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    app = make_app(
+        LLM_STUB_LATENCY=args.latency,
+        LLM_MAX_CONCURRENCY=args.concurrency,
+        LLM_MAX_QUEUE=args.requests,
+        LLM_ASYNC_MAX_CONCURRENCY=args.concurrency,
+        LLM_ASYNC_MAX_QUEUE=args.requests,
+        ASYNC_DB_WORKERS=args.workers,
+    )
+    user_id = create_user(app)
+    chat_ids = create_chats(app, user_id, 50)
+    client = app.test_client()
+    login(client)
+    cookie = client.get_cookie('session').value
+
+    results = {
+        "config": vars(args),
+        "sync": run_sync(app, cookie, chat_ids, args.requests, args.workers),
+        "async": asyncio.run(run_async(AsyncChatApp(app), cookie, chat_ids, args.requests, args.concurrency)),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'path':<6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for path in ('sync', 'async'):
+        row = results[path]
+        print(f"{path:<6} {row['rps']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+if __name__ == '__main__':
+    main()
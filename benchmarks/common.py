@@ -0,0 +1,79 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run `create_app()` against a throwaway SQLite database and the stub LLM
+backend, so they need no network access and leave no state behind.
+"""
+import os
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+# Make the `chatbot` package importable when a script is run directly
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+from chatbot import create_app, db  # noqa: E402
+from chatbot.models import RecentChats, User  # noqa: E402
+
+def make_app(**config):
+    """Creates the app on a temporary database with the stub LLM backend."""
+    directory = tempfile.mkdtemp(prefix='chatbot-bench-')
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        'LLM_BACKEND': 'stub',
+        'LLM_STUB_LATENCY': 0.0,
+        'LLM_MAX_RETRIES': 0,
+        'PURGE_INTERVAL': 0,
+        'ASSETS_DIR': os.path.join(directory, 'assets'),  # The startup asset build stays out of instance/
+        # Benchmarks drive many calls from one user; per-user limits would turn them into 429s
+        'LLM_USER_MAX_QUEUE': 0,
+        'LLM_USER_REQUESTS_PER_MINUTE': 0,
+        'LLM_USER_TOKENS_PER_MINUTE': 0,
+    }
+    settings.update(config)
+    return create_app(settings)
+
+def create_user(app, email='bench@gmail.com', password='bench'):
+    """Creates a user with a password login and returns its id."""
+    with app.app_context():
+        user = User(email=email, name='Bench', password_hash=generate_password_hash(password))
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def create_chats(app, user_id, count, title='Bench chat'):
+    """Creates titled chats (so no background title generation kicks in) and returns their ids."""
+    with app.app_context():
+        chats = [RecentChats(user_id=user_id, title=title) for _ in range(count)]
+        db.session.add_all(chats)
+        db.session.commit()
+        return [chat.recent_id for chat in chats]
+
+def login(client, email='bench@gmail.com', password='bench'):
+    """Logs a test client in and returns the response JSON."""
+    response = client.post('/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+def summarize(latencies, elapsed):
+    """Returns latency percentiles (ms) and throughput for a list of request durations (s)."""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"requests": 0}
+
+    def percentile(p):
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "requests": len(ordered),
+        "rps": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
@@ -0,0 +1,126 @@
+"""
+Measures the bytes sent for repeated chat history loads.
+
+Simulates a user switching between a few chats in the sidebar: every switch loads the
+newest page of the chat with /api/load_chat, and now and then a new message arrives in
+one of them. Three clients are compared:
+
+- `plain` ignores the validators and doesn't accept gzip, like before the change;
+- `gzip` accepts gzip but doesn't revalidate;
+- `revalidate` accepts gzip and sends back the ETag it got, like a browser's HTTP cache.
+
+Bytes are the status line, headers and body as sent by the app, before any transport
+compression a proxy might add.
+
+    python benchmarks/load_chat_bytes.py --chats 5 --messages 200 --switches 200
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from common import create_chats, create_user, login, make_app, summarize
+from chatbot import db
+from chatbot.models import ChatMessages
+
+CLIENTS = {
+    'plain': {'gzip': False, 'revalidate': False},
+    'gzip': {'gzip': True, 'revalidate': False},
+    'revalidate': {'gzip': True, 'revalidate': True},
+}
+
+# Weighted towards common letters, so the text compresses roughly like English
+LETTERS = 'eeeeeeetttttaaaaoooooiiiinnnnsssshhhrrrdddllcumwfgypbvk'
+
+def random_text(rng, length):
+    """Returns roughly `length` characters of made-up words, about as compressible as prose."""
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(''.join(rng.choice(LETTERS) for _ in range(rng.randint(2, 9))))
+    return ' '.join(words)
+
+def add_messages(app, rng, recent_id, count, length):
+    with app.app_context():
+        db.session.execute(insert(ChatMessages), [{
+            'recent_id': recent_id,
+            'sender': 'user' if index % 2 == 0 else 'ai',
+            'message': random_text(rng, length),
+            'timestamp': datetime.utcnow(),
+        } for index in range(count)])
+        db.session.commit()
+
+def response_bytes(response):
+    """Returns the size of a response as the app sent it."""
+    headers = ''.join(f'{key}: {value}\r\n' for key, value in response.headers.items())
+    return len(f'HTTP/1.1 {response.status}\r\n{headers}\r\n'.encode()) + len(response.data)
+
+def run_client(app, cookie, chat_ids, args, gzip, revalidate):
+    """Replays the same sequence of chat switches and new messages with one kind of client."""
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    client.set_cookie('session', cookie)
+    etags = {}
+    latencies, total, not_modified = [], 0, 0
+
+    started = time.perf_counter()
+    for _ in range(args.switches):
+        recent_id = rng.choice(chat_ids)
+        if rng.random() < args.new_message_rate:
+            add_messages(app, rng, recent_id, 1, args.length)
+
+        headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+        if revalidate and recent_id in etags:
+            headers['If-None-Match'] = etags[recent_id]
+        began = time.perf_counter()
+        response = client.get(f'/api/load_chat/{recent_id}', headers=headers)
+        latencies.append(time.perf_counter() - began)
+        assert response.status_code in (200, 304), response.get_data(as_text=True)
+
+        not_modified += response.status_code == 304
+        if response.headers.get('ETag'):
+            etags[recent_id] = response.headers['ETag']
+        total += response_bytes(response)
+
+    result = summarize(latencies, time.perf_counter() - started)
+    result.update({"bytes": total, "bytes_per_load": round(total / args.switches), "not_modified": not_modified})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=5, help="Chats switched between.")
+    parser.add_argument('--messages', type=int, default=200, help="Messages per chat.")
+    parser.add_argument('--length', type=int, default=600, help="Characters per message.")
+    parser.add_argument('--switches', type=int, default=200, help="Chat loads per client.")
+    parser.add_argument('--new-message-rate', type=float, default=0.1, help="Chance that a message arrives before a switch.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    results = {"config": vars(args)}
+    for name, options in CLIENTS.items():
+        # A fresh app per client, so every client sees the same chats and new messages
+        app = make_app()
+        user_id = create_user(app)
+        chat_ids = create_chats(app, user_id, args.chats)
+        rng = random.Random(args.seed)
+        for recent_id in chat_ids:
+            add_messages(app, rng, recent_id, args.messages, args.length)
+        client = app.test_client()
+        login(client)
+        results[name] = run_client(app, client.get_cookie('session').value, chat_ids, args, **options)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = results['plain']['bytes']
+    print(f"{'client':<11} {'bytes':>11} {'per load':>9} {'vs plain':>9} {'304s':>5} {'p50 ms':>7} {'p95 ms':>7}")
+    for name in CLIENTS:
+        row = results[name]
+        print(f"{name:<11} {row['bytes']:>11} {row['bytes_per_load']:>9} {row['bytes'] / baseline:>8.1%} "
+              f"{row['not_modified']:>5} {row['p50_ms']:>7} {row['p95_ms']:>7}")
+
+if __name__ == '__main__':
+    main()
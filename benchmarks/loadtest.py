@@ -0,0 +1,240 @@
+"""
+Load test of the whole chat flow, with the stub model standing in for Gemini.
+
+Every simulated user logs in with their own client and then runs `--sessions` sessions
+of what the browser does: POST /api/new_recent, `--turns` POST /chat turns, POST
+/generate/title with the first reply, POST /save/title and GET /api/load_chat. Users run
+concurrently on threads, like the worker threads of a WSGI server, and `--ramp-up`
+spreads their starts. The stub replies after `--latency` seconds, so the numbers show
+what the app adds around the model.
+
+Reports p50/p95/p99 latency, requests per second and errors per step and overall, SQL
+statements per request, and the process's peak memory. `--output` saves the results as
+JSON, and `--compare` checks them against a saved run: with `--max-regression`, the
+script exits with status 1 when a latency percentile or the throughput got worse by more
+than that many percent.
+
+    python benchmarks/loadtest.py --users 20 --sessions 3 --turns 4 --latency 0.2 --output base.json
+    python benchmarks/loadtest.py --users 20 --sessions 3 --turns 4 --latency 0.2 --compare base.json --max-regression 15
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from common import create_user, make_app, summarize
+from chatbot import db
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+STEPS = ['login', 'new_chat', 'chat', 'generate_title', 'save_title', 'load_chat']
+
+# Percentiles and throughput compared between runs; for rps higher is better
+COMPARED = ['p50_ms', 'p95_ms', 'p99_ms', 'rps']
+
+class Recorder:
+    """Collects request latencies, errors and SQL statement counts per step from many threads."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.total_queries = 0  # Includes statements of background threads, like title workers
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def count_query(self, *args):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+        with self.lock:
+            self.total_queries += 1
+
+    def request(self, client, step, method, url, **kwargs):
+        """Sends one request and records it. Returns the response, or None if it failed."""
+        self.local.queries = 0  # The test client runs the request on this thread
+        began = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - began
+        ok = response.status_code < 400
+        with self.lock:
+            self.latencies[step].append(elapsed)
+            self.queries[step] += self.local.queries
+            if not ok:
+                self.errors[step] += 1
+        return response if ok else None
+
+def run_user(app, recorder, index, args):
+    """Plays one user's sessions through the chat flow."""
+    time.sleep(args.ramp_up * index / max(args.users, 1))
+    client = app.test_client()
+    email = f'load{index}@gmail.com'
+    if not recorder.request(client, 'login', 'POST', '/login', json={'email': email, 'password': 'load'}):
+        return
+
+    for session in range(args.sessions):
+        response = recorder.request(client, 'new_chat', 'POST', '/api/new_recent', json={'title': 'New Chat'})
+        if response is None:
+            continue
+        recent_id = response.get_json()['recent_id']
+
+        first_reply = None
+        for turn in range(args.turns):
+            time.sleep(args.think)
+            response = recorder.request(client, 'chat', 'POST', '/chat', json={
+                'message': f'user {index} session {session} turn {turn}: tell me something',
+                'recent_id': recent_id,
+            })
+            if response is not None and first_reply is None:
+                first_reply = response.get_json()['response']
+
+        if first_reply:
+            response = recorder.request(client, 'generate_title', 'POST', '/generate/title', json={'response': first_reply})
+            title = response.get_json().get('title') if response is not None else None
+            if title:
+                recorder.request(client, 'save_title', 'POST', '/save/title', json={'chat_title': title, 'recent_id': recent_id})
+        recorder.request(client, 'load_chat', 'GET', f'/api/load_chat/{recent_id}')
+
+def memory_report(traced):
+    """Returns the process's peak RSS and, when traced, the peak of Python allocations (MB)."""
+    report = {}
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        report["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    if traced:
+        current, peak = tracemalloc.get_traced_memory()
+        report["python_current_mb"] = round(current / 1024 / 1024, 1)
+        report["python_peak_mb"] = round(peak / 1024 / 1024, 1)
+    return report
+
+def run(args):
+    app = make_app(
+        LLM_STUB_LATENCY=args.latency,
+        LLM_MAX_CONCURRENCY=max(args.users, 1),
+        LLM_MAX_QUEUE=args.users * 4,
+        LLM_QUEUE_TIMEOUT=60,
+    )
+    for index in range(args.users):
+        create_user(app, email=f'load{index}@gmail.com', password='load')
+
+    recorder = Recorder()
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', recorder.count_query)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for future in [pool.submit(run_user, app, recorder, index, args) for index in range(args.users)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    memory = memory_report(args.tracemalloc)
+    if args.tracemalloc:
+        tracemalloc.stop()
+    event.remove(engine, 'before_cursor_execute', recorder.count_query)
+
+    steps = {}
+    for step in STEPS:
+        latencies = recorder.latencies[step]
+        steps[step] = summarize(latencies, elapsed)
+        steps[step]["errors"] = recorder.errors[step]
+        steps[step]["queries_per_request"] = round(recorder.queries[step] / len(latencies), 2) if latencies else None
+    everything = [latency for step in STEPS for latency in recorder.latencies[step]]
+    overall = summarize(everything, elapsed)
+    overall["errors"] = sum(recorder.errors.values())
+    overall["queries_per_request"] = round(sum(recorder.queries.values()) / len(everything), 2) if everything else None
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ('compare', 'output', 'json')},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_s": round(elapsed, 3),
+        "overall": overall,
+        "steps": steps,
+        "db": {"queries": recorder.total_queries},
+        "memory": memory,
+    }
+
+def compare(results, baseline, max_regression=None):
+    """
+    Returns a row per step and metric with the change against a saved run, and the rows
+    that got worse by more than `max_regression` percent.
+    """
+    rows, regressions = [], []
+    for step in ['overall'] + STEPS:
+        current = results['overall'] if step == 'overall' else results['steps'].get(step, {})
+        before = baseline['overall'] if step == 'overall' else baseline.get('steps', {}).get(step, {})
+        for metric in COMPARED:
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if metric == 'rps' else change
+            row = {"step": step, "metric": metric, "baseline": old, "current": new, "change_pct": round(change, 1)}
+            rows.append(row)
+            if max_regression is not None and worse > max_regression:
+                regressions.append(row)
+    return rows, regressions
+
+def print_results(results):
+    print(f"{results['config']['users']} users, {results['elapsed_s']} s, "
+          f"{results['db']['queries']} SQL statements, memory {results['memory']}")
+    print(f"{'step':<15} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7}")
+    for step in STEPS + ['overall']:
+        row = results['overall'] if step == 'overall' else results['steps'][step]
+        if not row['requests']:
+            continue
+        print(f"{step:<15} {row['requests']:>8} {row['errors']:>6} {row['rps']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['queries_per_request']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help="Concurrent simulated users.")
+    parser.add_argument('--sessions', type=int, default=3, help="Chats each user goes through.")
+    parser.add_argument('--turns', type=int, default=4, help="Messages sent per chat.")
+    parser.add_argument('--latency', type=float, default=0.2, help="Stub model latency in seconds.")
+    parser.add_argument('--think', type=float, default=0.0, help="Seconds a user waits before each message.")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="Seconds over which the users start.")
+    parser.add_argument('--tracemalloc', action='store_true', help="Also report Python allocations (slows the run down).")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--compare', help="Compare with the results of a previous run.")
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help="With --compare, exit with status 1 if a metric got worse by more than this many percent.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    results = run(args)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        results["comparison"], regressions = compare(results, baseline, args.max_regression)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+        if args.compare:
+            print(f"\nAgainst {args.compare}:")
+            print(f"{'step':<15} {'metric':<7} {'baseline':>10} {'current':>10} {'change':>8}")
+            for row in results["comparison"]:
+                flag = '  <- regression' if row in regressions else ''
+                print(f"{row['step']:<15} {row['metric']:<7} {row['baseline']:>10} {row['current']:>10} "
+                      f"{row['change_pct']:>+7.1f}%{flag}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Storage micro-benchmark: query plans and latency before and after the storage tuning.
+
+Seeds a SQLite database with many chats and messages twice: once without the chat
+indexes and with the default rollback journal (`baseline`), once with the indexes and
+WAL (`tuned`). It then times the hot queries and a chat turn write on each.
+
+    python benchmarks/storage_bench.py --users 50 --chats 2000 --messages 50
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from common import make_app, summarize
+from chatbot import db
+from chatbot.models import ChatMessages, RecentChats, User
+from chatbot.views import messages_before
+
+VARIANTS = {
+    'baseline': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL'},
+    'tuned': {},
+}
+
+def seed(users, chats, messages):
+    """Bulk-inserts users, chats spread over them and messages per chat."""
+    db.session.execute(insert(User), [{'email': f'user{i}@gmail.com', 'name': f'User {i}'} for i in range(users)])
+    start = datetime(2024, 1, 1)
+    db.session.execute(insert(RecentChats), [
+        {'user_id': i % users + 1, 'title': f'Chat {i}', 'recent_time': start + timedelta(minutes=i)}
+        for i in range(chats)
+    ])
+    batch = []
+    for index in range(chats * messages):
+        # Interleave chats like real traffic, so one chat's messages are spread over the table
+        batch.append({
+            'recent_id': index % chats + 1,
+            'sender': 'user' if index // chats % 2 == 0 else 'ai',
+            'message': f'message {index} ' * 8,
+            'timestamp': start + timedelta(seconds=index),
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(ChatMessages), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(ChatMessages), batch)
+    db.session.commit()
+
+def query_plan(query):
+    """Returns SQLite's query plan for an ORM query."""
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+def timed(func, runs):
+    """Runs `func` `runs` times and summarizes the durations."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        began = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - started)
+
+def run_variant(name, args):
+    app = make_app(**VARIANTS[name])
+    with app.app_context():
+        if name == 'baseline':
+            db.session.execute(text('DROP INDEX IF EXISTS ix_chat_messages_recent_id_id'))
+            db.session.execute(text('DROP INDEX IF EXISTS ix_recent_chats_user_id_recent_time'))
+            db.session.commit()
+        seed(args.users, args.chats, args.messages)
+
+        def history_query(recent_id):
+            return ChatMessages.query.filter_by(recent_id=recent_id).order_by(ChatMessages.id.desc()).limit(51)
+
+        def chat_list_query(user_id):
+            return RecentChats.query.filter_by(user_id=user_id).order_by(RecentChats.recent_time.desc()).limit(20)
+
+        def write_turn():
+            recent_id = random.randint(1, args.chats)
+            messages = [ChatMessages(recent_id=recent_id, sender=sender, message='benchmark turn') for sender in ('user', 'ai')]
+            if name == 'baseline':
+                # Previous behaviour: one commit per message
+                for message in messages:
+                    db.session.add(message)
+                    db.session.commit()
+            else:
+                db.session.add_all(messages)
+                db.session.commit()
+
+        return {
+            "journal_mode": db.session.execute(text('PRAGMA journal_mode')).scalar(),
+            "plans": {
+                "load_chat": query_plan(history_query(1)),
+                "chat_list": query_plan(chat_list_query(1)),
+            },
+            "load_chat": timed(lambda: messages_before(random.randint(1, args.chats)), args.queries),
+            "chat_list": timed(lambda: chat_list_query(random.randint(1, args.users)).all(), args.queries),
+            "chat_turn_write": timed(write_turn, args.queries),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50, help="Messages per chat.")
+    parser.add_argument('--queries', type=int, default=200, help="Timed runs per operation.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    results = {"config": vars(args), **{name: run_variant(name, args) for name in VARIANTS}}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in VARIANTS:
+        result = results[name]
+        print(f"{name} (journal_mode={result['journal_mode']})")
+        for query, plan in result['plans'].items():
+            print(f"  plan {query:<10} {'; '.join(plan)}")
+        for operation in ('load_chat', 'chat_list', 'chat_turn_write'):
+            row = result[operation]
+            print(f"  {operation:<16} p50 {row['p50_ms']:>8} ms  p95 {row['p95_ms']:>8} ms")
+
+if __name__ == '__main__':
+    main()
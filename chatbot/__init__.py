@@ -6,7 +6,20 @@ from flask_login import LoginManager
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
 import os
-from flask_sse import sse
+from .archive import archive_cli
+from .assets import Assets, assets_cli
+from .chat_list import ChatListCache
+from .compression import Compress
+from .events import EventBroker, stream
+from .history import history_cli
+from .identity import IdentityCache
+from .llm import LLM
+from .metrics import Metrics
+from .profiler import Profiler, profile_cli
+from .purge import Purger, chats_cli
+from .search import search_cli
+from .storage import engine_options, init_storage
+from .titles import TitleWorker, titles_cli
 
 # Initialize the database, migration, and other extensions
 db = SQLAlchemy()
@@ -15,25 +28,137 @@ load_dotenv()
 
 DB_NAME = 'database.db'
 
+# Alembic migrations, found independently of the working directory
+MIGRATIONS_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'migrations')
+
+# Revision matching the schema of databases created before migrations were added
+INITIAL_REVISION = '1a2b3c4d5e6f'
+
 # Initialize OAuth for authentication
 oauth = OAuth()
 
-def create_app():
+# Initialize the LLM backend layer used for all model calls
+llm = LLM()
+
+# Initialize the background worker pool for chat titles
+title_worker = TitleWorker()
+purger = Purger()
+chat_list = ChatListCache()
+identity = IdentityCache()
+metrics = Metrics()
+profiler = Profiler()
+assets = Assets()
+compress = Compress()
+
+# Initialize the Server-Sent Events broker (in-process, or Redis across processes)
+events = EventBroker()
+
+def create_app(test_config=None):
     """
     Create and configure the Flask app with all necessary extensions.
+
+    `test_config` overrides the configuration loaded from the environment, e.g. to point
+    benchmarks at a temporary database and the stub LLM backend.
     """
     app = Flask(__name__)
 
     # Set configuration variables from environment variables
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')  # Secret key for session management
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'  # URI for the SQLite database
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{DB_NAME}')  # URI for the database (SQLite by default)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Disable modification tracking (optional)
-    app.config["REDIS_URL"] = "redis://localhost:6379/0"  # Redis URL for Server-Sent Events (SSE)
-    
+    app.config['REDIS_URL'] = os.getenv('REDIS_URL')  # Redis URL for fanning Server-Sent Events out across processes
+    app.config['EVENTS_BACKEND'] = os.getenv('EVENTS_BACKEND', 'redis' if app.config['REDIS_URL'] else 'memory')  # 'memory' (single process) or 'redis'
+    app.config['EVENTS_QUEUE_SIZE'] = int(os.getenv('EVENTS_QUEUE_SIZE', 100))  # Events buffered per client before the oldest are dropped
+    app.config['EVENTS_HEARTBEAT'] = float(os.getenv('EVENTS_HEARTBEAT', 15))  # Seconds between keep-alive comments on idle streams
+    app.config['CHAT_PAGE_SIZE'] = int(os.getenv('CHAT_PAGE_SIZE', 50))  # Messages per page in chat history responses
+    app.config['CHAT_PAGE_MAX_SIZE'] = int(os.getenv('CHAT_PAGE_MAX_SIZE', 200))  # Upper bound for client-requested page sizes
+    app.config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))  # Estimated tokens of history sent with each message
+    app.config['CONTEXT_SUMMARY_TOKENS'] = int(os.getenv('CONTEXT_SUMMARY_TOKENS', 300))  # Target size of the rolling chat summary
+
+    # LLM backend settings ('gemini' or the deterministic offline 'stub' backend)
+    app.config['LLM_BACKEND'] = os.getenv('LLM_BACKEND', 'gemini')
+    app.config['LLM_API_KEY'] = os.getenv('API_KEY')  # API key for Google Generative AI
+    app.config['LLM_MODEL'] = os.getenv('LLM_MODEL', 'gemini-1.5-flash')
+    app.config['LLM_TIMEOUT'] = float(os.getenv('LLM_TIMEOUT', 60))  # Seconds before an upstream call is abandoned
+    app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', 2))  # Retries for transient upstream errors
+    app.config['LLM_MAX_CONCURRENCY'] = int(os.getenv('LLM_MAX_CONCURRENCY', 8))  # Upstream calls in flight at once
+    app.config['LLM_MAX_QUEUE'] = int(os.getenv('LLM_MAX_QUEUE', 32))  # Calls allowed to wait for a slot before 503s
+    app.config['LLM_QUEUE_TIMEOUT'] = float(os.getenv('LLM_QUEUE_TIMEOUT', 10))  # Seconds a call may wait for a slot
+    app.config['LLM_ASYNC_MAX_CONCURRENCY'] = int(os.getenv('LLM_ASYNC_MAX_CONCURRENCY', 64))  # Upstream calls in flight on the async path
+    app.config['LLM_ASYNC_MAX_QUEUE'] = int(os.getenv('LLM_ASYNC_MAX_QUEUE', 512))  # Async calls allowed to wait for a slot
+    app.config['LLM_USER_MAX_QUEUE'] = int(os.getenv('LLM_USER_MAX_QUEUE', 4))  # Calls one user may have waiting for a slot (0 for no limit)
+    app.config['LLM_USER_REQUESTS_PER_MINUTE'] = int(os.getenv('LLM_USER_REQUESTS_PER_MINUTE', 20))  # Model calls per user per minute (0 for no limit)
+    app.config['LLM_USER_TOKENS_PER_MINUTE'] = int(os.getenv('LLM_USER_TOKENS_PER_MINUTE', 60000))  # Estimated prompt and reply tokens per user per minute (0 for no limit)
+    app.config['LLM_STUB_LATENCY'] = float(os.getenv('LLM_STUB_LATENCY', 0))  # Simulated latency of the stub backend
+
+    # Opt-in cache of model replies keyed on the normalized prompt
+    app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))  # In-memory LRU size
+    app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 3600))  # Seconds a cached reply stays valid
+    app.config['RESPONSE_CACHE_DB'] = os.getenv('RESPONSE_CACHE_DB')  # Optional SQLite file shared between processes
+    app.config['TITLE_WORKERS'] = int(os.getenv('TITLE_WORKERS', 2))  # Background threads generating chat titles
+    app.config['ASYNC_DB_WORKERS'] = int(os.getenv('ASYNC_DB_WORKERS', 8))  # Threads running DB work for the async chat path
+    app.config['CHAT_LIST_PAGE_SIZE'] = int(os.getenv('CHAT_LIST_PAGE_SIZE', 30))  # Chats per sidebar page
+    app.config['CHAT_LIST_PAGE_MAX_SIZE'] = int(os.getenv('CHAT_LIST_PAGE_MAX_SIZE', 100))  # Upper bound for the `limit` parameter
+    app.config['CHAT_LIST_CACHE_ENTRIES'] = int(os.getenv('CHAT_LIST_CACHE_ENTRIES', 4096))  # Users whose first sidebar page is cached
+    app.config['CHAT_LIST_CACHE_TTL'] = int(os.getenv('CHAT_LIST_CACHE_TTL', 300))  # Seconds a cached sidebar page is served
+    app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR')  # Directory of archive segments (defaults to instance/archive)
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))  # Days without activity before a chat is archived
+    app.config['ARCHIVE_CODEC'] = os.getenv('ARCHIVE_CODEC', 'zlib')  # 'zlib' or 'lzma' (smaller, slower)
+    app.config['ARCHIVE_BATCH_SIZE'] = int(os.getenv('ARCHIVE_BATCH_SIZE', 100))  # Chats archived per transaction
+    app.config['ARCHIVE_SEGMENT_MAX_BYTES'] = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', 64 * 1024 * 1024))  # Size at which a new segment is started
+    app.config['HISTORY_BATCH_SIZE'] = int(os.getenv('HISTORY_BATCH_SIZE', 1000))  # Rows per fetch when exporting and per transaction when importing
+    app.config['USER_CACHE_ENABLED'] = os.getenv('USER_CACHE_ENABLED', 'true').lower() == 'true'  # Cache user snapshots for Flask-Login across requests
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 300))  # Seconds a cached user is trusted; changes made by another process (even deletes) show up only after this
+    app.config['USER_CACHE_MAX_ENTRIES'] = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+    app.config['PURGE_INTERVAL'] = int(os.getenv('PURGE_INTERVAL', 3600))  # Seconds between purges of empty/stale chats (0 disables)
+    app.config['PURGE_BATCH_SIZE'] = int(os.getenv('PURGE_BATCH_SIZE', 500))  # Chats deleted per purge transaction
+    app.config['PURGE_EMPTY_AFTER'] = int(os.getenv('PURGE_EMPTY_AFTER', 3600))  # Seconds before a chat without messages is purged
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # Record request, SQL and LLM metrics for /metrics
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')  # Bearer token required to scrape /metrics (only localhost may scrape when unset)
+    app.config['PROFILE_REQUESTS'] = os.getenv('PROFILE_REQUESTS', 'false').lower() == 'true'  # Profile every request (otherwise only those sending a signed PROFILE_HEADER)
+    app.config['PROFILE_TOP_N'] = int(os.getenv('PROFILE_TOP_N', 30))  # Functions kept per profile, by cumulative time
+    app.config['PROFILE_MAX_ENTRIES'] = int(os.getenv('PROFILE_MAX_ENTRIES', 50))  # Profiles kept in memory
+    app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))  # SQL statements slower than this are logged (0 disables)
+    app.config['ADMIN_EMAILS'] = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}  # Users allowed into /admin
+    app.config['PURGE_STALE_AFTER_DAYS'] = int(os.getenv('PURGE_STALE_AFTER_DAYS', 0))  # Days without activity before a chat is purged (0 keeps them)
+    app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'  # Gzip JSON responses for clients that accept it
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # Smaller bodies are sent as they are
+
+    # Fingerprinted static assets (see chatbot/assets.py)
+    app.config['ASSETS_ENABLED'] = os.getenv('ASSETS_ENABLED', 'true').lower() == 'true'  # Serve static files under content-hashed, long-cached URLs
+    app.config['ASSETS_DIR'] = os.getenv('ASSETS_DIR')  # Directory of built assets (defaults to instance/assets)
+    app.config['ASSETS_BUILD_ON_STARTUP'] = os.getenv('ASSETS_BUILD_ON_STARTUP', 'true').lower() == 'true'  # Build at startup; turn off to ship a build from `flask assets build`
+    app.config['ASSETS_MAX_AGE'] = int(os.getenv('ASSETS_MAX_AGE', 365 * 24 * 3600))  # Cache lifetime of hashed assets in seconds
+
+    # SQLite connection tuning, and pool settings for other databases
+    app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')  # WAL lets readers run while a write is in progress
+    app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # NORMAL is durable across app crashes in WAL mode
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))  # Milliseconds to wait for a lock
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+
+    if test_config:
+        app.config.update(test_config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+
     # Initialize extensions with the Flask app
     db.init_app(app)
-    migrate.init_app(app, db)
+    init_storage(app, db)  # Apply SQLite pragmas to every new connection
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR)
     oauth.init_app(app)  # Initialize OAuth for Google authentication
+    llm.init_app(app)  # Initialize the model backend, client pool and concurrency limits
+    events.init_app(app)  # Initialize the Server-Sent Events broker
+    title_worker.init_app(app)  # Initialize the background title generation pool
+    purger.init_app(app)  # Start the periodic purge of empty and stale chats
+    chat_list.init_app(app)  # Initialize the per-user sidebar cache
+    identity.init_app(app)  # Initialize the user identity cache used by load_user
+    metrics.init_app(app)  # Record request, SQL and LLM metrics and serve them on /metrics
+    profiler.init_app(app)  # Profile opted-in requests and log slow queries
+    assets.init_app(app)  # Build or load the fingerprinted static assets served from /assets
+    compress.init_app(app)  # Gzip large JSON responses
 
     # Register Google OAuth client
     oauth.register(
@@ -45,13 +170,24 @@ def create_app():
     )
 
     # Register Server-Sent Events (SSE) blueprint
-    app.register_blueprint(sse, url_prefix='/stream')
+    app.register_blueprint(stream, url_prefix='/stream')
 
     # Import and register Blueprints for views and authentication
     from .views import views
     from .auth import auth
+    from .admin import admin
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
+    app.register_blueprint(admin, url_prefix='/admin')
+
+    # Register command line tools
+    app.cli.add_command(titles_cli)
+    app.cli.add_command(chats_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(profile_cli)
+    app.cli.add_command(history_cli)
+    app.cli.add_command(assets_cli)
 
     # Create the database if it doesn't exist
     create_database(app)
@@ -64,15 +200,32 @@ def create_app():
     # Load user function to prevent circular imports
     @login_manager.user_loader
     def load_user(user_id):
-        from .models import User  # Import inside function to avoid circular import
-        return User.query.get(int(user_id))
+        return identity.load(int(user_id))  # Memoized per request and cached across requests
 
     return app
 
 def create_database(app):
     """
     Create the database if it doesn't exist yet. This is a one-time setup.
+
+    A new database gets every table from the models and is stamped with the latest
+    migration, so `flask db upgrade` only applies migrations added later. Databases the
+    migrations don't track yet are left alone: they must be stamped with the initial
+    revision and upgraded, see the README.
     """
-    if not path.exists('chatbot/' + DB_NAME):
-        with app.app_context():
-            db.create_all()  # Create tables for all models if they don't exist yet
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from sqlalchemy import inspect
+
+    with app.app_context():
+        tables = set(inspect(db.engine).get_table_names())
+        if 'alembic_version' in tables:
+            return  # Managed by `flask db upgrade`
+        if tables & set(db.metadata.tables):
+            app.logger.warning("The database schema isn't tracked by migrations; run "
+                               "`flask db stamp %s` and `flask db upgrade`", INITIAL_REVISION)
+            return
+
+        db.create_all()  # Create tables for all models
+        with db.engine.begin() as connection:
+            MigrationContext.configure(connection).stamp(ScriptDirectory(MIGRATIONS_DIR), 'head')
@@ -0,0 +1,27 @@
+from flask import Blueprint, abort, current_app, render_template
+from flask_login import current_user
+from chatbot import profiler
+
+# Initialize the admin blueprint, restricted to the users listed in ADMIN_EMAILS
+admin = Blueprint('admin', __name__)
+
+@admin.before_request
+def require_admin():
+    """Sends anonymous users to the login page and rejects everyone who isn't an admin."""
+    if not current_user.is_authenticated:
+        return current_app.login_manager.unauthorized()
+    if (current_user.email or '').lower() not in current_app.config['ADMIN_EMAILS']:
+        abort(403)
+
+@admin.route('/profiles')
+def profiles():
+    """Lists recent request profiles and slow queries."""
+    return render_template('admin_profiles.html', profiles=profiler.profiles(), slow_queries=profiler.slow_queries())
+
+@admin.route('/profiles/<request_id>')
+def profile(request_id):
+    """Shows the slowest functions of one profiled request."""
+    found = profiler.get(request_id)
+    if found is None:
+        abort(404)
+    return render_template('admin_profile.html', profile=found)
@@ -0,0 +1,280 @@
+"""
+Cold storage for idle chats.
+
+Chats without activity for ARCHIVE_AFTER_DAYS days have their messages moved into
+compressed, append-only segment files and deleted from the database. The RecentChats
+row stays as a stub holding the segment name, offset and length of the chat's record,
+so the sidebar still lists it; each segment also gets a sidecar `.idx` file with the
+same offsets, so records can be found without the database. When an archived chat is
+opened or written to, its messages are restored with their original ids and timestamps.
+
+Segments are never rewritten: records of restored or deleted chats stay in place.
+`flask archive run` archives in bounded batches and `flask archive report` shows the
+space used and reclaimed.
+"""
+import json
+import lzma
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: segments are only locked within the process
+    fcntl = None
+
+# Compressors by segment file extension, so segments stay readable when ARCHIVE_CODEC changes
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# Serializes appends from threads of one process; fcntl locks cover other processes
+_append_lock = threading.Lock()
+
+def archive_dir():
+    """Returns the directory holding the segment files, creating it if needed."""
+    directory = current_app.config['ARCHIVE_DIR'] or os.path.join(current_app.instance_path, 'archive')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def current_segment(directory, codec):
+    """Returns the name of the segment to append to, starting a new one when the last is full."""
+    segments = sorted(name for name in os.listdir(directory) if name.endswith('.' + codec))
+    if segments:
+        last = segments[-1]
+        if os.path.getsize(os.path.join(directory, last)) < current_app.config['ARCHIVE_SEGMENT_MAX_BYTES']:
+            return last
+        number = int(last.split('-')[1].split('.')[0]) + 1
+    else:
+        number = 1
+    return f"segment-{number:06d}.{codec}"
+
+def append_record(recent_id, payload):
+    """
+    Compresses and appends one chat's record to the current segment.
+
+    Returns (segment, offset, length). The data is flushed to disk before returning, so a
+    stub never points at bytes that may be lost.
+    """
+    codec = current_app.config['ARCHIVE_CODEC']
+    compress, _ = CODECS[codec]
+    data = compress(payload)
+    directory = archive_dir()
+
+    with _append_lock:
+        segment = current_segment(directory, codec)
+        with open(os.path.join(directory, segment), 'ab') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            with open(os.path.join(directory, segment + '.idx'), 'a') as index:
+                index.write(f"{recent_id} {offset} {len(data)}\n")
+    return segment, offset, len(data)
+
+def read_record(segment, offset, length):
+    """Reads and decompresses one record."""
+    _, decompress = CODECS[segment.rsplit('.', 1)[1]]
+    with open(os.path.join(archive_dir(), segment), 'rb') as f:
+        f.seek(offset)
+        return decompress(f.read(length))
+
+def serialize_messages(messages):
+    """Encodes a chat's messages as the JSON payload of a record."""
+    return json.dumps([{
+        "id": msg.id,
+        "sender": msg.sender,
+        "message": msg.message,
+        "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
+    } for msg in messages]).encode()
+
+def archivable_chats(limit, before):
+    """Returns up to `limit` unarchived chats whose newest message is older than `before`."""
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    has_messages = (db.session.query(ChatMessages.id)
+                    .filter(ChatMessages.recent_id == RecentChats.recent_id)
+                    .exists())
+    recent_activity = (db.session.query(ChatMessages.id)
+                       .filter(ChatMessages.recent_id == RecentChats.recent_id, ChatMessages.timestamp >= before)
+                       .exists())
+    return (RecentChats.query
+            .filter(RecentChats.archive_segment.is_(None), has_messages, ~recent_activity)
+            .order_by(RecentChats.recent_id)
+            .limit(limit)
+            .all())
+
+def archive_batch(batch_size, before):
+    """
+    Archives one batch of idle chats in one transaction.
+
+    Returns (chats archived, bytes of message text removed, compressed bytes written).
+    """
+    from chatbot import db
+    from chatbot.models import ChatMessages
+
+    archived = raw_bytes = stored_bytes = 0
+    for recent_chat in archivable_chats(batch_size, before):
+        messages = (ChatMessages.query.filter_by(recent_id=recent_chat.recent_id)
+                    .order_by(ChatMessages.id).all())
+        segment, offset, length = append_record(recent_chat.recent_id, serialize_messages(messages))
+
+        recent_chat.archive_segment = segment
+        recent_chat.archive_offset = offset
+        recent_chat.archive_length = length
+        recent_chat.archived_at = datetime.utcnow()
+        # Only the archived messages go, in case one arrived while the record was written
+        (ChatMessages.query
+         .filter(ChatMessages.recent_id == recent_chat.recent_id, ChatMessages.id <= messages[-1].id)
+         .delete(synchronize_session=False))
+
+        archived += 1
+        raw_bytes += sum(len(msg.message.encode()) for msg in messages)
+        stored_bytes += length
+    db.session.commit()
+    return archived, raw_bytes, stored_bytes
+
+def restore_chat(recent_chat):
+    """
+    Moves an archived chat's messages back into the database. Returns True if it did.
+
+    The stub is claimed with a conditional update first, so concurrent requests for the
+    same chat restore it only once.
+    """
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    segment = recent_chat.archive_segment
+    if segment is None:
+        return False
+    records = json.loads(read_record(segment, recent_chat.archive_offset, recent_chat.archive_length))
+
+    claimed = (RecentChats.query
+               .filter_by(recent_id=recent_chat.recent_id, archive_segment=segment)
+               .update({'archive_segment': None, 'archive_offset': None,
+                        'archive_length': None, 'archived_at': None}, synchronize_session=False))
+    if not claimed:
+        db.session.rollback()
+        db.session.refresh(recent_chat)
+        return False
+
+    rows = [{
+        "id": record["id"],
+        "recent_id": recent_chat.recent_id,
+        "sender": record["sender"],
+        "message": record["message"],
+        "timestamp": datetime.fromisoformat(record["timestamp"]) if record["timestamp"] else None,
+    } for record in records]
+    if taken_ids([row["id"] for row in rows]):
+        renumber(recent_chat, rows)
+    else:
+        db.session.execute(insert(ChatMessages), rows)
+    db.session.commit()
+    return True
+
+def taken_ids(ids, chunk_size=500):
+    """Returns which of `ids` are used by messages in the database."""
+    from chatbot import db
+    from chatbot.models import ChatMessages
+
+    taken = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        taken.update(db.session.execute(select(ChatMessages.id).where(ChatMessages.id.in_(chunk))).scalars())
+    return taken
+
+def renumber(recent_chat, rows):
+    """
+    Inserts a chat's restored messages under new ids, in their original order.
+
+    Only needed when the ids were given to other messages while the chat was archived,
+    which databases from before chat_messages used AUTOINCREMENT allowed. The summary
+    boundary is moved to the new id of the last message it covered.
+    """
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    old_ids = [row.pop("id") for row in rows]
+    new_ids = db.session.execute(
+        insert(ChatMessages).returning(ChatMessages.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    upto = recent_chat.summary_upto_id
+    if upto is not None:
+        upto = max((new for old, new in zip(old_ids, new_ids) if old <= upto), default=None)
+        (RecentChats.query.filter_by(recent_id=recent_chat.recent_id)
+         .update({'summary_upto_id': upto}, synchronize_session=False))
+    current_app.logger.warning("Restored chat %s under new message ids; its old ids were reused",
+                               recent_chat.recent_id)
+
+def ensure_restored(recent_id):
+    """Restores a chat if it is archived; call before reading or adding its messages."""
+    from chatbot import db
+    from chatbot.models import RecentChats
+
+    recent_chat = db.session.get(RecentChats, recent_id)
+    if recent_chat is not None and recent_chat.archive_segment is not None:
+        restore_chat(recent_chat)
+
+def archive(config, max_batches=0):
+    """Archives idle chats in batches. Returns the totals of `archive_batch`."""
+    before = datetime.utcnow() - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+    batches = 0
+    totals = [0, 0, 0]
+    while not max_batches or batches < max_batches:
+        result = archive_batch(config['ARCHIVE_BATCH_SIZE'], before)
+        if not result[0]:
+            break
+        batches += 1
+        totals = [total + value for total, value in zip(totals, result)]
+    return tuple(totals)
+
+def space_report():
+    """Returns the archived chat count, segment sizes and database space freed for reuse."""
+    from chatbot import db
+    from chatbot.models import RecentChats
+
+    directory = archive_dir()
+    segments = [name for name in os.listdir(directory) if name.rsplit('.', 1)[-1] in CODECS]
+    report = {
+        "archived_chats": RecentChats.query.filter(RecentChats.archive_segment.isnot(None)).count(),
+        "segments": len(segments),
+        "segment_bytes": sum(os.path.getsize(os.path.join(directory, name)) for name in segments),
+    }
+    if db.engine.dialect.name == 'sqlite':
+        page_size = db.session.execute(db.text('PRAGMA page_size')).scalar()
+        free_pages = db.session.execute(db.text('PRAGMA freelist_count')).scalar()
+        report["database_bytes"] = page_size * db.session.execute(db.text('PRAGMA page_count')).scalar()
+        report["reusable_bytes"] = page_size * free_pages  # Freed pages; VACUUM returns them to the filesystem
+    return report
+
+archive_cli = AppGroup('archive', help="Move idle chats to compressed cold storage.")
+
+@archive_cli.command('run')
+@click.option('--batch-size', type=int, default=None, help="Chats archived per transaction (default ARCHIVE_BATCH_SIZE).")
+@click.option('--max-batches', default=0, help="Stop after this many batches (0 means until done).")
+@click.option('--days', type=int, default=None, help="Archive chats idle this many days (default ARCHIVE_AFTER_DAYS).")
+def run_command(batch_size, max_batches, days):
+    """Archives idle chats and reports the space reclaimed."""
+    config = dict(current_app.config)
+    if batch_size is not None:
+        config['ARCHIVE_BATCH_SIZE'] = batch_size
+    if days is not None:
+        config['ARCHIVE_AFTER_DAYS'] = days
+    chats, raw_bytes, stored_bytes = archive(config, max_batches)
+    click.echo(f"Archived {chats} chats: {raw_bytes} bytes of messages stored as {stored_bytes} compressed bytes")
+
+@archive_cli.command('report')
+def report_command():
+    """Shows archive and database space usage."""
+    for key, value in space_report().items():
+        click.echo(f"{key}: {value}")
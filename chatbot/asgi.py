@@ -0,0 +1,166 @@
+"""
+ASGI application with an asyncio path for the LLM-bound endpoints.
+
+POST /chat and POST /generate/title are served on the event loop: the model is called
+through the async API and database work runs on a small thread pool inside a Flask
+request context, so the same view helpers, session and login handling apply. While a
+request waits for the model it holds a suspended coroutine instead of a worker thread,
+so one process can keep hundreds of chats in flight. Every other request is handed to
+the Flask app through asgiref's WSGI adapter.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify, request
+from werkzeug.test import EnvironBuilder
+from chatbot import llm, views
+from chatbot.llm import LLMError
+from chatbot.titles import build_title_prompt
+
+async def read_body(receive):
+    """Reads the full request body from an ASGI receive channel."""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+def build_environ(scope, body):
+    """Builds a WSGI environ for an ASGI HTTP scope, so Flask can open a request context for it."""
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    client = scope.get('client')
+    return EnvironBuilder(
+        path=scope['path'],
+        method=scope['method'],
+        headers=headers,
+        data=body,
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+        environ_base={
+            'REMOTE_ADDR': client[0] if client else None,
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+        },
+    ).get_environ()
+
+async def send_response(send, response):
+    """Sends a Flask response over an ASGI send channel."""
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+def save_user_message(turn):
+    """Saves only the user's message of a turn whose model call failed."""
+    user_message, _ = views.save_turn(turn, None)
+    return {"id": user_message.id}
+
+class AsyncChatApp:
+    """
+    ASGI app serving the chat endpoints asynchronously in front of the Flask app.
+
+    Attributes:
+        app (Flask): The Flask application everything else is delegated to.
+        executor (ThreadPoolExecutor): Threads running blocking database work.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_DB_WORKERS'], thread_name_prefix='async-db')
+        self.routes = {
+            ('POST', '/chat'): self.chat,
+            ('POST', '/generate/title'): self.generate_title,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+
+        # These requests skip Flask's request hooks, so they are recorded here
+        metrics = self.app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.request_started()
+        started = time.perf_counter()
+        status = 500
+        try:
+            body = await read_body(receive)
+            environ = build_environ(scope, body)
+            with self.app.app_context():
+                try:
+                    response = await handler(environ, body)
+                except LLMError as e:
+                    response = views.llm_error_response(e)
+                except Exception as e:
+                    self.app.logger.exception("Async request to %s failed", scope['path'])
+                    response = jsonify({"success": False, "error": str(e)})
+                    response.status_code = 500
+            status = response.status_code
+            await send_response(send, response)
+        finally:
+            if metrics is not None:
+                metrics.request_finished(scope['path'], scope['method'], status, time.perf_counter() - started)
+
+    async def lifespan(self, receive, send):
+        """Handles ASGI startup and shutdown events."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def in_request(self, environ, func, *args):
+        """
+        Runs `func` on the database executor inside a Flask request context for `environ`.
+
+        Anything other than a dict is converted into a Flask response inside the context.
+        """
+        def run():
+            with self.app.request_context(environ):
+                result = func(*args)
+                return result if isinstance(result, dict) else self.app.make_response(result)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run)
+
+    async def chat(self, environ, body):
+        """Async counterpart of `views.chat`."""
+        turn = await self.in_request(environ, lambda: views.start_chat_turn(request.get_json(), summarize=False))
+        if not isinstance(turn, dict):
+            return turn  # Invalid request
+
+        # Older turns overflowing the budget are summarized here, without holding a database thread
+        summary = None
+        if turn['fold'] is not None:
+            try:
+                summary = (await llm.agenerate(turn['fold']['prompt'], user=turn['user'])).strip()
+            except Exception:
+                # Keep the previous summary; the same turns are retried on the next call
+                self.app.logger.warning("Updating summary of chat %s failed", turn['recent_id'], exc_info=True)
+        views.complete_chat_turn(turn, summary)
+
+        try:
+            ai_reply = await llm.agenerate(turn['contents'], user=turn['user'])
+        except LLMError:
+            # Keep the user's message, like `views.chat` does
+            await self.in_request(environ, save_user_message, turn)
+            raise
+
+        return await self.in_request(environ, views.finish_chat_turn, turn, ai_reply)
+
+    async def generate_title(self, environ, body):
+        """Async counterpart of `views.generate_title`; only loading the caller touches the database."""
+        ai_response = json.loads(body or b'{}').get('response', '')
+        if not ai_response:
+            return jsonify({"success": False, "title": None})
+
+        caller = await self.in_request(environ, lambda: {"user": views.llm_user()})
+        return views.title_response(await llm.agenerate(build_title_prompt(ai_response), user=caller['user']))
@@ -0,0 +1,244 @@
+"""
+Fingerprinted, precompressed static assets.
+
+`flask assets build` (also run at startup while ASSETS_BUILD_ON_STARTUP is on) copies
+every file under the static folder to ASSETS_DIR under a name carrying a hash of its
+content, like `style.3f2a9c01d4.css`, and writes `manifest.json` mapping each original
+name to its hashed one. Text assets get `.gz` and, when the `brotli` package is
+installed, `.br` siblings. When Pillow is installed, PNG and JPEG images are re-encoded
+with optimization and get a WebP variant, each kept only when smaller.
+
+Templates link assets through `asset_url('style.css')`. Hashed files are served from
+/assets with the best encoding the client accepts and a one-year `immutable` cache
+lifetime: a changed file gets a new name, so browsers never need to revalidate. Files
+missing from the manifest fall back to the plain /static URL.
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import click
+from flask import abort, current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:  # Only gzip variants are written
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Images are copied as they are
+    Image = None
+
+# Hex digits of the content hash put into file names
+HASH_LENGTH = 10
+
+# Extensions of text assets worth precompressing
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.map'}
+
+# Pillow formats of the images that get optimized copies and WebP variants
+IMAGE_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+
+# Precompressed variants, in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+MANIFEST = 'manifest.json'
+
+def assets_dir():
+    return current_app.config['ASSETS_DIR'] or os.path.join(current_app.instance_path, 'assets')
+
+def hashed_name(name, data):
+    """Returns `name` with a hash of `data` before its extension."""
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+def write_file(path, data):
+    """Writes a file atomically, so concurrent builds and readers never see half of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+def compress(encoding, data):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, 9, mtime=0)  # mtime=0 keeps the output identical across builds
+
+def optimize_image(data, ext, webp_quality):
+    """Returns (optimized bytes or None, WebP bytes or None), each only if smaller than `data`."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        optimized, webp = io.BytesIO(), io.BytesIO()
+        image.save(optimized, IMAGE_FORMATS[ext], optimize=True)
+        image.save(webp, 'WEBP', quality=webp_quality, method=6)
+    except (OSError, ValueError):  # Unreadable or unsupported image: copy it as it is
+        return None, None
+    return tuple(buffer.getvalue() if buffer.tell() < len(data) else None for buffer in (optimized, webp))
+
+def build_assets(static_folder, output_dir, webp_quality=80):
+    """
+    Writes the hashed files, their variants and the manifest. Returns the manifest.
+
+    Files already built under the same hash are left alone, so rebuilding is cheap.
+    """
+    manifest = {}
+    for directory, _, files in os.walk(static_folder):
+        for filename in sorted(files):
+            source = os.path.join(directory, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            hashed = hashed_name(name, data)
+            target = os.path.join(output_dir, hashed)
+            ext = os.path.splitext(name)[1].lower()
+            entry = {"path": hashed, "size": len(data), "encodings": []}
+
+            if not os.path.exists(target):
+                optimized = webp = None
+                if Image is not None and ext in IMAGE_FORMATS:
+                    optimized, webp = optimize_image(data, ext, webp_quality)
+                    if webp is not None:
+                        write_file(os.path.splitext(target)[0] + '.webp', webp)
+                write_file(target, optimized or data)
+            if os.path.exists(os.path.splitext(target)[0] + '.webp'):
+                entry["webp"] = os.path.splitext(hashed)[0] + '.webp'
+
+            if ext in COMPRESSIBLE:
+                for encoding, suffix in ENCODINGS:
+                    if encoding == 'br' and brotli is None:
+                        continue
+                    if not os.path.exists(target + suffix):
+                        compressed = compress(encoding, data)
+                        if len(compressed) >= len(data):
+                            continue
+                        write_file(target + suffix, compressed)
+                    entry["encodings"].append(encoding)
+
+            manifest[name] = entry
+
+    write_file(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+def stale_files(output_dir, manifest):
+    """Returns the built files the manifest no longer refers to."""
+    current = {MANIFEST}
+    for entry in manifest.values():
+        current.add(entry["path"])
+        current.update(entry["path"] + suffix for encoding, suffix in ENCODINGS if encoding in entry["encodings"])
+        if "webp" in entry:
+            current.add(entry["webp"])
+    stale = []
+    for directory, _, files in os.walk(output_dir):
+        for filename in files:
+            name = os.path.relpath(os.path.join(directory, filename), output_dir).replace(os.sep, '/')
+            if name not in current:
+                stale.append(name)
+    return sorted(stale)
+
+class Assets:
+    """Flask extension serving fingerprinted assets and providing `asset_url` to templates."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_ENABLED', True)
+        app.config.setdefault('ASSETS_DIR', None)
+        app.config.setdefault('ASSETS_BUILD_ON_STARTUP', True)
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.config.setdefault('ASSETS_WEBP_QUALITY', 80)
+        app.extensions['assets'] = {'manifest': {}, 'files': {}}
+        app.add_template_global(asset_url)
+        app.add_template_global(asset_webp_url)
+        app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+        if not app.config['ASSETS_ENABLED']:
+            return
+
+        with app.app_context():
+            output_dir = assets_dir()
+            if app.config['ASSETS_BUILD_ON_STARTUP']:
+                manifest = build_assets(app.static_folder, output_dir, app.config['ASSETS_WEBP_QUALITY'])
+            else:
+                manifest = self.load(output_dir)
+        self.use(app, manifest)
+
+    def load(self, output_dir):
+        """Reads a manifest written by `flask assets build`; without one, /static is used."""
+        path = os.path.join(output_dir, MANIFEST)
+        if not os.path.exists(path):
+            current_app.logger.warning("No asset manifest at %s; run `flask assets build`", path)
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def use(self, app, manifest):
+        files = {entry["path"]: entry for entry in manifest.values()}
+        files.update({entry["webp"]: {"path": entry["webp"], "encodings": []}
+                      for entry in manifest.values() if "webp" in entry})
+        app.extensions['assets'] = {'manifest': manifest, 'files': files}
+
+def asset_url(filename):
+    """Returns the fingerprinted URL of a static file, or its /static URL if it wasn't built."""
+    entry = current_app.extensions['assets']['manifest'].get(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=entry["path"])
+
+def asset_webp_url(filename):
+    """Returns the URL of an image's WebP variant, or None if it has none."""
+    entry = current_app.extensions['assets']['manifest'].get(filename)
+    if entry is None or "webp" not in entry:
+        return None
+    return url_for('assets', filename=entry["webp"])
+
+def serve_asset(filename):
+    """Serves a hashed file, precompressed when the client accepts it, cached for good."""
+    entry = current_app.extensions['assets']['files'].get(filename)
+    if entry is None:
+        abort(404)
+
+    path, encoding = filename, None
+    for candidate, suffix in ENCODINGS:
+        if candidate in entry["encodings"] and candidate in request.accept_encodings:
+            path, encoding = filename + suffix, candidate
+            break
+
+    # The name changes with the content, so the file can be cached without revalidation
+    # The type comes from the original name, not the .br/.gz suffix
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(assets_dir(), path, mimetype=mimetype, max_age=current_app.config['ASSETS_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry["encodings"]:
+        response.vary.add('Accept-Encoding')
+    return response
+
+assets_cli = AppGroup('assets', help="Build fingerprinted static assets.")
+
+@assets_cli.command('build')
+@click.option('--clean', is_flag=True, help="Also delete built files the new manifest no longer refers to.")
+def build_command(clean):
+    """Hashes, precompresses and optimizes the static files into ASSETS_DIR."""
+    output_dir = assets_dir()
+    manifest = build_assets(current_app.static_folder, output_dir, current_app.config['ASSETS_WEBP_QUALITY'])
+    compressed = sum(1 for entry in manifest.values() if entry["encodings"])
+    webp = sum(1 for entry in manifest.values() if "webp" in entry)
+    click.echo(f"Built {len(manifest)} assets into {output_dir} ({compressed} precompressed, {webp} with WebP variants)")
+    if brotli is None:
+        click.echo("brotli is not installed; only gzip variants were written")
+    if Image is None:
+        click.echo("Pillow is not installed; images were copied without optimizing")
+    if clean:
+        stale = stale_files(output_dir, manifest)
+        for name in stale:
+            os.remove(os.path.join(output_dir, name))
+        click.echo(f"Removed {len(stale)} stale files")
@@ -1,8 +1,7 @@
-from flask import Blueprint, flash, redirect, render_template, request, url_for, session, jsonify
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, login_required, logout_user, current_user
-from chatbot.models import RecentChats, db, User, OAuth
-from datetime import datetime
+from chatbot.models import db, User, OAuth
 from . import oauth
 
 # Initialize the authentication blueprint
@@ -44,22 +43,13 @@ def login():
             logout_user()
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
 
-        # Log the user in
+        # Log the user in; their first chat is created when they send its first message
         login_user(user)
-
-        # Create new recent chat
-        new_recent = RecentChats(user_id=user.id, recent_time=datetime.utcnow(), title="New Chat")
-        db.session.add(new_recent)
-        db.session.commit()
-
-        # Set session with recent_id
-        session['user_id'] = user.id
         flash("Logged in successfully", category="success")
 
         return jsonify({
             'success': True,
             'message': 'Login successful',
-            'recent_id': new_recent.recent_id  # Send recent_id for frontend use
         }), 200
 
     return render_template('login.html')
@@ -151,23 +141,16 @@ def google_login():
                 db.session.add(oauth)
                 db.session.commit()
 
-            # Create new recent chat for the user
-            new_recent = RecentChats(user_id=user.id, recent_time=datetime.utcnow(), title="New Chat")
-            db.session.add(new_recent)
-            db.session.commit()
-
-            # Set session with user_id
-            session['user_id'] = user.id
+            # A chat is created when the first message is sent
             flash("Logged in successfully!")
-            return redirect(url_for('auth.handle_google_login', recent_id=new_recent.recent_id))
+            return redirect(url_for('auth.handle_google_login'))
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    except Exception:
+        current_app.logger.exception("Google login failed")
         flash("An error occurred during Google login.", "error")
         return redirect(url_for("auth.login"))
 
 # Handle Google login: Render the page after Google login success
 @auth.route('/handle_google_login')
 def handle_google_login():
-    recent_id = request.args.get('recent_id')
-    return render_template('handle_google_login.html', recent_id=recent_id)
+    return render_template('handle_google_login.html')
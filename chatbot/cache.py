@@ -0,0 +1,229 @@
+"""
+Response cache for model calls.
+
+Replies are cached under a key derived from the normalized prompt and the model
+parameters. Lookups go through a bounded in-memory LRU with TTL, then an optional shared
+SQLite tier; concurrent misses for the same key are coalesced so only one of them calls
+the model.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel for cache misses, so that falsy values can still be cached
+MISSING = object()
+
+def normalize(value):
+    """Collapses whitespace in every string of a prompt so formatting-only differences share a key."""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+def make_key(contents, **params):
+    """Returns the cache key for a prompt and the model parameters it is sent with."""
+    payload = json.dumps({"contents": normalize(contents), "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry time to live."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SQLiteStore:
+    """
+    Shared on-disk cache tier backed by a SQLite file.
+
+    Several processes can point at the same file. A connection is opened per operation so
+    the store can be used from any thread.
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else MISSING
+
+    def set(self, key, value):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl),
+            )
+            # Opportunistically drop expired entries so the file doesn't grow forever
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+
+class _Call:
+    """An in-progress computation that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResponseCache:
+    """
+    Two-tier response cache with single-flight deduplication of concurrent misses.
+
+    Attributes:
+        memory (LRUCache): In-process tier, checked first.
+        store (SQLiteStore): Optional shared tier, checked on memory misses.
+    """
+
+    def __init__(self, memory, store=None):
+        self.memory = memory
+        self.store = store
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """Returns the cached value for `key` from either tier, or MISSING."""
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        if self.store is not None:
+            value = self.store.get(key)
+            if value is not MISSING:
+                self.store_hits += 1
+                self.memory.set(key, value)
+                return value
+        return MISSING
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.store is not None:
+            self.store.set(key, value)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for `key`, calling `compute` on a miss.
+
+        While one caller computes a key, other callers for the same key wait for its
+        result (or its exception) instead of computing it again.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        self.misses += 1
+        try:
+            call.value = compute()
+            self.set(key, call.value)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def aget_or_compute(self, key, compute):
+        """
+        Async variant of `get_or_compute` for use on one event loop.
+
+        `compute` is a coroutine function; concurrent awaits for the same key share it.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = self._tasks[key] = asyncio.ensure_future(compute())
+        try:
+            value = await asyncio.shield(task)
+            self.set(key, value)
+            return value
+        finally:
+            self._tasks.pop(key, None)
+
+    def stats(self):
+        """Returns the hit/miss counters and current size."""
+        lookups = self.hits + self.store_hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.memory),
+        }
@@ -0,0 +1,85 @@
+"""
+Recent chats listing for the sidebar.
+
+The sidebar shows a user's chats newest first, one page at a time: the first page is
+rendered with the chat page and later pages are fetched from /api/recent_chats with a
+keyset cursor. Each user's first page is cached in memory and dropped whenever one of
+their chats is created, renamed or deleted; the TTL bounds how stale another process's
+copy can get.
+"""
+from flask import current_app
+from chatbot.cache import MISSING, LRUCache
+
+class ChatListCache:
+    """Flask extension holding the per-user cache of first sidebar pages."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CHAT_LIST_PAGE_SIZE', 30)
+        app.config.setdefault('CHAT_LIST_PAGE_MAX_SIZE', 100)
+        app.config.setdefault('CHAT_LIST_CACHE_ENTRIES', 4096)
+        app.config.setdefault('CHAT_LIST_CACHE_TTL', 300)
+        app.extensions['chat_list'] = LRUCache(
+            max_entries=app.config['CHAT_LIST_CACHE_ENTRIES'],
+            ttl=app.config['CHAT_LIST_CACHE_TTL'],
+        )
+
+    @property
+    def cache(self):
+        return current_app.extensions['chat_list']
+
+    def invalidate(self, user_id):
+        """Drops a user's cached listing; call after committing a change to their chats."""
+        self.cache.delete(user_id)
+
+def chat_list_size(limit):
+    """Clamps a requested sidebar page size to the configured default and maximum."""
+    if not limit or limit < 1:
+        return current_app.config['CHAT_LIST_PAGE_SIZE']
+    return min(limit, current_app.config['CHAT_LIST_PAGE_MAX_SIZE'])
+
+def serialize_chat(recent_chat):
+    """Converts a chat to the dict sent to the sidebar."""
+    return {
+        "recent_id": recent_chat.recent_id,
+        "title": recent_chat.title,
+        "recent_time": recent_chat.recent_time.isoformat() if recent_chat.recent_time else None,
+    }
+
+def recent_chats_page(user_id, before_id=None, limit=None):
+    """
+    Returns one page of a user's chats, newest first, and whether older chats exist.
+
+    `before_id` continues after that chat. The first page at the default size is served
+    from the cache when possible.
+    """
+    from chatbot import chat_list, db
+    from chatbot.models import RecentChats
+
+    limit = chat_list_size(limit)
+    cacheable = before_id is None and limit == current_app.config['CHAT_LIST_PAGE_SIZE']
+    if cacheable:
+        page = chat_list.cache.get(user_id)
+        if page is not MISSING:
+            return page
+
+    query = RecentChats.query.filter_by(user_id=user_id)
+    if before_id is not None:
+        cursor = RecentChats.query.filter_by(recent_id=before_id, user_id=user_id).first()
+        if cursor is None:
+            return [], False
+        # Keyset on (recent_time, recent_id), so chats created in the same instant aren't skipped
+        query = query.filter(db.or_(
+            RecentChats.recent_time < cursor.recent_time,
+            db.and_(RecentChats.recent_time == cursor.recent_time, RecentChats.recent_id < cursor.recent_id),
+        ))
+    # Fetch one extra row to know whether an older page exists
+    rows = query.order_by(RecentChats.recent_time.desc(), RecentChats.recent_id.desc()).limit(limit + 1).all()
+
+    page = ([serialize_chat(chat) for chat in rows[:limit]], len(rows) > limit)
+    if cacheable:
+        chat_list.cache.set(user_id, page)
+    return page
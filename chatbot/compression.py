@@ -0,0 +1,47 @@
+"""
+Gzip compression of JSON responses.
+
+Responses with a type listed in COMPRESS_MIMETYPES and a body of at least
+COMPRESS_MIN_SIZE bytes are gzipped when the client accepts it. Streamed responses are
+left alone, so chunks still reach the browser as they are generated. A strong ETag is
+weakened on compressed responses, since the bytes no longer match the uncompressed body.
+"""
+import gzip
+from flask import current_app, request
+
+class Compress:
+    """Flask extension gzipping large JSON bodies."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_MIMETYPES', {'application/json'})
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(compress_response)
+
+def compress_response(response):
+    config = current_app.config
+    if (response.mimetype not in config['COMPRESS_MIMETYPES'] or response.is_streamed
+            or response.direct_passthrough or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    # Caches must keep the gzipped and plain bodies apart, even when this one stays plain
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(gzip.compress(data, config['COMPRESS_LEVEL'], mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
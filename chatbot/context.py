@@ -0,0 +1,165 @@
+"""
+Builds the prompt sent to the model from the conversation history.
+
+Recent turns are sent verbatim as long as they fit in the token budget. Turns that no
+longer fit are folded into a rolling summary stored on the RecentChats row. The summary
+is extended incrementally from the last folded message, never regenerated from scratch.
+"""
+import logging
+from chatbot.models import ChatMessages
+
+logger = logging.getLogger(__name__)
+
+# Prompt used to fold older turns into the rolling summary
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Update the summary with the new turns below. Keep every fact, decision and open "
+    "question that later turns may refer to, drop small talk, and answer with the updated "
+    "summary only, in at most {max_words} words.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New turns:\n{transcript}\n"
+)
+
+def estimate_tokens(text):
+    """Roughly estimates the number of tokens in a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def to_content(sender, text):
+    """Converts a stored message into a Gemini `contents` entry."""
+    return {"role": "user" if sender == "user" else "model", "parts": [text]}
+
+class ContextBuilder:
+    """
+    Assembles the `contents` for a model call within a token budget.
+
+    Attributes:
+        generate (callable): Function taking a prompt string and returning the model's text,
+            used to update the rolling summary. It should raise on failure.
+        token_budget (int): Maximum estimated tokens for summary, history and new message.
+        summary_tokens (int): Target size of the rolling summary.
+        retain_ratio (float): Share of the history budget kept verbatim after folding, so
+            the summary is updated every few turns instead of on every turn.
+        fold_tokens (int): Maximum estimated tokens folded into the summary per call.
+    """
+
+    def __init__(self, generate, token_budget=3000, summary_tokens=300, retain_ratio=0.5, fold_tokens=4000):
+        self.generate = generate
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.retain_ratio = retain_ratio
+        self.fold_tokens = fold_tokens
+
+    def build(self, recent_chat, message):
+        """
+        Returns the `contents` list for answering `message` in `recent_chat`.
+
+        The new message must not be stored yet. When older turns overflow the budget the
+        summary on `recent_chat` is updated in the session; the caller commits it together
+        with the rest of the turn.
+        """
+        window, fold = self.prepare(recent_chat, message)
+        if fold is not None:
+            summary = self.summarize(recent_chat, fold["prompt"])
+            if summary:
+                recent_chat.summary = summary
+                recent_chat.summary_upto_id = fold["upto_id"]
+        return assemble_contents(recent_chat.summary, window, message)
+
+    def prepare(self, recent_chat, message):
+        """
+        Does the database work of `build` without calling the model.
+
+        Returns the history window as `contents` entries and the summary update due first,
+        as {"prompt", "upto_id"}, or None when the history fits. Async callers use it to make
+        the summary call themselves and finish with `assemble_contents`.
+        """
+        history_budget = self.token_budget - estimate_tokens(message) - self.summary_tokens
+        window = self._recent_window(recent_chat, history_budget)
+
+        fold = None
+        if self._overflows(recent_chat, window):
+            # Shrink the window so the next few turns fit without another summary update
+            retained = int(history_budget * self.retain_ratio)
+            while window and sum(estimate_tokens(msg.message) for msg in window) > retained:
+                window.pop(0)
+            fold = self._fold(recent_chat, window[0].id if window else None)
+        return [to_content(msg.sender, msg.message) for msg in window], fold
+
+    def summarize(self, recent_chat, prompt):
+        """Returns the model's updated summary, or None if the call failed."""
+        try:
+            return self.generate(prompt).strip()
+        except Exception:
+            # Keep the previous summary; the same turns are retried on the next call
+            logger.warning("Updating summary of chat %s failed", recent_chat.recent_id, exc_info=True)
+            return None
+
+    def _unsummarized(self, recent_chat):
+        """Query over the messages that are not yet part of the summary."""
+        query = ChatMessages.query.filter_by(recent_id=recent_chat.recent_id)
+        if recent_chat.summary_upto_id:
+            query = query.filter(ChatMessages.id > recent_chat.summary_upto_id)
+        return query
+
+    def _recent_window(self, recent_chat, budget):
+        """Returns the newest unsummarized messages that fit in `budget`, oldest first."""
+        window, used = [], 0
+        for msg in self._unsummarized(recent_chat).order_by(ChatMessages.id.desc()).yield_per(50):
+            used += estimate_tokens(msg.message)
+            if used > budget:
+                break
+            window.append(msg)
+        return window[::-1]
+
+    def _overflows(self, recent_chat, window):
+        """Checks whether unsummarized messages exist before the window."""
+        query = self._unsummarized(recent_chat)
+        if window:
+            query = query.filter(ChatMessages.id < window[0].id)
+        return query.first() is not None
+
+    def _fold(self, recent_chat, before_id):
+        """
+        Returns the summary update folding unsummarized messages older than `before_id`
+        into the summary, oldest first, or None if there are none.
+        """
+        query = self._unsummarized(recent_chat)
+        if before_id is not None:
+            query = query.filter(ChatMessages.id < before_id)
+
+        folded, used = [], 0
+        for msg in query.order_by(ChatMessages.id.asc()).yield_per(50):
+            used += estimate_tokens(msg.message)
+            if folded and used > self.fold_tokens:
+                break  # The rest is folded on a later turn
+            folded.append(msg)
+        if not folded:
+            return None
+
+        transcript = "\n".join(f"{'User' if msg.sender == 'user' else 'AI'}: {msg.message}" for msg in folded)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_tokens * 3 // 4,
+            summary=recent_chat.summary or "(empty)",
+            transcript=transcript,
+        )
+        return {"prompt": prompt, "upto_id": folded[-1].id}
+
+def assemble_contents(summary, window, message):
+    """Returns the `contents` for `message` after the rolling summary and the history window."""
+    contents = []
+    if summary:
+        contents.append(to_content('user', f"Summary of our conversation so far:\n{summary}"))
+        contents.append(to_content('ai', "Understood, I will keep that in mind."))
+    contents.extend(window)
+    contents.append(to_content('user', message))
+    return merge_roles(contents)
+
+def merge_roles(contents):
+    """Merges consecutive entries from the same role, as the model expects alternating turns."""
+    merged = []
+    for content in contents:
+        if merged and merged[-1]["role"] == content["role"]:
+            merged[-1]["parts"].extend(content["parts"])
+        else:
+            merged.append({"role": content["role"], "parts": list(content["parts"])})
+    return merged
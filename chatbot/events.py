@@ -0,0 +1,269 @@
+"""
+Server-Sent Events.
+
+Events are published to named channels: `user.<id>` for a user's sidebar (like new chat
+titles) and `chat.<recent_id>` for one chat. Browsers listen through
+GET /stream?channel=..., and only to their own channels.
+
+The broker is pluggable. The in-process broker (EVENTS_BACKEND=memory) needs no other
+service but only reaches browsers connected to the same process. The Redis broker fans
+events out across processes: each process holds one pub/sub connection, subscribed to
+just the channels its own browsers listen on, and delivers events to them locally. The
+Redis client can be injected through EVENTS_REDIS_CLIENT, e.g. to use a local stand-in.
+
+Every subscriber has a bounded queue. When a slow client lets it fill up, its oldest
+events are dropped instead of piling up in memory. Idle streams get a comment line every
+EVENTS_HEARTBEAT seconds, so proxies keep them open and closed connections are noticed.
+"""
+import json
+import threading
+import time
+from collections import deque
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+
+# Seconds the Redis listener waits for a message before applying new (un)subscriptions
+REDIS_POLL_INTERVAL = 0.25
+
+def user_channel(user_id):
+    """Returns the channel that events for a user are published on."""
+    return f"user.{user_id}"
+
+def chat_channel(recent_id):
+    """Returns the channel that events for one chat are published on."""
+    return f"chat.{recent_id}"
+
+def format_event(data, type=None):
+    """Encodes an event in the text/event-stream format, once for all its subscribers."""
+    lines = [f"event: {type}"] if type else []
+    lines.extend(f"data: {line}" for line in json.dumps(data).splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+class Subscription:
+    """A subscriber's bounded queue of encoded events."""
+
+    def __init__(self, broker, channels, max_size):
+        self.broker = broker
+        self.channels = tuple(dict.fromkeys(channels))
+        self.events = deque(maxlen=max_size)
+        self.dropped = 0
+        self.closed = False
+        self._ready = threading.Condition()
+
+    def put(self, event):
+        with self._ready:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1  # The deque drops the oldest event to make room
+                self.broker.dropped += 1
+            self.events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Returns the next event, or None if none arrived within `timeout` seconds."""
+        with self._ready:
+            if not self.events and not self.closed:
+                self._ready.wait(timeout)
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+        self.broker.unsubscribe(self)
+
+class MemoryBroker:
+    """Delivers events to the subscribers of this process."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, data, type=None):
+        self.deliver(channel, format_event(data, type))
+
+    def deliver(self, channel, event):
+        """Hands an encoded event to the local subscribers of `channel`."""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.setdefault(channel, set())
+                subscribers.add(subscription)
+                if len(subscribers) == 1:
+                    self.channel_added(channel)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if not subscribers or subscription not in subscribers:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[channel]
+                    self.channel_removed(channel)
+
+    def channel_added(self, channel):
+        """Called when a channel gets its first local subscriber."""
+
+    def channel_removed(self, channel):
+        """Called when a channel loses its last local subscriber."""
+
+    def subscribers(self):
+        """Returns the number of open local subscriptions."""
+        with self._lock:
+            return len({subscription for subscribers in self._channels.values() for subscription in subscribers})
+
+class RedisBroker(MemoryBroker):
+    """
+    Publishes through Redis and delivers what this process's subscribers listen to.
+
+    A single listener thread owns the pub/sub connection; subscription changes are queued
+    for it, since redis-py pub/sub objects aren't thread-safe.
+    """
+
+    def __init__(self, client, queue_size=100, prefix='chatbot:', logger=None):
+        super().__init__(queue_size)
+        self.client = client
+        self.prefix = prefix
+        self.logger = logger
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._changes = deque()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def publish(self, channel, data, type=None):
+        self.client.publish(self.prefix + channel, format_event(data, type))
+
+    def channel_added(self, channel):
+        self._changes.append(('subscribe', self.prefix + channel))
+        self._start_listener()
+
+    def channel_removed(self, channel):
+        self._changes.append(('unsubscribe', self.prefix + channel))
+
+    def _start_listener(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='events-redis', daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                while self._changes:
+                    action, channel = self._changes.popleft()
+                    getattr(self._pubsub, action)(channel)
+                if not self._pubsub.subscribed:
+                    time.sleep(REDIS_POLL_INTERVAL)
+                    continue
+                message = self._pubsub.get_message(timeout=REDIS_POLL_INTERVAL)
+                if message and message['type'] == 'message':
+                    channel, data = message['channel'], message['data']
+                    channel = channel.decode() if isinstance(channel, bytes) else channel
+                    self.deliver(channel[len(self.prefix):], data.decode() if isinstance(data, bytes) else data)
+            except Exception:
+                # redis-py reconnects and resubscribes on the next call
+                if self.logger:
+                    self.logger.warning("Reading events from Redis failed", exc_info=True)
+                time.sleep(1)
+
+class EventBroker:
+    """Flask extension publishing events and subscribing browsers through the configured broker."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('REDIS_URL', None)
+        config.setdefault('EVENTS_BACKEND', 'redis' if config['REDIS_URL'] else 'memory')
+        config.setdefault('EVENTS_REDIS_CLIENT', None)
+        config.setdefault('EVENTS_REDIS_PREFIX', 'chatbot:')
+        config.setdefault('EVENTS_QUEUE_SIZE', 100)
+        config.setdefault('EVENTS_HEARTBEAT', 15)
+        config.setdefault('EVENTS_RETRY', 3000)
+        app.extensions['events'] = self._create_broker(app)
+
+    def _create_broker(self, app):
+        config = app.config
+        if config['EVENTS_BACKEND'] == 'memory':
+            return MemoryBroker(config['EVENTS_QUEUE_SIZE'])
+        if config['EVENTS_BACKEND'] != 'redis':
+            raise ValueError(f"Unknown EVENTS_BACKEND {config['EVENTS_BACKEND']!r}, expected 'memory' or 'redis'")
+
+        client = config['EVENTS_REDIS_CLIENT']
+        if client is None:
+            if not config['REDIS_URL']:
+                raise ValueError("EVENTS_BACKEND 'redis' needs REDIS_URL")
+            import redis
+            client = redis.Redis.from_url(config['REDIS_URL'])
+        return RedisBroker(client, config['EVENTS_QUEUE_SIZE'], config['EVENTS_REDIS_PREFIX'], app.logger)
+
+    @property
+    def broker(self):
+        return current_app.extensions['events']
+
+    def publish(self, channel, data, type=None):
+        """Publishes an event with JSON `data` to everyone listening on `channel`."""
+        self.broker.publish(channel, data, type)
+
+    def subscribe(self, channels):
+        """Returns a Subscription to `channels`; close it when the client goes away."""
+        return self.broker.subscribe(channels)
+
+def can_subscribe(channel):
+    """Checks whether the current user may listen on a channel."""
+    from chatbot import db
+    from chatbot.models import RecentChats
+
+    kind, _, key = channel.partition('.')
+    if kind == 'user':
+        return key == str(current_user.id)
+    if kind == 'chat' and key.isdigit():
+        owned = (db.session.query(RecentChats.recent_id)
+                 .filter_by(recent_id=int(key), user_id=current_user.id)
+                 .exists())
+        return db.session.query(owned).scalar()
+    return False
+
+# Blueprint serving the event stream
+stream = Blueprint('stream', __name__)
+
+@stream.route('')
+def subscribe():
+    """Streams the events of the requested channels as text/event-stream."""
+    from chatbot import events
+
+    channels = request.args.getlist('channel')
+    if not current_user.is_authenticated or not channels or not all(can_subscribe(channel) for channel in channels):
+        abort(403)
+
+    config = current_app.config
+    heartbeat, retry = config['EVENTS_HEARTBEAT'], config['EVENTS_RETRY']
+    subscription = events.subscribe(channels)
+
+    # Not wrapped in stream_with_context: the request context (and its database session)
+    # is released as soon as the response starts, not held for the life of the connection
+    def generate():
+        try:
+            yield f"retry: {retry}\n\n"
+            while True:
+                event = subscription.get(heartbeat)
+                yield event if event is not None else ": heartbeat\n\n"
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,335 @@
+"""
+Chat history export and import as NDJSON.
+
+An export is one JSON object per line. It starts with an `export` header and then has
+the `user` records (profile fields only, never passwords or OAuth tokens), all `chat`
+records and then all `message` records, including the messages of archived chats, which
+are read from their segments. Rows are read through `yield_per` cursors and written out
+as they arrive, so memory stays flat however long the history is.
+
+Import reads the same format line by line and inserts chats and messages in batches of
+HISTORY_BATCH_SIZE with bulk INSERTs, one short transaction per batch, keeping the
+exported timestamps.
+
+The `flask history export` and `flask history import` commands work on every user at
+once, matching users by email and creating missing ones without a password. They keep
+the exported ids: rows that already exist are skipped, so an interrupted import can
+simply be run again, and a chat id taken by another user's chat, or a message id taken
+by a message of another chat, is reported as a conflict and left out.
+
+Users download their own history from /api/export and load it with /api/import. An
+upload is not trusted with ids: its chats and messages get new ones from the database,
+and the exported ids only tie messages to their chats. Rolling summaries are left out,
+since they refer to message ids; they are rebuilt as the chats continue.
+"""
+import json
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+
+# Version of the export format, written in the header line
+FORMAT_VERSION = 1
+
+USER_FIELDS = ('id', 'email', 'name', 'provider', 'provider_id', 'profile_picture', 'created_at')
+CHAT_FIELDS = ('recent_id', 'user_id', 'recent_time', 'title', 'summary', 'summary_upto_id')
+MESSAGE_FIELDS = ('id', 'recent_id', 'sender', 'message', 'timestamp')
+
+def to_line(record):
+    """Encodes one record as an NDJSON line; datetimes become ISO 8601 strings."""
+    return json.dumps({
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in record.items()
+    }) + '\n'
+
+def parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+def export_lines(user_id=None, batch_size=None):
+    """
+    Yields the NDJSON lines of an export of one user's history, or everyone's.
+
+    Runs inside an app context; each query streams its rows `batch_size` at a time.
+    """
+    from chatbot import db
+    from chatbot.archive import read_record
+    from chatbot.models import ChatMessages, RecentChats, User
+
+    batch_size = batch_size or current_app.config['HISTORY_BATCH_SIZE']
+
+    def rows(statement):
+        result = db.session.execute(statement.execution_options(yield_per=batch_size))
+        for row in result.mappings():
+            yield row
+
+    yield to_line({"type": "export", "version": FORMAT_VERSION, "exported_at": datetime.utcnow()})
+
+    users = select(*(getattr(User, field) for field in USER_FIELDS)).order_by(User.id)
+    chats = select(*(getattr(RecentChats, field) for field in CHAT_FIELDS)).order_by(RecentChats.recent_id)
+    messages = select(*(getattr(ChatMessages, field) for field in MESSAGE_FIELDS))
+    archived = (select(RecentChats.recent_id, RecentChats.archive_segment,
+                       RecentChats.archive_offset, RecentChats.archive_length)
+                .where(RecentChats.archive_segment.isnot(None))
+                .order_by(RecentChats.recent_id))
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+        chats = chats.where(RecentChats.user_id == user_id)
+        # Walks the (recent_id, id) index chat by chat
+        messages = (messages.join(RecentChats, RecentChats.recent_id == ChatMessages.recent_id)
+                    .where(RecentChats.user_id == user_id)
+                    .order_by(ChatMessages.recent_id, ChatMessages.id))
+        archived = archived.where(RecentChats.user_id == user_id)
+    else:
+        messages = messages.order_by(ChatMessages.id)
+
+    for user in rows(users):
+        yield to_line({"type": "user", **user})
+    for chat in rows(chats):
+        yield to_line({"type": "chat", **chat})
+    for message in rows(messages):
+        yield to_line({"type": "message", **message})
+
+    # Archived chats have no rows in chat_messages; their records hold the messages
+    for chat in rows(archived):
+        record = read_record(chat['archive_segment'], chat['archive_offset'], chat['archive_length'])
+        for message in json.loads(record):
+            yield to_line({"type": "message", "id": message["id"], "recent_id": chat['recent_id'],
+                           "sender": message["sender"], "message": message["message"],
+                           "timestamp": message["timestamp"]})
+
+class Importer:
+    """
+    Inserts the records of an export in batches.
+
+    With `user_id` every chat is imported for that user and `user` records are ignored;
+    otherwise exported users are matched to local ones by email. Without `keep_ids`,
+    chats and messages are inserted under new ids. Feed it lines, then call `finish()`,
+    which returns the counts.
+    """
+
+    def __init__(self, user_id=None, batch_size=None, keep_ids=True):
+        self.user_id = user_id
+        self.batch_size = batch_size or current_app.config['HISTORY_BATCH_SIZE']
+        self.keep_ids = keep_ids
+        self.user_ids = {}  # Exported user id -> local user id
+        self.chat_ids = {}  # Exported id -> local id of the chats imported messages may be added to
+        self.owners = set()  # Users whose chat lists changed
+        self.chats = []
+        self.messages = []
+        self.line_number = 0
+        self.counts = {"users": 0, "chats": 0, "messages": 0, "skipped": 0, "conflicts": 0}
+
+    def feed(self, line):
+        """Adds one NDJSON line, flushing a batch when it is full."""
+        self.line_number += 1
+        if isinstance(line, bytes):
+            line = line.decode()
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            kind = record.get('type')
+            if kind == 'export':
+                if record.get('version') != FORMAT_VERSION:
+                    raise ValueError(f"unsupported export version {record.get('version')!r}")
+            elif kind == 'user':
+                self.add_user(record)
+            elif kind == 'chat':
+                self.chats.append(self.chat_row(record))
+                if len(self.chats) >= self.batch_size:
+                    self.flush_chats()
+            elif kind == 'message':
+                self.messages.append(self.message_row(record))
+                if len(self.messages) >= self.batch_size:
+                    self.flush_messages()
+            else:
+                raise ValueError(f"unknown record type {kind!r}")
+        except KeyError as e:
+            raise ValueError(f"line {self.line_number}: missing field {e}") from e
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f"line {self.line_number}: {e}") from e
+
+    def chat_row(self, record):
+        from chatbot.titles import DEFAULT_TITLE, MAX_TITLE_LENGTH
+
+        return {
+            "recent_id": int(record["recent_id"]),
+            "user_id": int(record["user_id"]),
+            "recent_time": parse_time(record.get("recent_time")) or datetime.utcnow(),
+            "title": (record.get("title") or DEFAULT_TITLE)[:MAX_TITLE_LENGTH],
+            "summary": record.get("summary"),
+            "summary_upto_id": record.get("summary_upto_id"),
+        }
+
+    def message_row(self, record):
+        return {
+            "id": int(record["id"]),
+            "recent_id": int(record["recent_id"]),
+            "sender": str(record["sender"]),
+            "message": str(record["message"]),
+            "timestamp": parse_time(record.get("timestamp")) or datetime.utcnow(),
+        }
+
+    def add_user(self, record):
+        """Maps an exported user to the local user with the same email, creating it if needed."""
+        from chatbot import db
+        from chatbot.models import User
+
+        if self.user_id is not None:
+            return
+        email = record["email"]
+        user = User.query.filter_by(email=email).first()
+        if user is None:
+            user = User(email=email, name=record.get("name"), provider=record.get("provider"),
+                        provider_id=record.get("provider_id"), profile_picture=record.get("profile_picture"),
+                        created_at=parse_time(record.get("created_at")) or datetime.utcnow())
+            db.session.add(user)
+            db.session.commit()
+            self.counts["users"] += 1
+        self.user_ids[int(record["id"])] = user.id
+
+    def flush_chats(self):
+        from chatbot import db
+        from chatbot.archive import ensure_restored
+        from chatbot.models import RecentChats
+
+        if not self.chats:
+            return
+        rows, self.chats = self.chats, []
+        if not self.keep_ids:
+            return self.insert_chats(rows)
+        existing = dict(db.session.execute(
+            select(RecentChats.recent_id, RecentChats.user_id)
+            .where(RecentChats.recent_id.in_([row["recent_id"] for row in rows]))
+        ).all())
+
+        new_rows, restore = [], []
+        for row in rows:
+            owner = self.user_id if self.user_id is not None else self.user_ids.get(row["user_id"])
+            if owner is None or existing.get(row["recent_id"], owner) != owner:
+                self.counts["conflicts"] += 1  # Unknown user, or the id belongs to another user's chat
+                continue
+            self.chat_ids[row["recent_id"]] = row["recent_id"]
+            if row["recent_id"] in existing:
+                self.counts["skipped"] += 1
+                restore.append(row["recent_id"])
+            else:
+                new_rows.append({**row, "user_id": owner})
+                self.owners.add(owner)
+
+        if new_rows:
+            db.session.execute(insert(RecentChats), new_rows)
+            self.counts["chats"] += len(new_rows)
+        db.session.commit()
+        # Messages of an archived chat must be back in the database before more are added
+        for recent_id in restore:
+            ensure_restored(recent_id)
+
+    def insert_chats(self, rows):
+        """Inserts chats under new ids for `user_id`, remembering which id each one got."""
+        from chatbot import db
+        from chatbot.models import RecentChats
+
+        new_ids = db.session.execute(
+            insert(RecentChats).returning(RecentChats.recent_id, sort_by_parameter_order=True),
+            [{"user_id": self.user_id, "recent_time": row["recent_time"], "title": row["title"]} for row in rows]
+        ).scalars().all()
+        db.session.commit()
+        self.chat_ids.update(zip((row["recent_id"] for row in rows), new_ids))
+        self.counts["chats"] += len(rows)
+        self.owners.add(self.user_id)
+
+    def flush_messages(self):
+        from chatbot import db
+        from chatbot.models import ChatMessages
+
+        self.flush_chats()  # Messages may belong to chats still waiting in the batch
+        if not self.messages:
+            return
+        rows, self.messages = self.messages, []
+        existing = {}
+        if self.keep_ids:
+            existing = dict(db.session.execute(
+                select(ChatMessages.id, ChatMessages.recent_id).where(ChatMessages.id.in_([row["id"] for row in rows]))
+            ).all())
+
+        new_rows = []
+        for row in rows:
+            if row["recent_id"] not in self.chat_ids:
+                self.counts["conflicts"] += 1
+            elif not self.keep_ids:
+                # The database numbers them; in export order, so each chat keeps its order
+                new_rows.append({**{key: value for key, value in row.items() if key != "id"},
+                                 "recent_id": self.chat_ids[row["recent_id"]]})
+            elif row["id"] in existing:
+                # Already imported into the same chat, or the id belongs to another chat's message
+                self.counts["skipped" if existing[row["id"]] == row["recent_id"] else "conflicts"] += 1
+            else:
+                new_rows.append(row)
+
+        if new_rows:
+            db.session.execute(insert(ChatMessages), new_rows)
+            self.counts["messages"] += len(new_rows)
+        db.session.commit()
+
+    def finish(self):
+        """Flushes the last batches and returns the counts."""
+        from chatbot import chat_list, db
+
+        self.flush_messages()
+        if db.engine.dialect.name == 'postgresql':
+            # Explicit ids don't advance the sequences; move them past the imported rows
+            for table, column in (('recent_chats', 'recent_id'), ('chat_messages', 'id')):
+                db.session.execute(db.text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                    f"(SELECT COALESCE(MAX({column}), 1) FROM {table}))"
+                ))
+            db.session.commit()
+        for owner in self.owners:
+            chat_list.invalidate(owner)
+        return self.counts
+
+def import_lines(lines, user_id=None, batch_size=None, keep_ids=True):
+    """Imports an export from an iterable of lines. Returns the counts of `Importer.finish`."""
+    importer = Importer(user_id, batch_size, keep_ids)
+    for line in lines:
+        importer.feed(line)
+    return importer.finish()
+
+def find_user(reference):
+    """Returns the user with the given email or id, or raises a click error."""
+    from chatbot import db
+    from chatbot.models import User
+
+    user = User.query.filter_by(email=reference).first()
+    if user is None and reference.isdigit():
+        user = db.session.get(User, int(reference))
+    if user is None:
+        raise click.BadParameter(f"No user {reference!r}", param_hint='--user')
+    return user
+
+history_cli = AppGroup('history', help="Export and import chat history as NDJSON.")
+
+@history_cli.command('export')
+@click.option('--user', 'user_ref', default=None, help="Email or id of the user to export (default: everyone).")
+@click.option('--output', '-o', type=click.File('w'), default='-', help="File to write (default: stdout).")
+@click.option('--batch-size', type=int, default=None, help="Rows fetched per round trip (default HISTORY_BATCH_SIZE).")
+def export_command(user_ref, output, batch_size):
+    """Writes chats and messages as NDJSON."""
+    user_id = find_user(user_ref).id if user_ref else None
+    for line in export_lines(user_id, batch_size):
+        output.write(line)
+
+@history_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--user', 'user_ref', default=None, help="Email or id of the user to import every chat for.")
+@click.option('--batch-size', type=int, default=None, help="Rows inserted per transaction (default HISTORY_BATCH_SIZE).")
+def import_command(source, user_ref, batch_size):
+    """Loads chats and messages from an NDJSON export."""
+    user_id = find_user(user_ref).id if user_ref else None
+    try:
+        counts = import_lines(source, user_id, batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join(f"{key}: {value}" for key, value in counts.items()))
@@ -0,0 +1,106 @@
+"""
+User identity cache for Flask-Login.
+
+Users are loaded at most once per request (memoized on `flask.g`), and through an
+optional process-wide TTL cache of lightweight snapshots, so most authenticated requests
+run no user query at all. A snapshot is a plain object detached from the session holding
+the user's profile columns (never the password hash).
+
+Entries are dropped when a user row is updated or deleted through this process's
+session. Nothing tells other processes (other workers or hosts): they keep serving the
+old snapshot, including for a deleted user, until it is USER_CACHE_TTL seconds old.
+That TTL is the bound on cross-process staleness; lower it, or set USER_CACHE_ENABLED
+to false, where changes must take effect everywhere at once.
+"""
+from flask import current_app, g
+from flask_login import UserMixin
+from sqlalchemy import event
+from chatbot.cache import MISSING, LRUCache
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of a User row, used as `current_user`."""
+
+    FIELDS = ('id', 'email', 'name', 'provider', 'provider_id', 'profile_picture', 'created_at', 'updated_at')
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id}>"
+
+class IdentityCache:
+    """Flask extension loading users for Flask-Login through the request memo and the TTL cache."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_ENABLED', True)
+        app.config.setdefault('USER_CACHE_TTL', 300)
+        app.config.setdefault('USER_CACHE_MAX_ENTRIES', 10000)
+        app.extensions['identity'] = {
+            'cache': LRUCache(
+                max_entries=app.config['USER_CACHE_MAX_ENTRIES'],
+                ttl=app.config['USER_CACHE_TTL'],
+            ) if app.config['USER_CACHE_ENABLED'] else None,
+            'stats': {"request_hits": 0, "hits": 0, "misses": 0},
+        }
+
+        from chatbot.models import User
+        for name in ('after_update', 'after_delete'):
+            if not event.contains(User, name, user_changed):
+                event.listen(User, name, user_changed)
+
+    @property
+    def cache(self):
+        return current_app.extensions['identity']['cache']
+
+    @property
+    def counters(self):
+        return current_app.extensions['identity']['stats']
+
+    def load(self, user_id):
+        """Returns the user with `user_id` (a snapshot when caching is on), or None."""
+        from chatbot import db
+        from chatbot.models import User
+
+        loaded = g.setdefault('_identity_users', {})
+        if user_id in loaded:
+            self.counters["request_hits"] += 1
+            return loaded[user_id]
+
+        user = self.cache.get(user_id) if self.cache is not None else MISSING
+        if user is not MISSING:
+            self.counters["hits"] += 1
+        else:
+            self.counters["misses"] += 1
+            user = db.session.get(User, user_id)
+            if self.cache is not None and user is not None:
+                user = UserSnapshot(user)
+                self.cache.set(user_id, user)
+
+        loaded[user_id] = user
+        return user
+
+    def invalidate(self, user_id):
+        """Drops a user's cached snapshot in this process only; others wait out the TTL."""
+        if self.cache is not None:
+            self.cache.delete(user_id)
+        g.pop('_identity_users', None)
+
+    def stats(self):
+        """Returns the hit/miss counters and current size."""
+        counters = dict(self.counters)
+        lookups = sum(counters.values())
+        counters["hit_ratio"] = round((lookups - counters["misses"]) / lookups, 4) if lookups else 0.0
+        counters["entries"] = len(self.cache) if self.cache is not None else 0
+        return counters
+
+def user_changed(mapper, connection, target):
+    """Drops the cached snapshot of a User row that was updated (which bumps `updated_at`) or deleted."""
+    from chatbot import identity
+
+    if current_app and 'identity' in current_app.extensions:
+        identity.invalidate(target.id)
@@ -0,0 +1,609 @@
+"""
+LLM backend layer.
+
+All upstream model calls go through the `LLM` extension, which picks a backend from the
+app config, reuses its model clients, caps the number of in-flight calls and retries
+transient failures with jittered backoff. Calls waiting for a slot are queued per user
+and served round-robin, and each user has token-bucket budgets for requests and
+estimated tokens, so one busy user can't take the whole upstream quota. Replies can
+optionally be served from a response cache. `agenerate` is the asyncio counterpart of
+`generate`, used by the async request path.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from flask import current_app
+from chatbot.cache import MISSING, LRUCache, ResponseCache, SQLiteStore, make_key
+from chatbot.metrics import LLMCall
+
+class LLMError(Exception):
+    """Raised when the model could not produce a response."""
+    status = 502
+    retry_after = None
+
+class LLMOverloaded(LLMError):
+    """Raised when too many calls are in flight or queued to accept another one."""
+    status = 503
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMRateLimited(LLMError):
+    """Raised when a user has too many calls pending or has used up their budget."""
+    status = 429
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMTimeout(LLMError):
+    """Raised when the model did not answer within the configured timeout."""
+    status = 504
+
+class GeminiBackend:
+    """
+    Google Gemini backend.
+
+    Model clients are created once per model name and reused across requests.
+    """
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name, timeout):
+        import google.generativeai as genai
+        from google.api_core import exceptions
+
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model_name = model_name
+        self.timeout = timeout
+        self._models = {}
+        self._lock = threading.Lock()
+        self.timeout_errors = (exceptions.DeadlineExceeded, TimeoutError)
+        self.retryable_errors = self.timeout_errors + (
+            exceptions.ServiceUnavailable,
+            exceptions.TooManyRequests,
+            exceptions.InternalServerError,
+            ConnectionError,
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['LLM_API_KEY'], config['LLM_MODEL'], config['LLM_TIMEOUT'])
+
+    def model(self, model_name=None):
+        """Returns the shared client for a model, creating it on first use."""
+        model_name = model_name or self.model_name
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.setdefault(model_name, self._genai.GenerativeModel(model_name=model_name))
+        return model
+
+    def generate(self, contents):
+        response = self.model().generate_content(contents, request_options={"timeout": self.timeout})
+        return response.text
+
+    async def agenerate(self, contents):
+        response = await self.model().generate_content_async(contents, request_options={"timeout": self.timeout})
+        return response.text
+
+    def stream(self, contents):
+        response = self.model().generate_content(contents, stream=True, request_options={"timeout": self.timeout})
+        for chunk in response:
+            # Chunks without text parts (e.g. safety metadata only) raise on `.text`
+            if chunk.parts:
+                yield chunk.text
+
+class StubBackend:
+    """
+    Deterministic local backend for load tests and CI, with no network access.
+
+    Replies are derived from a checksum of the prompt, so the same prompt always gets the
+    same reply. `latency` is slept before the first chunk and `chunk_latency` between
+    chunks; a latency above the timeout raises like a real upstream timeout would.
+    """
+    name = 'stub'
+    timeout_errors = (TimeoutError,)
+    retryable_errors = (TimeoutError,)
+
+    def __init__(self, model_name='stub', latency=0.0, chunk_latency=0.0, chunk_size=4, timeout=None):
+        self.model_name = model_name
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            model_name=config['LLM_MODEL'],
+            latency=config['LLM_STUB_LATENCY'],
+            chunk_latency=config['LLM_STUB_CHUNK_LATENCY'],
+            timeout=config['LLM_TIMEOUT'],
+        )
+
+    def reply_for(self, contents):
+        """Returns the deterministic reply for a prompt (short enough to double as a chat title)."""
+        return f"Stub reply {zlib.crc32(repr(contents).encode()):08x}"
+
+    def _wait(self, seconds):
+        if self.timeout is not None and seconds > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError(f"stub backend did not answer within {self.timeout}s")
+        time.sleep(seconds)
+
+    def generate(self, contents):
+        self._wait(self.latency)
+        return self.reply_for(contents)
+
+    async def agenerate(self, contents):
+        if self.timeout is not None and self.latency > self.timeout:
+            await asyncio.sleep(self.timeout)
+            raise TimeoutError(f"stub backend did not answer within {self.timeout}s")
+        await asyncio.sleep(self.latency)
+        return self.reply_for(contents)
+
+    def stream(self, contents):
+        self._wait(self.latency)
+        reply = self.reply_for(contents)
+        for start in range(0, len(reply), self.chunk_size):
+            if start:
+                self._wait(self.chunk_latency)
+            yield reply[start:start + self.chunk_size]
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, StubBackend)}
+
+class FairQueue:
+    """
+    Calls waiting for a slot, grouped by user and served round-robin.
+
+    A user who queues many calls only gets every n-th free slot while n users are
+    waiting, instead of everything in front of them. Not thread-safe: limiters hold their
+    own lock around it.
+    """
+
+    def __init__(self):
+        self._users = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def users(self):
+        """Returns the number of users with waiting calls."""
+        return len(self._users)
+
+    def count(self, user):
+        return len(self._users.get(user, ()))
+
+    def push(self, user, waiter):
+        self._users.setdefault(user, deque()).append(waiter)
+        self.size += 1
+
+    def pop(self):
+        """Returns the oldest waiter of the next user in turn; that user goes to the back."""
+        user, waiters = next(iter(self._users.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            self._users.move_to_end(user)
+        else:
+            del self._users[user]
+        self.size -= 1
+        return waiter
+
+    def remove(self, user, waiter):
+        waiters = self._users[user]
+        waiters.remove(waiter)
+        if not waiters:
+            del self._users[user]
+        self.size -= 1
+
+class BaseLimiter:
+    """
+    Caps concurrent upstream calls, queueing the rest fairly between users.
+
+    Callers beyond `max_concurrency` wait in a `FairQueue`; a finished call hands its slot
+    straight to the next waiter in turn. Once `max_queue` calls are waiting in total, or
+    `max_user_queue` for one user, or a slot doesn't free up within `queue_timeout`, the
+    call fails fast instead of piling up.
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout, max_user_queue=0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self.queue_timeout = queue_timeout
+        self.queue = FairQueue()
+        self.in_flight = 0
+
+    @property
+    def waiting(self):
+        return len(self.queue)
+
+    def _admit(self, user):
+        """Takes a free slot and returns True, returns False if the caller must queue, or raises."""
+        if self.in_flight < self.max_concurrency and not self.queue:
+            self.in_flight += 1
+            return True
+        if len(self.queue) >= self.max_queue:
+            raise LLMOverloaded("Too many pending AI requests, please retry shortly")
+        if self.max_user_queue and self.queue.count(user) >= self.max_user_queue:
+            raise LLMRateLimited("Too many of your AI requests are pending, please wait for them to finish",
+                                 retry_after=1)
+        return False
+
+    def _next_waiter(self):
+        """Returns the waiter a freed slot goes to, or None after giving the slot back."""
+        if self.queue:
+            return self.queue.pop()
+        self.in_flight -= 1
+        return None
+
+class Limiter(BaseLimiter):
+    """Thread-based limiter for the sync request path and background workers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, user=None):
+        self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, user=None):
+        with self._lock:
+            if self._admit(user):
+                return
+            waiter = threading.Event()
+            self.queue.push(user, waiter)
+        if waiter.wait(self.queue_timeout):
+            return
+        with self._lock:
+            # The slot may have been handed over right as the wait timed out
+            if waiter.is_set():
+                return
+            self.queue.remove(user, waiter)
+        raise LLMOverloaded("Timed out waiting for a free AI request slot")
+
+    def release(self):
+        with self._lock:
+            waiter = self._next_waiter()
+            if waiter is not None:
+                waiter.set()
+
+class AsyncLimiter(BaseLimiter):
+    """
+    asyncio counterpart of `Limiter` for the async request path.
+
+    Waiting callers only cost a suspended coroutine, so it is usually configured with a
+    much larger queue than the thread-based limiter. All calls run on one event loop, so
+    no lock is needed.
+    """
+
+    @asynccontextmanager
+    async def slot(self, user=None):
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user=None):
+        if self._admit(user):
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.queue.push(user, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # The slot was handed over right as the wait ended
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self.release()
+            else:
+                self.queue.remove(user, waiter)
+                waiter.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMOverloaded("Timed out waiting for a free AI request slot") from None
+            raise
+
+    def release(self):
+        waiter = self._next_waiter()
+        if waiter is not None:
+            waiter.set_result(None)
+
+class Budget:
+    """
+    Per-user token buckets for upstream requests and estimated tokens.
+
+    Each bucket holds up to a minute's allowance and refills continuously. Prompts are
+    charged before the call, and rejected with LLMRateLimited (and the seconds until they
+    would fit) when a bucket runs short; replies are charged afterwards and may take the
+    token bucket below zero. A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_users=10000):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # A bucket left alone for a minute is full again, so it can be forgotten
+        self._buckets = LRUCache(max_entries=max_users, ttl=60)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _refilled(self, user, now):
+        state = self._buckets.get(user)
+        if state is MISSING:
+            return float(self.requests_per_minute), float(self.tokens_per_minute)
+        requests, tokens, updated = state
+        elapsed_minutes = (now - updated) / 60
+        return (min(self.requests_per_minute, requests + elapsed_minutes * self.requests_per_minute),
+                min(self.tokens_per_minute, tokens + elapsed_minutes * self.tokens_per_minute))
+
+    def charge(self, user, tokens):
+        """Takes one request and `tokens` from the user's buckets, or raises LLMRateLimited."""
+        if not self.enabled:
+            return
+        # A prompt larger than the whole allowance only needs a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        now = time.monotonic()
+        with self._lock:
+            requests, available = self._refilled(user, now)
+            wait = max(
+                (1 - requests) * 60 / self.requests_per_minute if self.requests_per_minute and requests < 1 else 0,
+                (tokens - available) * 60 / self.tokens_per_minute if self.tokens_per_minute and available < tokens else 0,
+            )
+            if wait > 0:
+                self._buckets.set(user, (requests, available, now))
+                raise LLMRateLimited("AI request budget used up, please retry later", retry_after=math.ceil(wait))
+            self._buckets.set(user, (requests - 1, available - tokens, now))
+
+    def spend(self, user, tokens):
+        """Takes `tokens` from the user's token bucket without checking it, e.g. for a reply."""
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        with self._lock:
+            requests, available = self._refilled(user, now)
+            self._buckets.set(user, (requests, available - tokens, now))
+
+def estimate_prompt_tokens(contents):
+    """Estimates the tokens of a prompt string or Gemini `contents` list."""
+    from chatbot.context import estimate_tokens
+
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    return sum(estimate_tokens(str(part)) for content in contents for part in content.get("parts", ()))
+
+class LLM:
+    """Flask extension giving access to the configured model backend."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('LLM_BACKEND', 'gemini')
+        config.setdefault('LLM_API_KEY', None)
+        config.setdefault('LLM_MODEL', 'gemini-1.5-flash')
+        config.setdefault('LLM_TIMEOUT', 60)
+        config.setdefault('LLM_MAX_RETRIES', 2)
+        config.setdefault('LLM_RETRY_BACKOFF', 0.5)
+        config.setdefault('LLM_MAX_CONCURRENCY', 8)
+        config.setdefault('LLM_MAX_QUEUE', 32)
+        config.setdefault('LLM_QUEUE_TIMEOUT', 10)
+        config.setdefault('LLM_ASYNC_MAX_CONCURRENCY', 64)
+        config.setdefault('LLM_ASYNC_MAX_QUEUE', 512)
+        config.setdefault('LLM_USER_MAX_QUEUE', 4)
+        config.setdefault('LLM_USER_REQUESTS_PER_MINUTE', 20)
+        config.setdefault('LLM_USER_TOKENS_PER_MINUTE', 60000)
+        config.setdefault('LLM_BUDGET_MAX_USERS', 10000)
+        config.setdefault('LLM_STUB_LATENCY', 0.0)
+        config.setdefault('LLM_STUB_CHUNK_LATENCY', 0.0)
+        config.setdefault('RESPONSE_CACHE_ENABLED', False)
+        config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+        config.setdefault('RESPONSE_CACHE_TTL', 3600)
+        config.setdefault('RESPONSE_CACHE_DB', None)
+
+        if config['LLM_BACKEND'] not in BACKENDS:
+            raise ValueError(f"Unknown LLM_BACKEND {config['LLM_BACKEND']!r}, expected one of {sorted(BACKENDS)}")
+
+        app.extensions['llm'] = {
+            'backend': BACKENDS[config['LLM_BACKEND']].from_config(config),
+            'limiter': Limiter(
+                config['LLM_MAX_CONCURRENCY'], config['LLM_MAX_QUEUE'], config['LLM_QUEUE_TIMEOUT'], config['LLM_USER_MAX_QUEUE']
+            ),
+            'async_limiter': AsyncLimiter(
+                config['LLM_ASYNC_MAX_CONCURRENCY'], config['LLM_ASYNC_MAX_QUEUE'], config['LLM_QUEUE_TIMEOUT'],
+                config['LLM_USER_MAX_QUEUE']
+            ),
+            'budget': Budget(
+                config['LLM_USER_REQUESTS_PER_MINUTE'], config['LLM_USER_TOKENS_PER_MINUTE'], config['LLM_BUDGET_MAX_USERS']
+            ),
+            'cache': self._create_cache(config),
+        }
+
+    def _create_cache(self, config):
+        """Builds the response cache, or returns None when caching is disabled."""
+        if not config['RESPONSE_CACHE_ENABLED']:
+            return None
+        memory = LRUCache(config['RESPONSE_CACHE_MAX_ENTRIES'], config['RESPONSE_CACHE_TTL'])
+        store = SQLiteStore(config['RESPONSE_CACHE_DB'], config['RESPONSE_CACHE_TTL']) if config['RESPONSE_CACHE_DB'] else None
+        return ResponseCache(memory, store)
+
+    @property
+    def backend(self):
+        return current_app.extensions['llm']['backend']
+
+    @property
+    def limiter(self):
+        return current_app.extensions['llm']['limiter']
+
+    @property
+    def async_limiter(self):
+        return current_app.extensions['llm']['async_limiter']
+
+    @property
+    def cache(self):
+        return current_app.extensions['llm']['cache']
+
+    @property
+    def budget(self):
+        return current_app.extensions['llm']['budget']
+
+    def _charge(self, user, contents):
+        """Charges a call to the user's budget; background calls (no user) are not budgeted."""
+        if user is not None:
+            self.budget.charge(user, estimate_prompt_tokens(contents))
+
+    def _spend(self, user, reply):
+        if user is not None and reply:
+            self.budget.spend(user, estimate_prompt_tokens(reply))
+
+    def cache_key(self, contents):
+        """Returns the response cache key for a prompt sent to the current backend and model."""
+        backend = self.backend
+        return make_key(contents, backend=backend.name, model=backend.model_name)
+
+    def _backoff(self, attempt):
+        """Sleeps before a retry: exponential backoff with full jitter."""
+        base = current_app.config['LLM_RETRY_BACKOFF'] * (2 ** attempt)
+        time.sleep(random.uniform(0, base))
+
+    def _translate(self, error):
+        """Converts a backend exception into an LLMError."""
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, self.backend.timeout_errors):
+            return LLMTimeout(f"AI response timed out: {error}")
+        return LLMError(f"Error generating AI response: {error}")
+
+    def generate(self, contents, user=None):
+        """
+        Returns the model's full reply to `contents`, from the response cache when enabled.
+
+        `user` identifies who the call is made for: calls queue fairly per user and are
+        charged to the user's budget. Background work passes no user.
+        """
+        cache = self.cache
+        if cache is None:
+            return self._generate(contents, user)
+        return cache.get_or_compute(self.cache_key(contents), lambda: self._generate(contents, user))
+
+    def _generate(self, contents, user=None):
+        backend = self.backend
+        retries = current_app.config['LLM_MAX_RETRIES']
+        with LLMCall(backend.name, 'generate') as call:
+            self._charge(user, contents)
+            with self.limiter.slot(user):
+                call.start()
+                for attempt in range(retries + 1):
+                    try:
+                        reply = backend.generate(contents)
+                        self._spend(user, reply)
+                        return reply
+                    except backend.retryable_errors as e:
+                        if attempt == retries:
+                            raise self._translate(e) from e
+                        self._backoff(attempt)
+                    except Exception as e:
+                        raise self._translate(e) from e
+
+    async def agenerate(self, contents, user=None):
+        """Async variant of `generate`; the upstream call doesn't block a thread while it waits."""
+        cache = self.cache
+        if cache is None:
+            return await self._agenerate(contents, user)
+        return await cache.aget_or_compute(self.cache_key(contents), lambda: self._agenerate(contents, user))
+
+    async def _agenerate(self, contents, user=None):
+        backend = self.backend
+        config = current_app.config
+        retries = config['LLM_MAX_RETRIES']
+        with LLMCall(backend.name, 'agenerate') as call:
+            self._charge(user, contents)
+            async with self.async_limiter.slot(user):
+                call.start()
+                for attempt in range(retries + 1):
+                    try:
+                        reply = await asyncio.wait_for(backend.agenerate(contents), config['LLM_TIMEOUT'])
+                        self._spend(user, reply)
+                        return reply
+                    except (asyncio.TimeoutError, *backend.retryable_errors) as e:
+                        if attempt == retries:
+                            if isinstance(e, asyncio.TimeoutError):
+                                raise LLMTimeout("AI response timed out") from e
+                            raise self._translate(e) from e
+                        await asyncio.sleep(random.uniform(0, config['LLM_RETRY_BACKOFF'] * (2 ** attempt)))
+                    except Exception as e:
+                        raise self._translate(e) from e
+
+    def stream(self, contents, user=None):
+        """
+        Yields the model's reply to `contents` chunk by chunk.
+
+        A cached reply is yielded as a single chunk; a complete streamed reply is added to
+        the cache. Concurrent identical streams are not coalesced.
+        """
+        cache = self.cache
+        if cache is None:
+            yield from self._stream(contents, user)
+            return
+
+        key = self.cache_key(contents)
+        cached = cache.get(key)
+        if cached is not MISSING:
+            yield cached
+            return
+        cache.misses += 1
+        chunks = []
+        for chunk in self._stream(contents, user):
+            chunks.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(chunks))
+
+    def _stream(self, contents, user=None):
+        """
+        Streams from the backend.
+
+        Failures before the first chunk are retried; once text has been sent it can't be
+        taken back, so later failures are raised as-is.
+        """
+        backend = self.backend
+        retries = current_app.config['LLM_MAX_RETRIES']
+        chunks = []
+        with LLMCall(backend.name, 'stream') as call:
+            self._charge(user, contents)
+            try:
+                with self.limiter.slot(user):
+                    call.start()
+                    for attempt in range(retries + 1):
+                        try:
+                            for chunk in backend.stream(contents):
+                                call.chunk()
+                                chunks.append(chunk)
+                                yield chunk
+                            return
+                        except backend.retryable_errors as e:
+                            if chunks or attempt == retries:
+                                raise self._translate(e) from e
+                            self._backoff(attempt)
+                        except Exception as e:
+                            raise self._translate(e) from e
+            finally:
+                # Charged for what was streamed, also when the client went away early
+                self._spend(user, ''.join(chunks))
@@ -0,0 +1,337 @@
+"""
+Request, database and LLM metrics in the Prometheus text format.
+
+Every request's latency is recorded in a histogram per URL rule, method and status,
+together with the number of SQL statements it ran and the time they took, counted with
+SQLAlchemy cursor events. Upstream model calls record their latency, streamed chunks and
+errors. Cache and limiter gauges are read when /metrics is scraped, so they cost nothing
+on the request path; recording a sample is a bucket lookup and an increment under a
+per-metric lock.
+
+/metrics is closed by default: with METRICS_TOKEN set it needs `Authorization: Bearer
+<token>`, and without one it only answers requests from the loopback interface, e.g. a
+scraper or sidecar on the same host.
+"""
+import hmac
+import math
+import time
+from bisect import bisect_left
+from threading import Lock
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Bucket upper bounds in seconds, from a cached page up to a slow model reply
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def format_labels(names, values):
+    """Renders a label set as `{name="value",...}`, escaped for the text format."""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named metric with one series per combination of label values."""
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(self.render_series(labels, value) for labels, value in series)
+        return '\n'.join(lines)
+
+    def render_series(self, labels, value):
+        return f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+class Counter(Metric):
+    """A count that only goes up."""
+    type = 'counter'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """Copies a count kept elsewhere, such as a cache's hit counter, at scrape time."""
+        with self._lock:
+            self._series[labels] = value
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+    type = 'gauge'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._series[labels] = value
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, with their count and sum."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        # Per-bucket counts are kept and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render_series(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            bucket_labels = format_labels(self.labelnames + ('le',), labels + (format_value(bound),))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        series_labels = format_labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{series_labels} {format_value(total)}")
+        lines.append(f"{self.name}_count{series_labels} {cumulative}")
+        return '\n'.join(lines)
+
+class Registry:
+    """
+    The metrics of one app.
+
+    `collectors` are called before rendering to refresh values that are read rather than
+    recorded, like cache sizes.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        for collect in self.collectors:
+            collect(self)
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+class AppMetrics(Registry):
+    """Registry with the instruments the app records."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = self.add(Histogram(
+            'http_request_duration_seconds', "Time spent serving requests, including streamed bodies.",
+            ('endpoint', 'method', 'status')))
+        self.in_flight = self.add(Gauge('http_requests_in_flight', "Requests currently being served."))
+        self.request_queries = self.add(Histogram(
+            'http_request_db_queries', "SQL statements run per request.", ('endpoint',), COUNT_BUCKETS))
+        self.request_db_time = self.add(Histogram(
+            'http_request_db_duration_seconds', "Time spent in SQL statements per request.", ('endpoint',), QUERY_BUCKETS))
+        self.queries = self.add(Counter('db_queries_total', "SQL statements run, including background work."))
+        self.query_time = self.add(Histogram(
+            'db_query_duration_seconds', "Latency of single SQL statements.", buckets=QUERY_BUCKETS))
+        self.llm_latency = self.add(Histogram(
+            'llm_request_duration_seconds', "Latency of upstream model calls once a slot is free, including retries.",
+            ('backend', 'operation')))
+        self.llm_first_chunk = self.add(Histogram(
+            'llm_stream_first_chunk_seconds', "Time until a streamed reply's first chunk.", ('backend',)))
+        self.llm_chunks = self.add(Counter('llm_stream_chunks_total', "Chunks received from streamed replies.", ('backend',)))
+        self.llm_errors = self.add(Counter(
+            'llm_errors_total', "Failed model calls by error type.", ('backend', 'operation', 'error')))
+        self.llm_queue_wait = self.add(Histogram(
+            'llm_queue_wait_seconds', "Time model calls waited for a slot.", ('operation',)))
+        self.llm_in_flight = self.add(Gauge('llm_calls_in_flight', "Upstream model calls holding a slot.", ('path',)))
+        self.llm_waiting = self.add(Gauge('llm_calls_waiting', "Model calls waiting for a slot.", ('path',)))
+        self.llm_waiting_users = self.add(Gauge('llm_waiting_users', "Users with model calls waiting for a slot.", ('path',)))
+        self.cache_hits = self.add(Counter('cache_hits_total', "Cache lookups that found an entry.", ('cache',)))
+        self.cache_misses = self.add(Counter('cache_misses_total', "Cache lookups that missed.", ('cache',)))
+        self.cache_entries = self.add(Gauge('cache_entries', "Entries held by in-memory caches.", ('cache',)))
+        self.event_subscribers = self.add(Gauge('events_subscribers', "Open Server-Sent Events streams."))
+        self.events_dropped = self.add(Counter(
+            'events_dropped_total', "Events dropped because a slow client's queue was full."))
+        self.collectors.append(collect_app_state)
+
+    def request_started(self):
+        self.in_flight.inc()
+
+    def request_finished(self, endpoint, method, status, seconds, queries=None):
+        """Records a finished request; `queries` is its (count, seconds) of SQL, when tracked."""
+        self.in_flight.dec()
+        self.requests.observe(seconds, endpoint, method, str(status))
+        if queries is not None:
+            self.request_queries.observe(queries[0], endpoint)
+            self.request_db_time.observe(queries[1], endpoint)
+
+def collect_app_state(registry):
+    """Reads cache and limiter state into the registry's gauges."""
+    from chatbot import chat_list, events, identity, llm
+
+    cache = llm.cache
+    if cache is not None:
+        registry.cache_hits.set(cache.hits + cache.store_hits + cache.coalesced, 'response')
+        registry.cache_misses.set(cache.misses, 'response')
+        registry.cache_entries.set(len(cache.memory), 'response')
+    users = identity.stats()
+    registry.cache_hits.set(users["hits"] + users["request_hits"], 'user')
+    registry.cache_misses.set(users["misses"], 'user')
+    registry.cache_entries.set(users["entries"], 'user')
+    registry.cache_entries.set(len(chat_list.cache), 'chat_list')
+    for path, limiter in (('sync', llm.limiter), ('async', llm.async_limiter)):
+        registry.llm_in_flight.set(limiter.in_flight, path)
+        registry.llm_waiting.set(limiter.waiting, path)
+        registry.llm_waiting_users.set(limiter.queue.users(), path)
+    registry.event_subscribers.set(events.broker.subscribers())
+    registry.events_dropped.set(events.broker.dropped)
+
+def current():
+    """Returns the current app's metrics, or None when they are disabled."""
+    return current_app.extensions.get('metrics')
+
+class LLMCall:
+    """
+    Records one upstream model call; used as a context manager around it.
+
+    Errors raised inside are counted by type. `start()` is called once a limiter slot is
+    held: the time until then is the queue wait, and latency is measured from there, so
+    calls rejected as overloaded or over budget only count as errors.
+    """
+
+    def __init__(self, backend, operation):
+        self.metrics = current()
+        self.backend = backend
+        self.operation = operation
+        self.created = time.perf_counter()
+        self.started = None
+        self.chunks = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.llm_queue_wait.observe(self.started - self.created, self.operation)
+
+    def chunk(self):
+        if self.metrics is not None and not self.chunks and self.started is not None:
+            self.metrics.llm_first_chunk.observe(time.perf_counter() - self.started, self.backend)
+        self.chunks += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        metrics = self.metrics
+        if metrics is None:
+            return
+        if self.started is not None:
+            metrics.llm_latency.observe(time.perf_counter() - self.started, self.backend, self.operation)
+        if self.chunks:
+            metrics.llm_chunks.inc(self.chunks, self.backend)
+        # GeneratorExit (a client leaving mid-stream) is not an upstream error
+        if exc_type is not None and issubclass(exc_type, Exception):
+            metrics.llm_errors.inc(1, self.backend, self.operation, exc_type.__name__)
+
+class Metrics:
+    """Flask extension recording request, SQL and LLM metrics and serving them on /metrics."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        if not app.config['METRICS_ENABLED']:
+            app.extensions['metrics'] = None
+            return
+
+        registry = app.extensions['metrics'] = AppMetrics()
+        app.before_request(start_request)
+        app.after_request(record_status)
+        app.teardown_request(finish_request)
+        app.add_url_rule('/metrics', 'metrics', export)
+
+        from chatbot import db
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', lambda *args: after_cursor_execute(registry, *args))
+        event.listen(engine, 'handle_error', cursor_failed)
+
+def start_request():
+    metrics = current()
+    if metrics is not None:
+        metrics.request_started()
+        g._metrics_started = time.perf_counter()
+        g._metrics_queries = [0, 0.0]
+
+def record_status(response):
+    g._metrics_status = response.status_code
+    return response
+
+def finish_request(error=None):
+    # Runs after a streamed body is fully sent, so streams are timed to their end
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = g.pop('_metrics_status', 500)
+    current().request_finished(endpoint, request.method, status, time.perf_counter() - started,
+                               g.pop('_metrics_queries', None))
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(registry, conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['metrics_query_started'].pop()
+    registry.queries.inc()
+    registry.query_time.observe(seconds)
+    if has_request_context():
+        queries = g.get('_metrics_queries')
+        if queries is not None:
+            queries[0] += 1
+            queries[1] += seconds
+
+def cursor_failed(exception_context):
+    # A failed statement gets no after_cursor_execute, so drop its start time here
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('metrics_query_started'):
+        conn.info['metrics_query_started'].pop()
+
+# Addresses allowed to scrape /metrics when no METRICS_TOKEN is set
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+
+def export():
+    """Serves the metrics in the Prometheus text format, to holders of METRICS_TOKEN or to localhost."""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            abort(401)
+    elif request.remote_addr not in LOOPBACK_ADDRESSES:
+        abort(403)
+    return Response(current().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
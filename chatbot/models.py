@@ -2,6 +2,7 @@ from datetime import datetime
 from chatbot import db
 from flask_login import UserMixin
 from sqlalchemy.sql import func
+from chatbot.search import register_schema
 
 class User(UserMixin, db.Model):
     """
@@ -43,19 +44,37 @@ class RecentChats(db.Model):
         recent_time (datetime): Timestamp when the chat was started.
         user_id (int): Foreign key referencing the user.
         title (str): Title of the recent chat.
+        summary (str): Rolling summary of the turns too old to fit in the prompt context.
+        summary_upto_id (int): Id of the last message folded into the summary.
+        archive_segment (str): Segment file holding the messages of an archived chat.
+        archive_offset (int): Byte offset of the chat's record in the segment.
+        archive_length (int): Compressed length of the record.
+        archived_at (datetime): When the chat was archived.
     """
     __tablename__ = 'recent_chats'
+    __table_args__ = (
+        # Serves a user's chat list ordered by time
+        db.Index('ix_recent_chats_user_id_recent_time', 'user_id', 'recent_time'),
+    )
 
     recent_id = db.Column(db.Integer, primary_key=True)
     recent_time = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(20), nullable=False)
+    summary = db.Column(db.Text, nullable=True)
+    summary_upto_id = db.Column(db.Integer, nullable=True)
+    # Set while the chat's messages live in cold storage (see chatbot/archive.py)
+    archive_segment = db.Column(db.String(64), nullable=True)
+    archive_offset = db.Column(db.BigInteger, nullable=True)
+    archive_length = db.Column(db.Integer, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=True)
 
     # Relationship to User
     user = db.relationship('User', back_populates='recent_chats')
 
-    # Relationship to ChatMessages
-    messages = db.relationship('ChatMessages', backref='recent_chat', lazy=True)
+    # Relationship to ChatMessages; the database deletes a chat's messages along with it
+    messages = db.relationship('ChatMessages', backref='recent_chat', lazy=True,
+                               cascade='all, delete-orphan', passive_deletes=True)
 
 class ChatMessages(db.Model):
     """
@@ -69,13 +88,22 @@ class ChatMessages(db.Model):
         timestamp (datetime): Timestamp when the message was sent.
     """
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Serves the history of a chat in id order, which the keyset pagination relies on
+        db.Index('ix_chat_messages_recent_id_id', 'recent_id', 'id'),
+        # Ids are never reused on SQLite, so archived messages can be restored under theirs
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    recent_id = db.Column(db.Integer, db.ForeignKey('recent_chats.recent_id'), nullable=False)
+    recent_id = db.Column(db.Integer, db.ForeignKey('recent_chats.recent_id', ondelete='CASCADE'), nullable=False)
     sender = db.Column(db.String(50), nullable=False)  # 'user' or 'ai'
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Full-text index over message text, created with the table on SQLite
+register_schema(ChatMessages.__table__)
+
 class OAuth(db.Model):
     """
     OAuth model for managing OAuth tokens linked to users.
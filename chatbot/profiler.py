@@ -0,0 +1,230 @@
+"""
+Opt-in request profiling and the slow-query log.
+
+A request is profiled with cProfile when PROFILE_REQUESTS is on, or when it carries a
+PROFILE_HEADER with a token signed with the app's secret key (`flask profile token`
+prints one). The top PROFILE_TOP_N functions by cumulative time are kept in memory under
+a request id generated by the server and sent back in `X-Request-Id`. An id the client
+sent in that header is recorded next to it for correlation, never used as the key. Only
+one request per process is profiled at a time; others arriving meanwhile are served
+normally.
+
+Every SQL statement slower than SLOW_QUERY_MS is logged with its duration, the shape of
+its parameters (types only, never values) and the view or thread that ran it. Recent
+profiles and slow queries are listed at /admin/profiles.
+"""
+import cProfile
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+import click
+from flask import current_app, g, has_request_context, request
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event
+
+# cProfile can't trace two requests of one process at once
+_profile_lock = threading.Lock()
+
+# Characters kept of a slow statement's SQL
+STATEMENT_MAX_LENGTH = 2000
+
+def token_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='chatbot-profile')
+
+def make_token():
+    """Returns a token that enables profiling for requests sending it in PROFILE_HEADER."""
+    return token_serializer().dumps('profile')
+
+def wants_profile():
+    """Checks whether the current request should be profiled."""
+    config = current_app.config
+    if config['PROFILE_REQUESTS']:
+        return True
+    token = request.headers.get(config['PROFILE_HEADER'])
+    if not token:
+        return False
+    try:
+        token_serializer().loads(token, max_age=config['PROFILE_TOKEN_MAX_AGE'])
+    except BadSignature:  # Also raised for expired tokens
+        return False
+    return True
+
+def request_id():
+    """Returns the current request's id, generated here so clients can't pick profile keys."""
+    if 'request_id' not in g:
+        g.request_id = uuid.uuid4().hex
+    return g.request_id
+
+def client_request_id():
+    """Returns the well-formed X-Request-Id the client sent, or None."""
+    incoming = request.headers.get('X-Request-Id', '')
+    return incoming if re.fullmatch(r'[\w.-]{1,64}', incoming) else None
+
+def top_functions(profile, limit):
+    """Returns the `limit` functions with the highest cumulative time, and the total time."""
+    stats = pstats.Stats(profile)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    functions = [{
+        "function": pstats.func_std_string(func),
+        "calls": calls,
+        "primitive_calls": primitive_calls,
+        "total_time": round(total_time, 6),
+        "cumulative_time": round(cumulative_time, 6),
+    } for func, (primitive_calls, calls, total_time, cumulative_time, _) in rows]
+    return functions, stats.total_tt
+
+def parameters_shape(parameters, executemany=False):
+    """Describes statement parameters by type, so message text and emails never reach the log."""
+    if executemany:
+        if not parameters:
+            return "0 rows"
+        return f"{len(parameters)} rows of {parameters_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+    return type(parameters).__name__
+
+class Profiler:
+    """Flask extension for request profiles and the slow-query log."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_REQUESTS', False)
+        app.config.setdefault('PROFILE_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILE_TOKEN_MAX_AGE', 3600)
+        app.config.setdefault('PROFILE_TOP_N', 30)
+        app.config.setdefault('PROFILE_MAX_ENTRIES', 50)
+        app.config.setdefault('SLOW_QUERY_MS', 200)
+        app.config.setdefault('SLOW_QUERY_MAX_ENTRIES', 200)
+        app.extensions['profiler'] = {
+            'profiles': OrderedDict(),
+            'slow_queries': deque(maxlen=app.config['SLOW_QUERY_MAX_ENTRIES']),
+            'lock': threading.Lock(),
+        }
+
+        app.before_request(start_profile)
+        app.after_request(tag_profiled_response)
+        app.teardown_request(finish_profile)
+
+        if app.config['SLOW_QUERY_MS'] > 0:
+            from chatbot import db
+            with app.app_context():
+                engine = db.engine
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', lambda *args: after_cursor_execute(app, *args))
+            event.listen(engine, 'handle_error', cursor_failed)
+
+    @property
+    def state(self):
+        return current_app.extensions['profiler']
+
+    def profiles(self):
+        """Returns the stored profiles, newest first, without their function tables."""
+        with self.state['lock']:
+            profiles = list(self.state['profiles'].values())
+        return [{key: value for key, value in profile.items() if key != 'functions'} for profile in reversed(profiles)]
+
+    def get(self, request_id):
+        """Returns one stored profile, or None."""
+        with self.state['lock']:
+            return self.state['profiles'].get(request_id)
+
+    def slow_queries(self):
+        """Returns the recent slow queries, newest first."""
+        with self.state['lock']:
+            return list(reversed(self.state['slow_queries']))
+
+    def add_profile(self, profile):
+        state = self.state
+        with state['lock']:
+            profiles = state['profiles']
+            profiles[profile['request_id']] = profile
+            while len(profiles) > current_app.config['PROFILE_MAX_ENTRIES']:
+                profiles.popitem(last=False)
+
+def start_profile():
+    if not wants_profile() or not _profile_lock.acquire(blocking=False):
+        return
+    profile = cProfile.Profile()
+    g._profile = (profile, time.perf_counter(), datetime.utcnow())
+    profile.enable()
+
+def tag_profiled_response(response):
+    if '_profile' in g:
+        response.headers['X-Request-Id'] = request_id()
+        g._profile_status = response.status_code
+    return response
+
+def finish_profile(error=None):
+    # Runs after a streamed body is fully sent, so streams are profiled to their end
+    started = g.pop('_profile', None)
+    if started is None:
+        return
+    profile, started_at, created_at = started
+    try:
+        profile.disable()
+        duration = time.perf_counter() - started_at
+    finally:
+        _profile_lock.release()
+
+    from chatbot import profiler
+    functions, profiled_time = top_functions(profile, current_app.config['PROFILE_TOP_N'])
+    profiler.add_profile({
+        "request_id": request_id(),
+        "client_request_id": client_request_id(),
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": g.pop('_profile_status', 500),
+        "created_at": created_at.isoformat(),
+        "duration": round(duration, 6),
+        "profiled_time": round(profiled_time, 6),
+        "functions": functions,
+    })
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profiler_query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(app, conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info['profiler_query_started'].pop()) * 1000
+    if duration_ms < app.config['SLOW_QUERY_MS']:
+        return
+
+    in_request = has_request_context()
+    entry = {
+        "time": datetime.utcnow().isoformat(),
+        "duration_ms": round(duration_ms, 2),
+        "statement": statement[:STATEMENT_MAX_LENGTH],
+        "parameters": parameters_shape(parameters, executemany),
+        # Background work (title workers, the purge thread) is attributed to its thread
+        "view": (request.endpoint or request.path) if in_request else threading.current_thread().name,
+        "request_id": request_id() if in_request else None,
+        "client_request_id": client_request_id() if in_request else None,
+    }
+    app.logger.warning("Slow query (%.1f ms) in %s: %s %s", duration_ms, entry["view"],
+                       entry["statement"], entry["parameters"])
+    state = app.extensions['profiler']
+    with state['lock']:
+        state['slow_queries'].append(entry)
+
+def cursor_failed(exception_context):
+    # A failed statement gets no after_cursor_execute, so drop its start time here
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('profiler_query_started'):
+        conn.info['profiler_query_started'].pop()
+
+profile_cli = AppGroup('profile', help="Profile requests.")
+
+@profile_cli.command('token')
+def token_command():
+    """Prints a header that makes a request profiled, valid for PROFILE_TOKEN_MAX_AGE seconds."""
+    click.echo(f"{current_app.config['PROFILE_HEADER']}: {make_token()}")
@@ -0,0 +1,146 @@
+"""
+Chat deletion and the background purge of empty or stale chats.
+
+Chats are deleted with set-based statements: one DELETE for the messages of a batch of
+chats and one for the chats themselves, instead of loading every row into the session.
+A periodic job, also available as `flask chats purge`, removes chats that never got a
+message and, when configured, chats with no activity for a number of days. It works in
+bounded batches, each in its own short transaction, so it never holds the database write
+lock for long.
+"""
+import threading
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+
+def delete_chats(recent_ids, user_id=None):
+    """
+    Deletes chats and all their messages. Returns the number of chats deleted.
+
+    When `user_id` is given, only chats owned by that user are deleted. The caller commits.
+    """
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    chats = RecentChats.query.filter(RecentChats.recent_id.in_(recent_ids))
+    if user_id is not None:
+        chats = chats.filter(RecentChats.user_id == user_id)
+
+    # Messages go first, so this also works on databases created before the cascade
+    owned = chats.with_entities(RecentChats.recent_id).scalar_subquery()
+    ChatMessages.query.filter(ChatMessages.recent_id.in_(owned)).delete(synchronize_session=False)
+    return chats.delete(synchronize_session=False)
+
+def purgeable_chats(limit, empty_before, stale_before=None):
+    """
+    Returns the ids of up to `limit` chats to purge.
+
+    These are chats without messages created before `empty_before` and, if `stale_before`
+    is given, chats whose newest message is older than it. Archived chats are kept.
+    """
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    has_messages = (db.session.query(ChatMessages.id)
+                    .filter(ChatMessages.recent_id == RecentChats.recent_id)
+                    .exists())
+    condition = db.and_(~has_messages, RecentChats.archive_segment.is_(None), RecentChats.recent_time < empty_before)
+    if stale_before is not None:
+        recent_activity = (db.session.query(ChatMessages.id)
+                           .filter(ChatMessages.recent_id == RecentChats.recent_id,
+                                   ChatMessages.timestamp >= stale_before)
+                           .exists())
+        condition = db.or_(condition, db.and_(has_messages, ~recent_activity, RecentChats.recent_time < stale_before))
+
+    rows = (db.session.query(RecentChats.recent_id)
+            .filter(condition)
+            .order_by(RecentChats.recent_id)
+            .limit(limit))
+    return [recent_id for recent_id, in rows]
+
+def purge_cutoffs(config, now=None):
+    """Returns the (empty_before, stale_before) cutoffs for the configured ages."""
+    now = now or datetime.utcnow()
+    empty_before = now - timedelta(seconds=config['PURGE_EMPTY_AFTER'])
+    stale_days = config['PURGE_STALE_AFTER_DAYS']
+    return empty_before, (now - timedelta(days=stale_days) if stale_days else None)
+
+def purge_batch(batch_size, empty_before, stale_before=None):
+    """Deletes one batch of purgeable chats in its own transaction. Returns the number deleted."""
+    from chatbot import chat_list, db
+    from chatbot.models import RecentChats
+
+    recent_ids = purgeable_chats(batch_size, empty_before, stale_before)
+    if not recent_ids:
+        return 0
+    user_ids = [user_id for user_id, in (db.session.query(RecentChats.user_id)
+                                         .filter(RecentChats.recent_id.in_(recent_ids))
+                                         .distinct())]
+    deleted = delete_chats(recent_ids)
+    db.session.commit()
+    for user_id in user_ids:
+        chat_list.invalidate(user_id)
+    return deleted
+
+def purge(config, max_batches=0):
+    """Purges chats in batches until none are left or `max_batches` is reached. Returns the total."""
+    empty_before, stale_before = purge_cutoffs(config)
+    batches = total = 0
+    while not max_batches or batches < max_batches:
+        deleted = purge_batch(config['PURGE_BATCH_SIZE'], empty_before, stale_before)
+        if not deleted:
+            break
+        batches += 1
+        total += deleted
+    return total
+
+class Purger:
+    """Flask extension running the chat purge on a background thread every PURGE_INTERVAL seconds."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PURGE_INTERVAL', 3600)
+        app.config.setdefault('PURGE_BATCH_SIZE', 500)
+        app.config.setdefault('PURGE_EMPTY_AFTER', 3600)
+        app.config.setdefault('PURGE_STALE_AFTER_DAYS', 0)
+
+        stop = threading.Event()
+        app.extensions['purge'] = stop
+        if app.config['PURGE_INTERVAL'] > 0:
+            thread = threading.Thread(target=self._loop, args=(app, stop), name='chat-purge', daemon=True)
+            thread.start()
+
+    def _loop(self, app, stop):
+        # The first run waits a full interval, so short-lived processes like CLI commands never purge
+        while not stop.wait(app.config['PURGE_INTERVAL']):
+            with app.app_context():
+                try:
+                    deleted = purge(app.config)
+                    if deleted:
+                        app.logger.info("Purged %s empty or stale chats", deleted)
+                except Exception:
+                    app.logger.exception("Purging chats failed")
+
+    def stop(self, app):
+        """Stops the app's purge thread after its current batch."""
+        app.extensions['purge'].set()
+
+chats_cli = AppGroup('chats', help="Maintain stored chats.")
+
+@chats_cli.command('purge')
+@click.option('--batch-size', type=int, default=None, help="Chats deleted per transaction (default PURGE_BATCH_SIZE).")
+@click.option('--max-batches', default=0, help="Stop after this many batches (0 means until done).")
+@click.option('--stale-days', type=int, default=None, help="Also purge chats idle this many days (default PURGE_STALE_AFTER_DAYS, 0 disables).")
+def purge_command(batch_size, max_batches, stale_days):
+    """Deletes empty chats and, optionally, stale ones."""
+    from flask import current_app
+
+    config = dict(current_app.config)
+    if batch_size is not None:
+        config['PURGE_BATCH_SIZE'] = batch_size
+    if stale_days is not None:
+        config['PURGE_STALE_AFTER_DAYS'] = stale_days
+    click.echo(f"Purged {purge(config, max_batches)} chats")
@@ -0,0 +1,162 @@
+"""
+Full-text search over chat history.
+
+On SQLite, message text is indexed in an FTS5 table using `chat_messages` as external
+content, so the text isn't stored twice. Triggers keep the index in sync as messages are
+inserted, updated and deleted, including set-based and cascading deletes. Search results
+are ranked with bm25 and grouped by chat. `flask search rebuild` reindexes existing data.
+
+Other databases fall back to a LIKE scan scoped to the user's chats.
+"""
+import html
+import re
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DDL, event, text
+
+# Statements creating the index and its sync triggers; mirrored in the migration
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5("
+    "message, content='chat_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF message ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+    "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END",
+]
+
+# Snippet markers outside anything users type, replaced with <mark> after escaping
+MARK_START, MARK_END = '\x02', '\x03'
+
+# Tokens of the snippet window around the best match
+SNIPPET_TOKENS = 12
+
+# Matching messages shown per chat
+MATCHES_PER_CHAT = 3
+
+def register_schema(table):
+    """Creates the FTS index along with the chat_messages table on SQLite, e.g. in `create_all`."""
+    for statement in FTS_SCHEMA:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+def fts_query(query):
+    """
+    Turns free text into an FTS5 query matching all of its words.
+
+    Every word is quoted so FTS5 operators in user input are searched literally; the last
+    one matches as a prefix, so results update while the user is typing.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def highlight(snippet):
+    """Escapes a snippet for HTML and turns the match markers into <mark> tags."""
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def search_messages(user_id, query, limit=20):
+    """
+    Searches a user's messages and returns matching chats, best first.
+
+    Each result has the chat's recent_id, title and recent_time, its best rank and up to
+    MATCHES_PER_CHAT matching messages with highlighted snippets.
+    """
+    from chatbot import db
+
+    if db.engine.dialect.name == 'sqlite':
+        rows = fts_matches(user_id, query, limit)
+    else:
+        rows = like_matches(user_id, query, limit)
+
+    # Rows come best first, so each chat is ranked by its best message
+    chats = {}
+    for recent_id, title, recent_time, message_id, sender, snippet, rank in rows:
+        if recent_id not in chats:
+            if len(chats) == limit:
+                continue
+            chats[recent_id] = {
+                "recent_id": recent_id,
+                "title": title,
+                "recent_time": recent_time.isoformat() if hasattr(recent_time, 'isoformat') else recent_time,
+                "rank": rank,
+                "matches": [],
+            }
+        matches = chats[recent_id]["matches"]
+        if len(matches) < MATCHES_PER_CHAT:
+            matches.append({"id": message_id, "sender": sender, "snippet": highlight(snippet)})
+    return list(chats.values())
+
+def fts_matches(user_id, query, limit):
+    """Returns ranked matching messages from the FTS5 index, best first."""
+    from chatbot import db
+
+    match = fts_query(query)
+    if match is None:
+        return []
+    # Fetch enough messages to fill `limit` chats with a few matches each
+    return db.session.execute(text(
+        "SELECT r.recent_id, r.title, r.recent_time, m.id, m.sender, "
+        "snippet(chat_messages_fts, 0, :start, :end, '…', :tokens), bm25(chat_messages_fts) AS rank "
+        "FROM chat_messages_fts "
+        "JOIN chat_messages m ON m.id = chat_messages_fts.rowid "
+        "JOIN recent_chats r ON r.recent_id = m.recent_id "
+        "WHERE chat_messages_fts MATCH :match AND r.user_id = :user_id "
+        "ORDER BY rank LIMIT :rows"
+    ).columns(recent_time=db.DateTime), {
+        "start": MARK_START, "end": MARK_END, "tokens": SNIPPET_TOKENS,
+        "match": match, "user_id": user_id, "rows": limit * MATCHES_PER_CHAT,
+    }).all()
+
+def like_matches(user_id, query, limit):
+    """Returns messages containing the query text, newest first, for databases without FTS5."""
+    from chatbot.models import ChatMessages, RecentChats
+
+    query = query.strip()
+    if not query:
+        return []
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    rows = (ChatMessages.query
+            .join(RecentChats, RecentChats.recent_id == ChatMessages.recent_id)
+            .filter(RecentChats.user_id == user_id, ChatMessages.message.ilike(pattern, escape='\\'))
+            .order_by(ChatMessages.id.desc())
+            .limit(limit * MATCHES_PER_CHAT)
+            .with_entities(RecentChats.recent_id, RecentChats.title, RecentChats.recent_time,
+                           ChatMessages.id, ChatMessages.sender, ChatMessages.message))
+    return [(*row[:5], excerpt(row[5], query), 0.0) for row in rows]
+
+def excerpt(message, query, width=80):
+    """Returns the part of a message around the first occurrence of `query`, with match markers."""
+    start = message.lower().find(query.lower())
+    if start < 0:
+        return message[:width]
+    end = start + len(query)
+    before = max(0, start - width // 2)
+    return (('…' if before else '') + message[before:start] + MARK_START + message[start:end] + MARK_END
+            + message[end:end + width // 2] + ('…' if end + width // 2 < len(message) else ''))
+
+def rebuild_index():
+    """Creates the FTS index if needed and reindexes every message. Returns the number indexed."""
+    from chatbot import db
+
+    for statement in FTS_SCHEMA:
+        db.session.execute(text(statement))
+    db.session.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
+    db.session.commit()
+    return db.session.execute(text("SELECT count(*) FROM chat_messages")).scalar()
+
+search_cli = AppGroup('search', help="Manage the chat search index.")
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuilds the full-text index from the stored messages."""
+    from chatbot import db
+
+    if db.engine.dialect.name != 'sqlite':
+        click.echo("Full-text indexing needs SQLite; search uses LIKE on this database")
+        return
+    click.echo(f"Indexed {rebuild_index()} messages")
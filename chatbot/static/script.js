@@ -15,34 +15,49 @@ document.addEventListener("DOMContentLoaded", async () => {
 });
 
 /**
- * Simulates the typing effect for AI messages with markdown parsing and syntax highlighting.
+ * Renders a finished AI message with markdown parsing and syntax highlighting.
+ * @param {HTMLElement} aiMessageDiv - The div element that contains the AI message.
+ * @param {string} aiMessage - The complete AI response message.
+ */
+function renderAiMessage(aiMessageDiv, aiMessage) {
+  let aiResponse = marked.parse(aiMessage); // Markdown parsing
+  let languageMatch = aiResponse.match(/```(\w+)/); // Regex to detect language
+  if (languageMatch) {
+    aiResponse = aiResponse.replace(
+      /```(\w+)([\s\S]*?)```/g,
+      `<pre><code class="language-$1">$2</code></pre>`
+    );
+  }
+
+  aiMessageDiv.innerHTML = aiResponse; // Inject parsed response with markdown
+  Prism.highlightAll(); // Apply syntax highlighting once the full response arrived
+}
+
+/**
+ * Reads the streamed AI response chunk by chunk and shows it as it arrives.
+ * @async
+ * @param {Response} response - The streaming fetch response from `/chat/stream`.
  * @param {HTMLElement} aiMessageDiv - The div element that will contain the AI message.
- * @param {string} aiMessage - The AI response message.
  * @param {HTMLElement} conversationBox - The conversation box to scroll to the latest message.
+ * @returns {Promise<string>} The complete AI response message.
  */
-function streamer(aiMessageDiv, aiMessage, conversationBox) {
-  let length = 0;
-  const interval = setInterval(() => {
-    aiMessageDiv.textContent += aiMessage[length++];
-    if (length >= aiMessage.length) {
-      clearInterval(interval);
-
-      // After the typing effect is complete, parse and highlight the content
-      let aiResponse = marked.parse(aiMessageDiv.textContent); // Markdown parsing
-      let languageMatch = aiResponse.match(/```(\w+)/); // Regex to detect language
-      if (languageMatch) {
-        let language = languageMatch[1]; // Extract language (e.g., 'javascript')
-        aiResponse = aiResponse.replace(
-          /```(\w+)([\s\S]*?)```/g,
-          `<pre><code class="language-$1">$2</code></pre>`
-        );
-      }
-
-      aiMessageDiv.innerHTML = aiResponse; // Inject parsed response with markdown
-      Prism.highlightAll(); // Apply syntax highlighting after the content is fully typed
-    }
+async function readStream(response, aiMessageDiv, conversationBox) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let aiMessage = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    aiMessage += decoder.decode(value, { stream: true });
+    aiMessageDiv.textContent = aiMessage; // Plain text while streaming
     conversationBox.scrollTop = conversationBox.scrollHeight;
-  }, 0.001);
+  }
+  aiMessage += decoder.decode();
+
+  renderAiMessage(aiMessageDiv, aiMessage);
+  conversationBox.scrollTop = conversationBox.scrollHeight;
+  return aiMessage;
 }
 
 /**
@@ -53,9 +68,9 @@ async function sendMessage() {
   let input = document.getElementById("messageInput");
   let message = input.value.trim();
   input.value = ""; // Clear the input
-  let recentId = localStorage.getItem("recent_id"); // Retrieve `recent_id` from localStorage
+  let recentId = localStorage.getItem("recent_id"); // Retrieve `recent_id` from localStorage; unset for a new chat
 
-  if (message !== "" && recentId !== null) {
+  if (message !== "") {
     let conversationBox = document.getElementById("conversationBox");
 
     // Append user's message
@@ -101,17 +116,23 @@ async function sendMessage() {
     conversationBox.appendChild(aiParentDiv);
     conversationBox.scrollTop = conversationBox.scrollHeight;
 
-    // Send the message to the backend
-    const response = await fetch("/chat", {
+    // Send the message to the backend and stream the response back
+    const response = await fetch("/chat/stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({ message: message, recent_id: recentId }),
     });
 
-    const data = await response.json();
+    if (response.ok && response.body) {
+      // The first message of a new chat creates it on the server
+      const savedId = response.headers.get("X-Recent-Id");
+      if (!recentId && savedId) {
+        localStorage.setItem("recent_id", savedId);
+        conversationBox.dataset.recentId = savedId;
+        addChatItem(savedId);
+      }
 
-    if (data.response) {
-      // Remove animation before showing the AI response
+      // Remove animation as soon as the first bytes can be shown
       aiParentDiv.removeChild(animationDiv);
 
       // Create AI message div for the response
@@ -128,45 +149,90 @@ async function sendMessage() {
         "break-all"
       );
       aiParentDiv.appendChild(aiMessageDiv);
-      streamer(aiMessageDiv, data.response, conversationBox);
+      // The chat title is generated on the server and arrives over the event stream
+      await readStream(response, aiMessageDiv, conversationBox);
+    } else {
+      aiParentDiv.removeChild(animationDiv);
+      if (response.status === 404) {
+        localStorage.removeItem("recent_id"); // The chat is gone; the next message starts a new one
+      }
+      const data = await response.json().catch(() => ({}));
+      showFlashMessage(data.error || "Could not get a response. Please try again.", "error", 3000);
+    }
+  }
+}
 
-      // Update the chat title if it's the first user query
-      const recentChatsList = document.querySelector(".recent-chats ul");
-      const newChatItem = recentChatsList.querySelector(
-        `li.chat-item[data-id='${recentId}']`
-      );
+/**
+ * Subscribes to the server's event stream for the logged-in user and updates
+ * chat titles in the sidebar as they are generated in the background.
+ * @listens title
+ */
+document.addEventListener("DOMContentLoaded", () => {
+  const recentChatsList = document.getElementById("recentChatsList");
+  const userId = recentChatsList ? recentChatsList.dataset.userId : null;
+  if (!userId || !window.EventSource) {
+    return;
+  }
 
-      if (newChatItem && !newChatItem.dataset.titleSet) {
-        const titleResponse = await fetch("/generate/title", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ response: data.response }),
-        });
-        const titleData = await titleResponse.json();
-
-        if (titleData.success && titleData.title) {
-          const is_saved = await fetch("/save/title", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-              recent_id: recentId,
-              chat_title: titleData.title,
-            }),
-          });
-          const saved = await is_saved.json();
-          if (saved.success) {
-            const chatTitleSpan = newChatItem.querySelector("button.load-chat");
-            chatTitleSpan.textContent = titleData.title; // Update the title
-            newChatItem.dataset.titleSet = "true"; // Mark as title set
-          }
-        }
-      }
+  const events = new EventSource(`/stream?channel=user.${userId}`);
+  events.addEventListener("title", (event) => {
+    const data = JSON.parse(event.data);
+    const chatItem = recentChatsList.querySelector(
+      `li.chat-item[data-id='${data.recent_id}']`
+    );
+    if (chatItem) {
+      chatItem.querySelector("button.load-chat").textContent = data.title;
     }
+  });
+});
+
+/**
+ * Builds the DOM element for one stored chat message.
+ * @param {{sender: string, message: string}} chat - The message returned by the API.
+ * @returns {HTMLElement} The wrapper element to insert into the conversation box.
+ */
+function createMessageElement(chat) {
+  let messageDiv = document.createElement("div");
+  messageDiv.classList.add(
+    "message",
+    chat.sender === "user" ? "user-message" : "ai-message",
+    chat.sender === "user" ? "bg-blue-500" : "bg-gray-700",
+    chat.sender === "user" ? "text-white-300" : "text-white-800",
+    "p-3",
+    "rounded-md",
+    "mb-2",
+    "max-w-xl",
+    "break-all"
+  );
+
+  if (chat.sender === "user") {
+    messageDiv.textContent = chat.message; // Plain text for user messages
+  } else {
+    // Handle AI response with syntax highlighting
+    let aiResponse = marked.parse(chat.message); // Markdown parsing
+    let languageMatch = aiResponse.match(/```(\w+)/); // Regex to detect language
+    if (languageMatch) {
+      aiResponse = aiResponse.replace(
+        /```(\w+)([\s\S]*?)```/g,
+        `<pre><code class="language-$1">$2</code></pre>`
+      );
+    }
+    messageDiv.innerHTML = aiResponse; // Add AI's formatted response
+  }
+
+  let parentDiv = document.createElement("div");
+  if (chat.sender === "user") {
+    parentDiv.classList.add("flex", "items-end", "relative", "justify-end");
+  } else {
+    parentDiv.classList.add("flex", "items-start", "relative");
   }
+  parentDiv.appendChild(messageDiv);
+  return parentDiv;
 }
 
 /**
  * Loads a previous chat based on the `recent_id`.
+ * Only the newest page of messages is fetched; older pages load on scroll.
  * @async
  * @param {string} recentId - The ID of the chat to load.
  */
@@ -181,51 +247,21 @@ async function loadChat(recentId) {
 
   if (data.chat_history && data.chat_history.length > 0) {
     data.chat_history.forEach((chat) => {
-      let messageDiv = document.createElement("div");
-      messageDiv.classList.add(
-        "message",
-        chat.sender === "user" ? "user-message" : "ai-message",
-        chat.sender === "user" ? "bg-blue-500" : "bg-gray-700",
-        chat.sender === "user" ? "text-white-300" : "text-white-800",
-        "p-3",
-        "rounded-md",
-        "mb-2",
-        "max-w-xl",
-        "break-all"
-      );
-
-      if (chat.sender === "user") {
-        messageDiv.textContent = chat.message; // Plain text for user messages
-      } else {
-        // Handle AI response with syntax highlighting
-        let aiResponse = marked.parse(chat.message); // Markdown parsing
-        let languageMatch = aiResponse.match(/```(\w+)/); // Regex to detect language
-        if (languageMatch) {
-          let language = languageMatch[1]; // Extract language (e.g., 'javascript')
-          aiResponse = aiResponse.replace(
-            /```(\w+)([\s\S]*?)```/g,
-            `<pre><code class="language-$1">$2</code></pre>`
-          );
-        }
-        messageDiv.innerHTML = aiResponse; // Add AI's formatted response
-      }
-
-      let parentDiv = document.createElement("div");
-      if (chat.sender === "user") {
-        parentDiv.classList.add("flex", "items-end", "relative", "justify-end");
-      } else {
-        parentDiv.classList.add("flex", "items-start", "relative");
-      }
-      parentDiv.appendChild(messageDiv);
-      conversationBox.appendChild(parentDiv);
+      conversationBox.appendChild(createMessageElement(chat));
     });
 
+    // Remember the cursor for loading older messages on scroll
+    conversationBox.dataset.recentId = recentId;
+    conversationBox.dataset.firstId = data.first_id;
+    conversationBox.dataset.hasMore = data.has_more ? "true" : "false";
+
     // Automatically scroll to the latest message
     conversationBox.scrollTop = conversationBox.scrollHeight;
 
     // Apply syntax highlighting to all code blocks
     Prism.highlightAll();
   } else {
+    conversationBox.dataset.hasMore = "false";
     let noMessagesDiv = document.createElement("div");
     noMessagesDiv.classList.add("message", "p-2", "rounded-md", "mb-2");
     noMessagesDiv.textContent = "Hey there, How can I help you today?";
@@ -240,58 +276,88 @@ async function loadChat(recentId) {
 }
 
 /**
- * Creates a new chat session.
- * Sends a request to create a new chat and initializes the conversation box.
+ * Loads the page of messages preceding the oldest one shown and prepends it,
+ * keeping the current scroll position.
  * @async
  */
-async function createNewChat() {
-  const conversationBox = document.getElementById("conversationBox");
-  if (!conversationBox) {
-    console.error(
-      "Conversation box is not available. Ensure the page is fully loaded."
-    );
+async function loadOlderMessages() {
+  let conversationBox = document.getElementById("conversationBox");
+  if (conversationBox.dataset.hasMore !== "true" || conversationBox.dataset.loading === "true") {
     return;
   }
+  conversationBox.dataset.loading = "true";
 
   try {
-    const response = await fetch(`/api/new_recent`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ title: "New Chat" }), // Send the title in the request body
-    });
+    const recentId = conversationBox.dataset.recentId;
+    const response = await fetch(
+      `/api/load_chat/${recentId}?before_id=${conversationBox.dataset.firstId}`
+    );
+    const data = await response.json();
 
-    if (!response.ok) {
-      console.error(
-        "Failed to create a new chat session.",
-        await response.text()
-      );
+    // Ignore the page if the user switched chats while it was loading
+    if (recentId !== conversationBox.dataset.recentId || !data.chat_history) {
       return;
     }
 
-    const data = await response.json();
+    const previousHeight = conversationBox.scrollHeight;
+    let fragment = document.createDocumentFragment();
+    data.chat_history.forEach((chat) => {
+      fragment.appendChild(createMessageElement(chat));
+    });
+    conversationBox.insertBefore(fragment, conversationBox.firstChild);
+    conversationBox.scrollTop += conversationBox.scrollHeight - previousHeight;
 
-    if (data.success) {
-      localStorage.setItem("recent_id", data.recent_id);
-      console.log("Created new chat:", data.recent_id);
-      startNewChat(data.recent_id);
-    } else {
-      console.error("Error:", data.error || "Unknown error occurred.");
+    if (data.first_id) {
+      conversationBox.dataset.firstId = data.first_id;
     }
-  } catch (error) {
+    conversationBox.dataset.hasMore = data.has_more ? "true" : "false";
+    Prism.highlightAll();
+  } finally {
+    conversationBox.dataset.loading = "false";
+  }
+}
+
+/**
+ * Loads older messages when the conversation is scrolled to the top.
+ * @listens scroll#conversationBox
+ */
+document.addEventListener("DOMContentLoaded", () => {
+  const conversationBox = document.getElementById("conversationBox");
+
+  if (conversationBox) {
+    conversationBox.addEventListener("scroll", () => {
+      if (conversationBox.scrollTop < 50) {
+        loadOlderMessages();
+      }
+    });
+  }
+});
+
+/**
+ * Starts a new, unsaved chat.
+ * The chat is created on the server when its first message is sent.
+ */
+function createNewChat() {
+  const conversationBox = document.getElementById("conversationBox");
+  if (!conversationBox) {
     console.error(
-      "An error occurred while creating a new chat session:",
-      error
+      "Conversation box is not available. Ensure the page is fully loaded."
     );
+    return;
   }
+
+  localStorage.removeItem("recent_id");
+  startNewChat();
 }
 
 /**
- * Initializes the chat with a welcome message and updates the recent chats list.
- * @param {string} recent_id - The ID of the newly created chat session.
+ * Initializes the conversation box of a new chat with a welcome message.
  */
-function startNewChat(recent_id) {
+function startNewChat() {
   let conversationBox = document.getElementById("conversationBox");
   conversationBox.innerHTML = ""; // Clear conversation box
+  conversationBox.dataset.hasMore = "false"; // Nothing older to load in a new chat
+  delete conversationBox.dataset.recentId;
 
   // Add welcome message
   let welcomeMessageDiv = document.createElement("div");
@@ -304,10 +370,28 @@ function startNewChat(recent_id) {
   welcomeMessageDiv.textContent =
     "ChatBot: Hi there! How can I help you today?";
   conversationBox.appendChild(welcomeMessageDiv);
+}
 
+/**
+ * Adds a chat to the top of the recent chats list.
+ * @param {string} recent_id - The ID of the chat saved by the server.
+ */
+function addChatItem(recent_id) {
   let recentChatsList = document.getElementById("recentChatsList");
+  recentChatsList.insertBefore(
+    createChatItem(recent_id, "New Chat"),
+    recentChatsList.firstChild
+  );
+}
 
-  // Create new <li> for the new chat
+/**
+ * Builds the recent chats list item for one chat.
+ * @param {string} recent_id - The ID of the chat.
+ * @param {string} title - The title shown for the chat.
+ * @returns {HTMLElement} The <li> element to insert into the list.
+ */
+function createChatItem(recent_id, title) {
+  // Create new <li> for the chat
   let newChatItem = document.createElement("li");
   newChatItem.classList.add(
     "chat-item",
@@ -332,7 +416,7 @@ function startNewChat(recent_id) {
     "font-medium",
     "hover:underline"
   );
-  loadChatButton.textContent = "New Chat"; // Set default chat title
+  loadChatButton.textContent = title;
   loadChatButton.setAttribute("onclick", `loadChat('${recent_id}')`);
 
   // Create button to delete the chat
@@ -357,11 +441,59 @@ function startNewChat(recent_id) {
   // Append buttons to the new chat item
   newChatItem.appendChild(loadChatButton);
   newChatItem.appendChild(deleteChatButton);
+  return newChatItem;
+}
 
-  // Insert the new chat item at the top of the list
-  recentChatsList.insertBefore(newChatItem, recentChatsList.firstChild);
+/**
+ * Loads the next page of older chats into the recent chats list.
+ * @async
+ */
+async function loadOlderChats() {
+  const recentChatsList = document.getElementById("recentChatsList");
+  if (recentChatsList.dataset.hasMore !== "true" || recentChatsList.dataset.loading === "true") {
+    return;
+  }
+  recentChatsList.dataset.loading = "true";
+
+  try {
+    // Continue after the oldest chat shown, which stays valid when chats are deleted
+    const items = recentChatsList.querySelectorAll("li.chat-item");
+    const lastItem = items[items.length - 1];
+    const query = lastItem ? `?before_id=${lastItem.dataset.id}` : "";
+    const response = await fetch(`/api/recent_chats${query}`);
+    const data = await response.json();
+    if (!data.recent_chats) {
+      return;
+    }
+
+    data.recent_chats.forEach((chat) => {
+      if (!recentChatsList.querySelector(`li.chat-item[data-id='${chat.recent_id}']`)) {
+        recentChatsList.appendChild(createChatItem(chat.recent_id, chat.title));
+      }
+    });
+    recentChatsList.dataset.hasMore = data.has_more ? "true" : "false";
+  } finally {
+    recentChatsList.dataset.loading = "false";
+  }
 }
 
+/**
+ * Loads older chats when the recent chats list is scrolled near its end.
+ * @listens scroll#recentChatsList
+ */
+document.addEventListener("DOMContentLoaded", () => {
+  const recentChatsList = document.getElementById("recentChatsList");
+  const container = recentChatsList ? recentChatsList.closest(".recent-chats") : null;
+
+  if (container) {
+    container.addEventListener("scroll", () => {
+      if (container.scrollTop + container.clientHeight > container.scrollHeight - 100) {
+        loadOlderChats();
+      }
+    });
+  }
+});
+
 /**
  * Handles the login process with email and password.
  * @async
@@ -398,12 +530,14 @@ function loginWithGoogle(event) {
 }
 
 /**
- * Handles the search functionality for filtering recent chats.
+ * Handles the search functionality: filters the loaded chats by title and
+ * searches the text of all the user's messages on the server.
  * @listens input#searchInput
  */
 document.addEventListener("DOMContentLoaded", () => {
   const searchInput = document.getElementById("searchInput");
   const recentChatsList = document.getElementById("recentChatsList");
+  let searchTimer = null;
 
   if (searchInput) {
     searchInput.addEventListener("input", () => {
@@ -418,10 +552,54 @@ document.addEventListener("DOMContentLoaded", () => {
           chatItem.style.display = "none";
         }
       });
+
+      // Wait for a pause in typing before asking the server
+      clearTimeout(searchTimer);
+      searchTimer = setTimeout(() => searchMessages(searchInput.value.trim()), 250);
     });
   }
 });
 
+/**
+ * Searches the user's messages and lists the matching chats with snippets.
+ * @async
+ * @param {string} query - The text to search for.
+ */
+async function searchMessages(query) {
+  const searchResults = document.getElementById("searchResults");
+  searchResults.innerHTML = "";
+  if (query.length < 2) {
+    searchResults.classList.add("hidden");
+    return;
+  }
+
+  const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+  const data = await response.json();
+  // Ignore results for a query the user has already changed
+  if (!data.results || document.getElementById("searchInput").value.trim() !== query) {
+    return;
+  }
+
+  data.results.forEach((result) => {
+    let item = document.createElement("li");
+    item.classList.add("bg-gray-700", "p-2", "rounded-md", "cursor-pointer");
+    item.addEventListener("click", () => loadChat(String(result.recent_id)));
+
+    let title = document.createElement("div");
+    title.classList.add("font-medium", "text-white");
+    title.textContent = result.title;
+    item.appendChild(title);
+
+    let snippet = document.createElement("div");
+    snippet.classList.add("text-sm", "text-gray-300");
+    snippet.innerHTML = result.matches[0].snippet; // Escaped by the server, with <mark> highlights
+    item.appendChild(snippet);
+
+    searchResults.appendChild(item);
+  });
+  searchResults.classList.toggle("hidden", data.results.length === 0);
+}
+
 /**
  * Deletes a chat session.
  * @async
@@ -461,9 +639,9 @@ async function deleteChat(event, recentId, buttonElement) {
             }
           }
         } else {
-          createNewChat(); // No chats left; create a new chat
+          createNewChat(); // No chats left; start a new chat
         }
-      } else {
+      } else if (currentId) {
         loadChat(currentId); // If not current chat, load it again
       }
 
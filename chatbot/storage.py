@@ -0,0 +1,49 @@
+"""
+Database engine tuning.
+
+SQLite connections get WAL journaling, a busy timeout and a relaxed `synchronous` level
+when they are opened, so readers don't block the writer and short lock waits don't
+fail requests, and foreign keys are enforced, so deleting a chat cascades to its
+messages. Other databases get connection pool settings from the config.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+def is_sqlite(uri):
+    """Checks whether a database URI points at SQLite."""
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+def engine_options(config):
+    """Returns the SQLAlchemy engine options for the configured database."""
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,  # Drop connections the server closed while they sat in the pool
+    }
+
+def sqlite_pragmas(config):
+    """Returns the PRAGMA statements run on every new SQLite connection."""
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        "PRAGMA foreign_keys=ON",  # SQLite ignores ON DELETE CASCADE without it
+    ]
+
+def init_storage(app, db):
+    """Registers the connection hook applying the SQLite pragmas, before any connection is made."""
+    if not is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
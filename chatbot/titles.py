@@ -0,0 +1,227 @@
+"""
+Chat title generation.
+
+Titles are generated in a background worker pool once a chat gets its first AI reply,
+saved on the RecentChats row and pushed to the user's browser over Server-Sent Events.
+Request handlers only schedule the work and never wait for it.
+
+Chats left untitled can be backfilled in batches, packing several chats into one model
+call, through `flask titles backfill` or POST /api/titles/backfill.
+"""
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from chatbot.events import chat_channel, user_channel
+
+# Title given to chats until a generated one is saved
+DEFAULT_TITLE = "New Chat"
+
+# Matches the String(20) length of RecentChats.title
+MAX_TITLE_LENGTH = 20
+
+def build_title_prompt(ai_response):
+    """Returns the prompt asking the model for a title for a conversation response."""
+    return (
+        f"Generate a concise title of at most {MAX_TITLE_LENGTH} characters and just single sentence just the title no other thing for the following conversation response if its not greeting or error message or asking for clarification else just return 'error' no anything else :\n\n"
+        f"Response: {ai_response}\n\n"
+    )
+
+def clean_title(generated):
+    """Returns the generated title if it is usable, otherwise None."""
+    title = generated.strip().strip('"\'*').strip()
+    if not title or len(title) > MAX_TITLE_LENGTH or title.lower() == 'error':
+        return None
+    return title
+
+# Characters of each message included per chat in a batch prompt
+EXCERPT_CHARS = 400
+
+def build_batch_prompt(exchanges):
+    """Returns one prompt asking for a title for each (recent_id, user message, AI reply)."""
+    conversations = "\n\n".join(
+        f"Conversation {recent_id}:\nUser: {user_message[:EXCERPT_CHARS]}\nAI: {ai_reply[:EXCERPT_CHARS]}"
+        for recent_id, user_message, ai_reply in exchanges
+    )
+    return (
+        f"Give each conversation below a concise title of at most {MAX_TITLE_LENGTH} characters. "
+        "Answer only with a JSON object mapping each conversation number to its title, "
+        'for example {"12": "Python decorators", "15": "Trip to Rome"}.\n\n'
+        f"{conversations}\n"
+    )
+
+def parse_batch_titles(text, recent_ids):
+    """
+    Extracts one title per chat from a batch response.
+
+    Accepts a JSON object (optionally inside a code fence) and falls back to lines like
+    `12: Title`. Chats without a usable title are left out of the result.
+    """
+    raw = {}
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            raw = {str(key): value for key, value in json.loads(match.group(0)).items()}
+        except (ValueError, AttributeError):
+            raw = {}
+    if not raw:
+        for line in text.splitlines():
+            line_match = re.match(r"\s*(?:Conversation\s+)?(\d+)\s*[:.)\-]\s*(.+)", line)
+            if line_match:
+                raw[line_match.group(1)] = line_match.group(2)
+
+    titles = {}
+    for recent_id in recent_ids:
+        value = raw.get(str(recent_id))
+        title = shorten_title(value) if isinstance(value, str) else None
+        if title and title.lower() != 'error':
+            titles[recent_id] = title
+    return titles
+
+def shorten_title(text):
+    """Cleans up a title and cuts it to MAX_TITLE_LENGTH characters, on a word boundary when possible."""
+    title = ' '.join(text.split()).strip('"\'*').strip()
+    if len(title) <= MAX_TITLE_LENGTH:
+        return title or None
+    cut = title[:MAX_TITLE_LENGTH + 1].rsplit(' ', 1)[0]
+    return (cut if 0 < len(cut) <= MAX_TITLE_LENGTH else title[:MAX_TITLE_LENGTH]).rstrip(' ,.;:-')
+
+def publish_title(recent_chat):
+    """Pushes a chat's new title to its owner's browsers."""
+    from chatbot import events
+
+    data = {"recent_id": recent_chat.recent_id, "title": recent_chat.title}
+    events.publish(user_channel(recent_chat.user_id), data, type='title')
+    events.publish(chat_channel(recent_chat.recent_id), data, type='title')
+
+def safe_publish(recent_chat):
+    """Publishes a title update, logging instead of failing when the event stream is unavailable."""
+    try:
+        publish_title(recent_chat)
+    except Exception:
+        current_app.logger.warning("Publishing title of chat %s failed", recent_chat.recent_id, exc_info=True)
+
+class TitleWorker:
+    """Flask extension running title generation on a background thread pool."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TITLE_WORKERS', 2)
+        app.extensions['titles'] = ThreadPoolExecutor(
+            max_workers=app.config['TITLE_WORKERS'],
+            thread_name_prefix='title-worker',
+        )
+
+    def schedule(self, recent_id, ai_response):
+        """Queues title generation for a chat from its first AI reply and returns immediately."""
+        app = current_app._get_current_object()
+        return app.extensions['titles'].submit(self._run, app, recent_id, ai_response)
+
+    def _run(self, app, recent_id, ai_response):
+        with app.app_context():
+            try:
+                self.generate(recent_id, ai_response)
+            except Exception:
+                app.logger.exception("Generating title for chat %s failed", recent_id)
+
+    def generate(self, recent_id, ai_response):
+        """Generates, saves and publishes the title of one chat. Returns the title or None."""
+        from chatbot import chat_list, db, llm
+        from chatbot.models import RecentChats
+
+        # Skip chats that already have a title or were deleted
+        recent_chat = db.session.get(RecentChats, recent_id)
+        if recent_chat is None or recent_chat.title != DEFAULT_TITLE:
+            return None
+
+        title = clean_title(llm.generate(build_title_prompt(ai_response)))
+        if not title:
+            return None
+
+        # Don't overwrite a title the user set while the title was being generated
+        db.session.refresh(recent_chat)
+        if recent_chat.title != DEFAULT_TITLE:
+            return None
+        recent_chat.title = title
+        db.session.commit()
+        chat_list.invalidate(recent_chat.user_id)
+
+        publish_title(recent_chat)
+        return title
+
+def untitled_chats(limit, user_id=None):
+    """Returns up to `limit` chats that still have the default title and at least one AI reply."""
+    from chatbot import db
+    from chatbot.models import ChatMessages, RecentChats
+
+    has_reply = (db.session.query(ChatMessages.id)
+                 .filter(ChatMessages.recent_id == RecentChats.recent_id, ChatMessages.sender == 'ai')
+                 .exists())
+    query = RecentChats.query.filter(RecentChats.title == DEFAULT_TITLE, has_reply)
+    if user_id is not None:
+        query = query.filter(RecentChats.user_id == user_id)
+    return query.order_by(RecentChats.recent_id).limit(limit).all()
+
+def first_exchange(recent_id):
+    """Returns the first user message and first AI reply of a chat."""
+    from chatbot.models import ChatMessages
+
+    def first(sender):
+        msg = (ChatMessages.query.filter_by(recent_id=recent_id, sender=sender)
+               .order_by(ChatMessages.id).first())
+        return msg.message if msg else ''
+    return first('user'), first('ai')
+
+def generate_titles_batch(batch_size, user_id=None, user=None):
+    """
+    Titles up to `batch_size` untitled chats with a single model call.
+
+    Chats the response has no usable title for get one derived from their first user
+    message, so every chat in the batch leaves the untitled pool. The model call is queued
+    and budgeted for `user`, like the requests they make themselves. Returns the saved
+    titles by recent_id.
+    """
+    from chatbot import chat_list, db, llm
+
+    chats = untitled_chats(batch_size, user_id)
+    if not chats:
+        return {}
+
+    exchanges = [(chat.recent_id, *first_exchange(chat.recent_id)) for chat in chats]
+    titles = parse_batch_titles(llm.generate(build_batch_prompt(exchanges), user=user), [chat.recent_id for chat in chats])
+
+    for recent_id, user_message, _ in exchanges:
+        if recent_id not in titles:
+            titles[recent_id] = shorten_title(user_message) or "Untitled chat"
+    for chat in chats:
+        chat.title = titles[chat.recent_id]
+    db.session.commit()
+    for user_id in {chat.user_id for chat in chats}:
+        chat_list.invalidate(user_id)
+
+    for chat in chats:
+        safe_publish(chat)
+    return titles
+
+titles_cli = AppGroup('titles', help="Manage chat titles.")
+
+@titles_cli.command('backfill')
+@click.option('--batch-size', default=20, show_default=True, help="Chats titled per model call.")
+@click.option('--max-batches', default=0, help="Stop after this many batches (0 means until done).")
+@click.option('--user-id', type=int, default=None, help="Only backfill this user's chats.")
+def backfill_command(batch_size, max_batches, user_id):
+    """Generates titles for chats still called "New Chat"."""
+    batches = total = 0
+    while not max_batches or batches < max_batches:
+        titles = generate_titles_batch(batch_size, user_id)
+        if not titles:
+            break
+        batches += 1
+        total += len(titles)
+        click.echo(f"Batch {batches}: titled {len(titles)} chats")
+    click.echo(f"Titled {total} chats in {batches} model calls")
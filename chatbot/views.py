@@ -1,18 +1,17 @@
-from flask import Blueprint, flash, redirect, render_template, request, jsonify, session, url_for
-import google.generativeai as genai
+from flask import Blueprint, Response, current_app, flash, redirect, render_template, request, jsonify, stream_with_context, url_for
 from datetime import datetime
-from chatbot.models import RecentChats, ChatMessages, User  # Models for managing chat and user data
-from chatbot import db
-from dotenv import load_dotenv
-import os
+from chatbot.models import RecentChats, ChatMessages  # Models for managing chat and user data
+from chatbot import chat_list, db, identity, llm, title_worker
+from chatbot.chat_list import recent_chats_page
+from chatbot.archive import restore_chat
+from chatbot.context import ContextBuilder, assemble_contents
+from chatbot.history import export_lines, import_lines
+from chatbot.llm import LLMError
+from chatbot.purge import delete_chats
+from chatbot.search import search_messages
+from chatbot.titles import DEFAULT_TITLE, build_title_prompt, clean_title, generate_titles_batch
 from flask_login import login_required, current_user
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure API key for the Generative AI library
-api_key = os.getenv('API_KEY')
-genai.configure(api_key=api_key)
+from werkzeug.http import is_resource_modified
 
 # Blueprint for views
 views = Blueprint('views', __name__)
@@ -55,11 +54,10 @@ def contact():
 def home():
     """Renders the chat page with recent chats for the logged-in user."""
     try:
-        user_id = session.get('user_id')
-        if user_id:
-            user = User.query.get(user_id)
-            recent_chats = RecentChats.query.filter_by(user_id=user.id).all()
-            return render_template('form.html', recent_chats=recent_chats)
+        if current_user.is_authenticated:
+            # Only the newest page is rendered; older chats load as the sidebar scrolls
+            recent_chats, has_more = recent_chats_page(current_user.id)
+            return render_template('form.html', recent_chats=recent_chats, has_more=has_more)
         else:
             return redirect(url_for('auth.login'))  # Redirect to login if not authenticated
     except Exception as e:
@@ -75,12 +73,16 @@ def saved():
         chat_title = received.get('chat_title')
         recent_id = received.get('recent_id')
 
+        if not current_user.is_authenticated:
+            return jsonify({"success": False, "message": "User not logged in"}), 401
+
         if chat_title and recent_id:
-            # Retrieve the recent chat and update its title
-            recent_chat = RecentChats.query.filter_by(recent_id=recent_id).first()
+            # Retrieve the user's recent chat and update its title
+            recent_chat = RecentChats.query.filter_by(recent_id=recent_id, user_id=current_user.id).first()
             if recent_chat:
                 recent_chat.title = chat_title
                 db.session.commit()
+                chat_list.invalidate(recent_chat.user_id)
                 return jsonify({"success": True, "chat_title": chat_title})
             else:
                 return jsonify({"success": False, "message": "Chat not found"}), 404
@@ -92,74 +94,384 @@ def saved():
 
 
 @views.route('/chat', methods=['POST'])
+@login_required
 def chat():
     """Handles user chat by saving the message and generating an AI response."""
+    turn = None
     try:
-        access_token = request.get_json()
-        message = access_token.get('message')
-        recent_id = access_token.get('recent_id')
+        turn = start_chat_turn(request.get_json())
+        if not isinstance(turn, dict):
+            return turn  # Invalid request
+
+        # Generate AI response using Google AI model
+        ai_reply = chat_with_google_ai(turn['contents'])
 
-        if message and recent_id:
-            # Save user message to the database
-            new_message = ChatMessages(recent_id=recent_id, sender='user', message=message, timestamp=datetime.now())
-            db.session.add(new_message)
-            db.session.commit()
+        return finish_chat_turn(turn, ai_reply)
+    except LLMError as e:
+        if isinstance(turn, dict):
+            save_turn(turn, None)  # Keep the user's message; they can retry it
+        return llm_error_response(e)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-            # Generate AI response using Google AI model
-            ai_reply = chat_with_google_ai(message)
+def start_chat_turn(data, summarize=True):
+    """
+    Validates a chat request and builds the prompt.
 
-            # Save AI response to the database
-            new_message = ChatMessages(recent_id=recent_id, sender='ai', message=ai_reply, timestamp=datetime.now())
-            db.session.add(new_message)
-            db.session.commit()
+    Returns the turn state passed on to `finish_chat_turn`, or an error response. A chat
+    is created here when its first message arrives without a recent_id; otherwise nothing
+    is written yet: the whole turn is saved in one transaction once the reply is known.
+    Shared by the sync, streaming and async chat endpoints.
 
-            # Fetch updated chat history
-            messages = ChatMessages.query.filter_by(recent_id=recent_id).order_by(ChatMessages.timestamp.asc()).all()
-            chat_history = [{"sender": msg.sender, "message": msg.message} for msg in messages]
+    With `summarize` off no model call is made: the turn carries the history `window` and
+    the summary update due (`fold`), and the caller completes it with `complete_chat_turn`.
+    """
+    message = data.get('message')
+    recent_id = data.get('recent_id')
 
-            return jsonify({"response": ai_reply, "chat_history": chat_history})
-        else:
-            return jsonify({"success": False, "message": "Invalid message or recent_id"}), 400
+    if not message:
+        return jsonify({"success": False, "message": "Invalid message or recent_id"}), 400
+    if not current_user.is_authenticated:
+        return jsonify({"success": False, "error": "User not logged in"}), 401
+
+    if recent_id:
+        recent_chat = RecentChats.query.filter_by(recent_id=recent_id, user_id=current_user.id).first()
+        if not recent_chat:
+            return jsonify({"success": False, "message": "Chat not found"}), 404
+        restore_chat(recent_chat)  # Bring back the history of an archived chat
+    else:
+        recent_chat = create_chat(current_user.id)
+        recent_id = recent_chat.recent_id
+
+    # Build the prompt from the stored history (this may update the rolling summary)
+    context = {}
+    if summarize:
+        context["contents"] = build_context(recent_chat, message)
+    else:
+        context["window"], context["fold"] = context_builder().prepare(recent_chat, message)
+
+    return {
+        "recent_id": recent_id,
+        "message": message,
+        "timestamp": datetime.now(),
+        "user": llm_user(),
+        "summary": recent_chat.summary,
+        "summary_upto_id": recent_chat.summary_upto_id,
+        "after_id": data.get('after_id'),
+        **context,
+    }
+
+def complete_chat_turn(turn, summary):
+    """
+    Builds the prompt of a turn started with `summarize=False`, given the model's updated
+    summary (None if there was nothing to fold or the call failed). Needs no database.
+    """
+    fold = turn.pop('fold')
+    if fold is not None and summary:
+        turn['summary'], turn['summary_upto_id'] = summary, fold['upto_id']
+    turn['contents'] = assemble_contents(turn['summary'], turn.pop('window'), turn['message'])
+    return turn
+
+def create_chat(user_id, title=DEFAULT_TITLE):
+    """Creates and returns an empty chat for a user."""
+    recent_chat = RecentChats(user_id=user_id, recent_time=datetime.utcnow(), title=title)
+    db.session.add(recent_chat)
+    db.session.commit()
+    chat_list.invalidate(user_id)
+    return recent_chat
+
+def finish_chat_turn(turn, ai_reply):
+    """Saves a turn with its AI reply and returns the response for the chat endpoint."""
+    user_message, ai_message = save_turn(turn, ai_reply)
+
+    # Only return the messages the client hasn't seen yet: everything after its
+    # `after_id` cursor, or just this turn's pair when no cursor is sent
+    after_id = turn['after_id']
+    if after_id is None:
+        after_id = user_message.id - 1
+    messages, has_more = messages_after(turn['recent_id'], int(after_id))
+    chat_history = [serialize_message(msg) for msg in messages]
+
+    return jsonify({
+        "response": ai_reply,
+        "recent_id": turn['recent_id'],  # Identifies the chat created by a first message
+        "chat_history": chat_history,
+        "has_more": has_more,
+        "last_id": ai_message.id,
+    })
+
+def save_turn(turn, ai_reply):
+    """
+    Saves the user message, the AI reply and the updated chat summary in one transaction.
+
+    With `ai_reply` None (the model call failed) only the user message is saved, and the
+    AI message returned is None. Schedules background title generation when this is the
+    chat's first AI reply.
+    """
+    recent_id = turn['recent_id']
+    first_reply = ChatMessages.query.filter_by(recent_id=recent_id, sender='ai').first() is None
+
+    recent_chat = db.session.get(RecentChats, recent_id)
+    recent_chat.summary = turn['summary']
+    recent_chat.summary_upto_id = turn['summary_upto_id']
+
+    user_message = ChatMessages(recent_id=recent_id, sender='user', message=turn['message'], timestamp=turn['timestamp'])
+    db.session.add(user_message)
+    ai_message = None
+    if ai_reply is not None:
+        ai_message = ChatMessages(recent_id=recent_id, sender='ai', message=ai_reply, timestamp=datetime.now())
+        db.session.add(ai_message)
+    db.session.commit()
+
+    if first_reply and ai_reply:
+        title_worker.schedule(recent_id, ai_reply)
+    return user_message, ai_message
+
+@views.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Handles user chat like `chat`, but streams the AI response back as it is generated."""
+    try:
+        turn = start_chat_turn(request.get_json())
+        if not isinstance(turn, dict):
+            return turn  # Invalid request
+        recent_id = turn['recent_id']
+
+        # Wait for the first chunk here, so upstream errors and overload still get a proper status
+        stream = stream_with_google_ai(turn['contents'])
+        first_chunk = next(stream, '')
+    except LLMError as e:
+        save_turn(turn, None)  # Keep the user's message, like `chat` does
+        return llm_error_response(e)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+    def generate():
+        chunks = [first_chunk]
+        completed = False
+        try:
+            yield first_chunk
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+            completed = True
+        except LLMError:
+            # Headers are already sent; end the stream and keep what was generated
+            current_app.logger.exception("AI response stream for chat %s failed", recent_id)
+        finally:
+            stream.close()
+            # Persist the whole reply as one message once the stream ends (or the client goes
+            # away). A complete reply is saved even when empty, as `chat` does; a cut-off one
+            # only if something arrived, but the user's message always is.
+            ai_reply = ''.join(chunks)
+            save_turn(turn, ai_reply if completed or ai_reply else None)
+
+    # Chunked plain-text body; disable proxy buffering so chunks reach the browser immediately
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/plain',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'X-Recent-Id': str(recent_id),  # Identifies the chat created by a first message
+        },
+    )
+
 @views.route('/api/new_recent', methods=['POST'])
 def create_new_chat():
     """Creates a new chat and stores it in the database."""
     try:
-        title = request.json.get('title', 'New Chat')  # Default to "New Chat" if no title is provided
-        user_id = session.get('user_id')
+        title = request.json.get('title', DEFAULT_TITLE)  # Default to "New Chat" if no title is provided
 
-        if not user_id:
+        if not current_user.is_authenticated:
             return jsonify({"success": False, "error": "User not logged in"}), 401
 
-        new_recent = RecentChats(user_id=user_id, recent_time=datetime.now(), title=title)
-        db.session.add(new_recent)
-        db.session.commit()
+        new_recent = create_chat(current_user.id, title)
         return jsonify({"success": True, "recent_id": new_recent.recent_id}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@views.route('/api/recent_chats', methods=['GET'])
+@login_required
+def recent_chats():
+    """Returns one page of the user's chats, newest first. `before_id` continues after that chat."""
+    try:
+        chats, has_more = recent_chats_page(
+            current_user.id,
+            before_id=request.args.get('before_id', type=int),
+            limit=request.args.get('limit', type=int),
+        )
+        return jsonify({
+            "recent_chats": chats,
+            "has_more": has_more,
+            "last_id": chats[-1]["recent_id"] if chats else None,
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@views.route('/api/search', methods=['GET'])
+@login_required
+def search():
+    """Searches the user's messages and returns ranked snippets grouped by chat."""
+    try:
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 20, type=int), 50)
+        return jsonify({"query": query, "results": search_messages(current_user.id, query, max(limit, 1))})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@views.route('/api/export', methods=['GET'])
+@login_required
+def export_history():
+    """Streams the user's chats and messages, archived ones included, as NDJSON."""
+    filename = f"chat-history-{datetime.utcnow():%Y%m%d}.ndjson"
+    # The rows are read while the body is sent, so the request context must stay open
+    return Response(stream_with_context(export_lines(current_user.id)), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@views.route('/api/import', methods=['POST'])
+@login_required
+def import_history():
+    """
+    Imports an NDJSON export into the user's account, sent as the request body or as a
+    `file` upload. Chats and messages get new ids, so uploads can't claim or exhaust them.
+    """
+    try:
+        source = request.files['file'].stream if 'file' in request.files else request.stream
+        counts = import_lines(source, user_id=current_user.id, keep_ids=False)
+        return jsonify({"success": True, **counts})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @views.route('/api/load_chat/<int:recent_id>', methods=['GET'])
+@login_required
 def load_chat(recent_id):
-    """Loads the chat history for a given recent_id."""
+    """
+    Loads one page of the chat history for a given recent_id.
+
+    Without a cursor the newest page is returned. `before_id` pages backwards to older
+    messages and `after_id` returns only messages newer than the given id.
+
+    Responses carry an ETag and Last-Modified derived from the chat's creation time and
+    newest message, so a chat that hasn't changed is answered with 304 before any message
+    is loaded.
+    """
     try:
-        # Retrieve all messages for the given recent_id
-        messages = ChatMessages.query.filter_by(recent_id=recent_id).order_by(ChatMessages.timestamp.asc()).all()
-        chat_history = [{"sender": msg.sender, "message": msg.message} for msg in messages]
+        limit = page_size(request.args.get('limit', type=int))
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+
+        recent_chat = RecentChats.query.filter_by(recent_id=recent_id, user_id=current_user.id).first()
+        if not recent_chat:
+            return jsonify({"success": False, "message": "Chat not found"}), 404
+        restore_chat(recent_chat)  # Archived chats are restored on first access
+        latest = latest_message(recent_id)
+        # The creation time tells a chat apart from an earlier deleted one that had the same id
+        created = int(recent_chat.recent_time.timestamp() * 1000) if recent_chat.recent_time else 0
+        etag = f"{recent_id}.{created}.{latest.id if latest else 0}.{before_id}.{after_id}.{limit}"
+        last_modified = latest.timestamp if latest else None
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return with_validators(Response(status=304), etag, last_modified)
 
-        return jsonify({"chat_history": chat_history})
+        if after_id is not None:
+            messages, has_more = messages_after(recent_id, after_id, limit)
+        else:
+            messages, has_more = messages_before(recent_id, before_id, limit)
+        chat_history = [serialize_message(msg) for msg in messages]
+
+        response = jsonify({
+            "chat_history": chat_history,
+            "has_more": has_more,  # More messages exist beyond this page in the requested direction
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+        })
+        return with_validators(response, etag, last_modified)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+def page_size(limit):
+    """Clamps a requested page size to the configured default and maximum."""
+    if not limit or limit < 1:
+        return current_app.config['CHAT_PAGE_SIZE']
+    return min(limit, current_app.config['CHAT_PAGE_MAX_SIZE'])
+
+def messages_before(recent_id, before_id=None, limit=None):
+    """Returns the newest `limit` messages older than `before_id` (oldest first) and whether more exist."""
+    limit = limit or page_size(None)
+    query = ChatMessages.query.filter_by(recent_id=recent_id)
+    if before_id is not None:
+        query = query.filter(ChatMessages.id < before_id)
+    # Fetch one extra row to know whether an older page exists
+    messages = query.order_by(ChatMessages.id.desc()).limit(limit + 1).all()
+    return messages[:limit][::-1], len(messages) > limit
+
+def latest_message(recent_id):
+    """Returns the id and timestamp of a chat's newest message, or None if it has none."""
+    return (db.session.query(ChatMessages.id, ChatMessages.timestamp)
+            .filter_by(recent_id=recent_id)
+            .order_by(ChatMessages.id.desc())
+            .first())
+
+def with_validators(response, etag, last_modified):
+    """
+    Sets the validators of a chat history response. Messages are only ever appended, so the
+    newest message id (with the page requested) identifies the response body.
+    """
+    response.set_etag(etag, weak=True)  # Weak, since the body may be sent gzipped
+    if last_modified:
+        response.last_modified = last_modified
+    # Browsers may keep the body but must check with the server before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def messages_after(recent_id, after_id, limit=None):
+    """Returns up to `limit` messages newer than `after_id` (oldest first) and whether more exist."""
+    limit = limit or page_size(None)
+    messages = (ChatMessages.query.filter_by(recent_id=recent_id)
+                .filter(ChatMessages.id > after_id)
+                .order_by(ChatMessages.id.asc())
+                .limit(limit + 1).all())
+    return messages[:limit], len(messages) > limit
+
+def serialize_message(msg):
+    """Converts a ChatMessages row into the JSON shape used by the chat endpoints."""
+    return {"id": msg.id, "sender": msg.sender, "message": msg.message}
+
+def context_builder():
+    return ContextBuilder(
+        chat_with_google_ai,
+        token_budget=current_app.config['CONTEXT_TOKEN_BUDGET'],
+        summary_tokens=current_app.config['CONTEXT_SUMMARY_TOKENS'],
+    )
+
+def build_context(recent_chat, message):
+    """Returns the model `contents` for a new message, including the relevant chat history."""
+    return context_builder().build(recent_chat, message)
+
+def llm_user():
+    """Returns who model calls of the current request are queued and budgeted for."""
+    if current_user.is_authenticated:
+        return current_user.id
+    return f"ip:{request.remote_addr}"  # Anonymous callers share a budget per address
+
 def chat_with_google_ai(message):
-    """Generates an AI response using Google Generative AI model."""
-    try:
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-        response = model.generate_content(message)
-        return response.text
-    except Exception as e:
-        return f"Error generating AI response: {str(e)}"
+    """Generates an AI response with the configured model backend, raising LLMError on failure."""
+    return llm.generate(message, user=llm_user())
+
+def stream_with_google_ai(message):
+    """Yields the AI response text chunk by chunk as the configured model backend produces it."""
+    return llm.stream(message, user=llm_user())
+
+def llm_error_response(error):
+    """Builds the JSON error response for a failed model call."""
+    response = jsonify({"success": False, "error": str(error)})
+    response.status_code = error.status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 @views.route("/generate/title", methods=["POST"])
 def generate_title():
@@ -171,37 +483,56 @@ def generate_title():
         if not ai_response:
             return jsonify({"success": False, "title": None})
 
-        # Prepare the prompt for title generation
-        prompt = (
-        f"Generate a concise title of at most 20 characters and just single sentence just the title no other thing for the following conversation response if its not greeting or error message or asking for clarification else just return 'error' no anything else :\n\n"
-        f"Response: {ai_response}\n\n"
-    )
+        # Generate the title and validate its length
+        return title_response(chat_with_google_ai(build_title_prompt(ai_response)))
 
-        generated_response = chat_with_google_ai(prompt)
-        title = generated_response.strip()
+    except LLMError as e:
+        return llm_error_response(e)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        # Validate the title length
-        if len(title) <= 20 and title.lower() != 'error':
-            return jsonify({"success": True, "title": title})
-        else:
-            return jsonify({"success": False, "title": None})
+def title_response(generated):
+    """Returns the `generate_title` response for the model's answer."""
+    title = clean_title(generated)
+    if title:
+        return jsonify({"success": True, "title": title})
+    else:
+        return jsonify({"success": False, "title": None})
 
+@views.route('/api/titles/backfill', methods=['POST'])
+@login_required
+def backfill_titles():
+    """Generates titles for a batch of the user's untitled chats with a single AI request."""
+    try:
+        data = request.get_json(silent=True) or {}
+        batch_size = min(int(data.get('batch_size', 20)), 50)
+        titles = generate_titles_batch(batch_size, user_id=current_user.id, user=llm_user())
+        return jsonify({"success": True, "titles": titles})
+    except LLMError as e:
+        return llm_error_response(e)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
-@views.route('/api/delete_chat/<recent_id>', methods=['DELETE'])
+@views.route('/api/stats', methods=['GET'])
+@login_required
+def stats():
+    """Returns operational counters, such as response and user cache hits and misses."""
+    cache = llm.cache
+    return jsonify({
+        "response_cache": cache.stats() if cache else None,
+        "user_cache": identity.stats(),
+    })
+
+@views.route('/api/delete_chat/<int:recent_id>', methods=['DELETE'])
+@login_required
 def delete_chat(recent_id):
-    """Deletes the specified chat and its messages from the database."""
+    """Deletes one of the user's chats and its messages with set-based deletes."""
     try:
-        # Delete all chat messages related to the given recent_id
-        chat_messages = ChatMessages.query.filter_by(recent_id=recent_id).all()
-        for chat_message in chat_messages:
-            db.session.delete(chat_message)
-        
-        # Delete the recent chat record
-        recent_chat = RecentChats.query.filter_by(recent_id=recent_id).first()
-        db.session.delete(recent_chat)
+        deleted = delete_chats([recent_id], user_id=current_user.id)
         db.session.commit()
+        chat_list.invalidate(current_user.id)
+        if not deleted:
+            return jsonify({"success": False, "message": "Chat not found"}), 404
 
         return jsonify({"success": True, "message": "Successfully Deleted"})
     except Exception as e:
@@ -0,0 +1,41 @@
+"""cascade chat message deletes
+
+Revision ID: 4d5e6f708192
+Revises: 3c4d5e6f7081
+Create Date: 2026-10-18 12:02:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d5e6f708192'
+down_revision = '3c4d5e6f7081'
+branch_labels = None
+depends_on = None
+
+# Names unnamed constraints (as created by the initial SQLite schema) so batch mode can drop them
+naming_convention = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+}
+
+
+def recent_id_fk_name():
+    for fk in sa.inspect(op.get_bind()).get_foreign_keys('chat_messages'):
+        if fk['referred_table'] == 'recent_chats':
+            return fk['name'] or 'fk_chat_messages_recent_id_recent_chats'
+
+
+def upgrade():
+    name = recent_id_fk_name()
+    with op.batch_alter_table('chat_messages', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'recent_chats', ['recent_id'], ['recent_id'], ondelete='CASCADE')
+
+
+def downgrade():
+    name = recent_id_fk_name()
+    with op.batch_alter_table('chat_messages', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'recent_chats', ['recent_id'], ['recent_id'])
@@ -0,0 +1,50 @@
+"""add full-text search index over chat messages
+
+Revision ID: 5e6f708192a3
+Revises: 4d5e6f708192
+Create Date: 2026-10-18 13:10:52.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e6f708192a3'
+down_revision = '4d5e6f708192'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite only; other databases search with LIKE
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5("
+        "message, content='chat_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF message ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+        "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END"
+    )
+    # Index the messages stored so far
+    op.execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TRIGGER IF EXISTS chat_messages_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS chat_messages_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS chat_messages_fts_insert")
+    op.execute("DROP TABLE IF EXISTS chat_messages_fts")
@@ -0,0 +1,46 @@
+"""never reuse chat message ids
+
+Revision ID: 708192a3b4c5
+Revises: 6f708192a3b4
+Create Date: 2026-10-19 10:04:37.291835
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '708192a3b4c5'
+down_revision = '6f708192a3b4'
+branch_labels = None
+depends_on = None
+
+# Rebuilding the table drops its triggers; these keep the search index in sync again
+FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); END",
+    "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF message ON chat_messages BEGIN "
+    "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message); "
+    "INSERT INTO chat_messages_fts(rowid, message) VALUES (new.id, new.message); END",
+]
+
+
+def rebuild(autoincrement):
+    # Other databases take ids from sequences, which never go back
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('chat_messages', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}) as batch_op:
+        pass
+    for statement in FTS_TRIGGERS:
+        op.execute(statement)
+
+
+def upgrade():
+    rebuild(True)
+
+
+def downgrade():
+    rebuild(False)
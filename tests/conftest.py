@@ -0,0 +1,41 @@
+"""Fixtures creating the app on a throwaway database with the stub model backend."""
+import pytest
+from werkzeug.security import generate_password_hash
+from chatbot import create_app, db
+from chatbot.models import RecentChats, User
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'LLM_BACKEND': 'stub',
+        'LLM_MAX_RETRIES': 0,
+        'PURGE_INTERVAL': 0,
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'ASSETS_DIR': str(tmp_path / 'assets'),
+    })
+    with app.app_context():
+        yield app
+
+@pytest.fixture
+def user(app):
+    user = User(email='test@gmail.com', name='Test', password_hash=generate_password_hash('test'))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    """A test client logged in as `user`."""
+    client = app.test_client()
+    response = client.post('/login', json={'email': 'test@gmail.com', 'password': 'test'})
+    assert response.status_code == 200
+    return client
+
+@pytest.fixture
+def chat(user):
+    chat = RecentChats(user_id=user.id, title='Test chat')
+    db.session.add(chat)
+    db.session.commit()
+    return chat
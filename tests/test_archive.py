@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from chatbot import db
+from chatbot.archive import archive_batch, ensure_restored
+from chatbot.models import ChatMessages, RecentChats
+
+def add_messages(chat, texts):
+    messages = [ChatMessages(recent_id=chat.recent_id, sender='user', message=text) for text in texts]
+    db.session.add_all(messages)
+    db.session.commit()
+    return [message.id for message in messages]
+
+def archive_all():
+    archived, _, _ = archive_batch(100, datetime.utcnow() + timedelta(days=1))
+    db.session.expire_all()
+    return archived
+
+def history(chat):
+    return [(message.id, message.message) for message in
+            ChatMessages.query.filter_by(recent_id=chat.recent_id).order_by(ChatMessages.id)]
+
+def new_chat(user, title):
+    chat = RecentChats(user_id=user.id, title=title)
+    db.session.add(chat)
+    db.session.commit()
+    return chat
+
+def test_message_ids_are_not_reused_after_archiving(chat, user):
+    ids = add_messages(chat, ['one', 'two'])
+    assert archive_all() == 1
+
+    other = new_chat(user, 'Other chat')
+    other_ids = add_messages(other, ['three'])
+    assert other_ids[0] > max(ids)
+
+    ensure_restored(chat.recent_id)
+    assert history(chat) == list(zip(ids, ['one', 'two']))
+    assert history(other) == list(zip(other_ids, ['three']))
+
+def test_restore_renumbers_when_ids_were_reused(chat, user):
+    ids = add_messages(chat, ['one', 'two', 'three'])
+    chat.summary_upto_id = ids[1]
+    db.session.commit()
+    assert archive_all() == 1
+
+    # Like a database from before AUTOINCREMENT, which gave the freed ids out again
+    other = new_chat(user, 'Other chat')
+    db.session.execute(insert(ChatMessages), [
+        {'id': ids[0], 'recent_id': other.recent_id, 'sender': 'user', 'message': 'reused'},
+    ])
+    db.session.commit()
+
+    ensure_restored(chat.recent_id)
+    db.session.expire_all()
+    restored = history(chat)
+    assert [text for _, text in restored] == ['one', 'two', 'three']
+    assert all(message_id not in ids[:1] for message_id, _ in restored)
+    assert db.session.get(RecentChats, chat.recent_id).summary_upto_id == restored[1][0]
+    assert history(other) == [(ids[0], 'reused')]
+    assert db.session.get(RecentChats, chat.recent_id).archive_segment is None
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import threading
+from chatbot import db, llm
+from chatbot.asgi import AsyncChatApp
+from chatbot.llm import LLMError
+from chatbot.models import ChatMessages, RecentChats
+
+def post(asgi, path, payload, cookie):
+    """Sends one POST through the ASGI app and returns (status, JSON body)."""
+    body = json.dumps(payload).encode()
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'', 'scheme': 'http',
+        'headers': [(b'content-type', b'application/json'), (b'cookie', f'session={cookie}'.encode())],
+    }
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi(scope, receive, send))
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+def test_chat_summarizes_on_the_event_loop(app, client, chat, monkeypatch):
+    app.config['CONTEXT_TOKEN_BUDGET'] = 200
+    app.config['CONTEXT_SUMMARY_TOKENS'] = 50
+    db.session.add_all([ChatMessages(recent_id=chat.recent_id, sender='user' if index % 2 == 0 else 'ai',
+                                     message=f"message {index} ".ljust(200, 'x')) for index in range(6)])
+    db.session.commit()
+
+    calls = []
+
+    async def agenerate(contents, user=None):
+        calls.append((threading.current_thread(), user))
+        return ' folded summary ' if isinstance(contents, str) else 'reply'
+
+    def generate(contents, user=None):
+        raise AssertionError("blocking model call")
+
+    monkeypatch.setattr(llm, 'agenerate', agenerate)
+    monkeypatch.setattr(llm, 'generate', generate)
+    asgi = AsyncChatApp(app)
+    status, body = post(asgi, '/chat', {'message': 'next', 'recent_id': chat.recent_id},
+                        client.get_cookie('session').value)
+
+    assert status == 200, body
+    assert body['response'] == 'reply'
+    # Both the summary and the reply were awaited on the loop's thread, not the executor's
+    assert [call[1] for call in calls] == [chat.user_id, chat.user_id]
+    assert len({call[0] for call in calls}) == 1
+    assert not calls[0][0].name.startswith('async-db')
+    db.session.expire_all()
+    saved = db.session.get(RecentChats, chat.recent_id)
+    assert saved.summary == 'folded summary'
+    assert saved.summary_upto_id is not None
+
+def test_failed_reply_keeps_the_user_message(app, client, chat, monkeypatch):
+    async def agenerate(contents, user=None):
+        raise LLMError("model unavailable")
+
+    monkeypatch.setattr(llm, 'agenerate', agenerate)
+    status, body = post(AsyncChatApp(app), '/chat', {'message': 'hello', 'recent_id': chat.recent_id},
+                        client.get_cookie('session').value)
+
+    assert status == 502 and not body['success']
+    db.session.expire_all()
+    assert [(msg.sender, msg.message) for msg in ChatMessages.query.filter_by(recent_id=chat.recent_id)] == [('user', 'hello')]
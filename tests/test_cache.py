@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+import pytest
+from chatbot.cache import MISSING, LRUCache, ResponseCache, SQLiteStore, make_key
+
+def run_concurrently(cache, compute, count=8):
+    """Calls get_or_compute for one key from `count` threads at once; returns results or errors."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def call(index):
+        barrier.wait()
+        try:
+            results[index] = cache.get_or_compute('key', compute)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+def slow(result, calls):
+    """Returns a compute function that records its calls and gives the others time to pile up."""
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return compute
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache(LRUCache())
+    calls = []
+
+    results = run_concurrently(cache, slow('reply', calls))
+
+    assert calls == [1]
+    assert results == ['reply'] * 8
+    assert cache.misses == 1 and cache.coalesced + cache.hits == 7
+    assert cache.get('key') == 'reply'
+
+def test_leader_error_reaches_followers_and_is_not_cached():
+    cache = ResponseCache(LRUCache())
+    calls = []
+    error = RuntimeError("model down")
+
+    results = run_concurrently(cache, slow(error, calls))
+
+    assert calls == [1]
+    assert all(result is error for result in results)
+    assert cache.get('key') is MISSING
+    assert cache.get_or_compute('key', lambda: 'retried') == 'retried'
+
+def test_async_concurrent_misses_compute_once():
+    cache = ResponseCache(LRUCache())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("model down")
+        return 'reply'
+
+    async def scenario():
+        failed = await asyncio.gather(*(cache.aget_or_compute('key', compute) for _ in range(5)),
+                                      return_exceptions=True)
+        assert len(calls) == 1 and all(isinstance(result, RuntimeError) for result in failed)
+        assert cache.get('key') is MISSING
+        return await asyncio.gather(*(cache.aget_or_compute('key', compute) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ['reply'] * 5
+    assert len(calls) == 2 and cache.coalesced == 8
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(ttl=60)
+    cache.set('default', 1)
+    cache.set('short', 2, ttl=10)
+
+    now[0] += 10
+    assert cache.get('short') is MISSING
+    assert cache.get('default') == 1
+    now[0] += 50
+    assert cache.get('default') is MISSING
+    assert len(cache) == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')  # Now 'b' is the least recently used
+
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+def test_sqlite_tier_is_shared_between_processes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.db')
+    first = ResponseCache(LRUCache(), SQLiteStore(path, ttl=60))
+    second = ResponseCache(LRUCache(), SQLiteStore(path, ttl=60))
+    key = make_key([{"role": "user", "parts": ["Hello   there"]}], model='m')
+    assert key == make_key([{"role": "user", "parts": ["Hello there"]}], model='m')
+
+    first.get_or_compute(key, lambda: {"text": "hi"})
+    assert second.get_or_compute(key, lambda: pytest.fail("computed again")) == {"text": "hi"}
+    assert second.store_hits == 1
+    assert second.get(key) == {"text": "hi"} and second.hits == 1  # Now in its memory tier
+
+    third = ResponseCache(LRUCache(), SQLiteStore(path, ttl=60))
+    later = time.time() + 60
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert third.get(key) is MISSING  # Expired in the shared tier
@@ -0,0 +1,88 @@
+from chatbot import db
+from chatbot.context import ContextBuilder, estimate_tokens
+from chatbot.models import ChatMessages
+
+class FakeModel:
+    """
+    Deterministic stand-in for the model summarizing older turns.
+
+    Records every prompt it receives and answers with `reply`, or raises `error`.
+    """
+
+    def __init__(self, reply='summary', error=None):
+        self.reply = reply
+        self.error = error
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+def add_turns(chat, count, start=0, length=100):
+    """Stores `count` alternating user and AI messages of `length` characters, numbered from `start`."""
+    messages = [ChatMessages(recent_id=chat.recent_id, sender='user' if index % 2 == 0 else 'ai',
+                             message=f"message {index} ".ljust(length, 'x')) for index in range(start, start + count)]
+    db.session.add_all(messages)
+    db.session.commit()
+    return messages
+
+def texts(contents):
+    return [part for content in contents for part in content["parts"]]
+
+def test_short_history_is_sent_verbatim(chat):
+    messages = add_turns(chat, 4)
+    model = FakeModel()
+
+    contents = ContextBuilder(model, token_budget=1000, summary_tokens=100).build(chat, 'next question')
+
+    assert model.prompts == []
+    assert chat.summary is None
+    assert texts(contents) == [msg.message for msg in messages] + ['next question']
+    assert [content["role"] for content in contents] == ['user', 'model', 'user', 'model', 'user']
+
+def test_overflowing_turns_are_folded_into_the_summary(chat):
+    messages = add_turns(chat, 20)  # 26 estimated tokens each
+    model = FakeModel(reply='the story so far')
+    builder = ContextBuilder(model, token_budget=300, summary_tokens=50)
+
+    contents = builder.build(chat, 'next question')
+
+    assert len(model.prompts) == 1
+    assert messages[0].message in model.prompts[0]
+    assert chat.summary == 'the story so far'
+    kept = [msg for msg in messages if msg.id > chat.summary_upto_id]
+    assert kept and texts(contents)[-len(kept) - 1:] == [msg.message for msg in kept] + ['next question']
+    assert 'the story so far' in texts(contents)[0]
+    # Summary, retained history and the new message stay within the budget
+    assert sum(estimate_tokens(text) for text in texts(contents)) <= builder.token_budget
+
+def test_summary_is_extended_from_the_last_folded_message(chat):
+    add_turns(chat, 20)
+    builder = ContextBuilder(FakeModel(reply='first summary'), token_budget=300, summary_tokens=50)
+    builder.build(chat, 'next question')
+    folded_upto = chat.summary_upto_id
+
+    later = add_turns(chat, 10, start=20)
+    model = FakeModel(reply='second summary')
+    ContextBuilder(model, token_budget=300, summary_tokens=50).build(chat, 'another question')
+
+    assert len(model.prompts) == 1
+    assert 'first summary' in model.prompts[0]
+    # Already folded turns aren't sent again, only the ones after them
+    folded_before = ChatMessages.query.filter(ChatMessages.recent_id == chat.recent_id,
+                                              ChatMessages.id <= folded_upto).all()
+    assert not any(msg.message in model.prompts[0] for msg in folded_before)
+    assert chat.summary == 'second summary'
+    assert folded_upto < chat.summary_upto_id < later[-1].id
+
+def test_failed_summary_keeps_the_previous_one(chat):
+    add_turns(chat, 20)
+    model = FakeModel(error=RuntimeError('upstream down'))
+
+    contents = ContextBuilder(model, token_budget=300, summary_tokens=50).build(chat, 'next question')
+
+    assert len(model.prompts) == 1
+    assert chat.summary is None and chat.summary_upto_id is None
+    assert texts(contents)[-1] == 'next question'
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from chatbot.events import RedisBroker, format_event
+
+class FakeRedis:
+    """
+    In-memory stand-in for a Redis server's pub/sub, shared by the brokers of several
+    simulated processes. Implements just what RedisBroker uses.
+    """
+
+    def __init__(self):
+        self.pubsubs = []
+        self.lock = threading.Lock()
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        pubsub = FakePubSub()
+        with self.lock:
+            self.pubsubs.append(pubsub)
+        return pubsub
+
+    def publish(self, channel, data):
+        with self.lock:
+            receivers = [pubsub for pubsub in self.pubsubs if channel in pubsub.channels]
+        for pubsub in receivers:
+            pubsub.messages.put({'type': 'message', 'channel': channel.encode(), 'data': data.encode()})
+        return len(receivers)
+
+    def subscribed(self, channel):
+        """Returns how many connections are subscribed to `channel`."""
+        with self.lock:
+            return sum(channel in pubsub.channels for pubsub in self.pubsubs)
+
+class FakePubSub:
+    def __init__(self):
+        self.channels = set()
+        self.messages = queue.Queue()
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+
+    def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    def get_message(self, timeout=0):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_events_fan_out_to_every_process():
+    redis = FakeRedis()
+    first, second = RedisBroker(redis), RedisBroker(redis)
+    subscriptions = [first.subscribe(['chat.1']), second.subscribe(['chat.1'])]
+    wait_until(lambda: redis.subscribed('chatbot:chat.1') == 2)
+
+    first.publish('chat.1', {'title': 'Tides'}, type='title')
+
+    for subscription in subscriptions:
+        assert subscription.get(timeout=2) == format_event({'title': 'Tides'}, type='title')
+
+def test_events_reach_only_their_channel():
+    redis = FakeRedis()
+    broker = RedisBroker(redis)
+    chat = broker.subscribe(['chat.1'])
+    user = broker.subscribe(['user.1'])
+    wait_until(lambda: redis.subscribed('chatbot:chat.1') and redis.subscribed('chatbot:user.1'))
+
+    broker.publish('chat.2', {'n': 0})
+    RedisBroker(redis, prefix='other:').publish('chat.1', {'n': 1})  # Another app on the same server
+    broker.publish('user.1', {'n': 2})
+
+    assert user.get(timeout=2) == format_event({'n': 2})
+    assert chat.get(timeout=0.3) is None
+
+    chat.close()
+    wait_until(lambda: not redis.subscribed('chatbot:chat.1'))
+    assert redis.subscribed('chatbot:user.1') == 1
+
+def test_slow_subscribers_drop_their_oldest_events():
+    redis = FakeRedis()
+    broker = RedisBroker(redis, queue_size=2)
+    subscription = broker.subscribe(['chat.1'])
+    wait_until(lambda: redis.subscribed('chatbot:chat.1'))
+
+    for n in range(5):
+        broker.publish('chat.1', {'n': n})
+    wait_until(lambda: subscription.dropped == 3)
+
+    assert broker.dropped == 3
+    assert [subscription.get(timeout=0), subscription.get(timeout=0)] == [format_event({'n': 3}), format_event({'n': 4})]
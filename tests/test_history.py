@@ -0,0 +1,54 @@
+from chatbot import db
+from chatbot.history import export_lines, import_lines
+from chatbot.models import ChatMessages, RecentChats
+
+def test_import_skips_what_is_already_there(user, chat):
+    db.session.add(ChatMessages(recent_id=chat.recent_id, sender='user', message='hello'))
+    db.session.commit()
+    lines = list(export_lines(user.id))
+
+    counts = import_lines(lines, user_id=user.id)
+
+    assert counts == {"users": 0, "chats": 0, "messages": 0, "skipped": 2, "conflicts": 0}
+
+def test_import_reports_message_ids_of_other_chats_as_conflicts(user, chat):
+    message = ChatMessages(recent_id=chat.recent_id, sender='user', message='mine')
+    db.session.add(message)
+    db.session.commit()
+    # An export from elsewhere whose message has the id of a message in another chat
+    lines = [
+        '{"type": "export", "version": 1}',
+        '{"type": "chat", "recent_id": 500, "user_id": 9, "title": "Imported"}',
+        f'{{"type": "message", "id": {message.id}, "recent_id": 500, "sender": "user", "message": "theirs"}}',
+        '{"type": "message", "id": 501, "recent_id": 500, "sender": "ai", "message": "reply"}',
+    ]
+
+    counts = import_lines(lines, user_id=user.id)
+
+    assert counts == {"users": 0, "chats": 1, "messages": 1, "skipped": 0, "conflicts": 1}
+    assert db.session.get(ChatMessages, message.id).message == 'mine'
+    assert [msg.message for msg in ChatMessages.query.filter_by(recent_id=500)] == ['reply']
+    assert db.session.get(RecentChats, 500).user_id == user.id
+
+def test_upload_gets_new_ids(client, user):
+    huge = 2 ** 63 - 1
+    lines = [
+        '{"type": "export", "version": 1}',
+        f'{{"type": "chat", "recent_id": {huge}, "user_id": 9, "title": "Imported", "summary": "s", "summary_upto_id": {huge}}}',
+        f'{{"type": "message", "id": {huge - 1}, "recent_id": {huge}, "sender": "user", "message": "question"}}',
+        f'{{"type": "message", "id": {huge}, "recent_id": {huge}, "sender": "ai", "message": "answer"}}',
+    ]
+
+    response = client.post('/api/import', data='\n'.join(lines), content_type='application/x-ndjson')
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["chats"] == 1 and response.get_json()["messages"] == 2
+    imported = RecentChats.query.filter_by(title='Imported').one()
+    assert imported.recent_id < huge and imported.summary is None and imported.summary_upto_id is None
+    assert [(msg.sender, msg.message) for msg in ChatMessages.query.filter_by(recent_id=imported.recent_id)
+            .order_by(ChatMessages.id)] == [('user', 'question'), ('ai', 'answer')]
+    assert db.session.query(db.func.max(ChatMessages.id)).scalar() < huge
+
+    # The id sequence is untouched, so chatting still works
+    response = client.post('/chat', json={'message': 'hello'})
+    assert response.status_code == 200, response.get_json()
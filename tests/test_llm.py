@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+import pytest
+from chatbot import llm
+from chatbot.llm import AsyncLimiter, Budget, FairQueue, Limiter, LLMError, LLMOverloaded, LLMRateLimited
+
+class Clock:
+    """Stands in for time.monotonic, moved forward by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
+
+def test_fair_queue_serves_users_round_robin():
+    queue = FairQueue()
+    for user, waiter in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), ('c', 'c1'), ('c', 'c2')]:
+        queue.push(user, waiter)
+
+    assert queue.users() == 3
+    assert [queue.pop() for _ in range(len(queue))] == ['a1', 'b1', 'c1', 'a2', 'c2', 'a3']
+    assert queue.users() == 0
+
+def test_limiter_hands_freed_slots_to_users_in_turn():
+    limiter = Limiter(max_concurrency=1, max_queue=10, queue_timeout=5)
+    limiter.acquire('holder')
+    served, lock = [], threading.Lock()
+
+    def call(user, name):
+        with limiter.slot(user):
+            with lock:
+                served.append(name)
+
+    threads = []
+    for user, name in [('a', 'a1'), ('a', 'a2'), ('b', 'b1')]:
+        thread = threading.Thread(target=call, args=(user, name))
+        thread.start()
+        threads.append(thread)
+        while limiter.waiting < len(threads):  # Queue them in a known order
+            time.sleep(0.001)
+    limiter.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert served == ['a1', 'b1', 'a2']
+    assert limiter.in_flight == 0
+
+def test_limiter_caps_each_users_queue():
+    async def scenario():
+        limiter = AsyncLimiter(max_concurrency=1, max_queue=3, queue_timeout=5, max_user_queue=2)
+        await limiter.acquire('holder')
+        waiting = [asyncio.ensure_future(limiter.acquire(user)) for user in ('a', 'a')]
+        await asyncio.sleep(0)
+
+        with pytest.raises(LLMRateLimited) as error:
+            await limiter.acquire('a')  # A third call from the same user
+        assert error.value.status == 429 and error.value.retry_after == 1
+        waiting.append(asyncio.ensure_future(limiter.acquire('b')))  # Other users still queue
+        await asyncio.sleep(0)
+        assert limiter.waiting == 3
+        with pytest.raises(LLMOverloaded):
+            await limiter.acquire('c')  # The queue as a whole is full
+
+        for _ in waiting:
+            limiter.release()
+        await asyncio.gather(*waiting)
+        assert limiter.waiting == 0 and limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+def test_budget_reports_when_requests_fit_again(clock):
+    budget = Budget(requests_per_minute=2, tokens_per_minute=0)
+    budget.charge('a', 10)
+    budget.charge('a', 10)
+
+    with pytest.raises(LLMRateLimited) as error:
+        budget.charge('a', 10)
+    assert error.value.status == 429 and error.value.retry_after == 30  # One request refills in 30 s
+    budget.charge('b', 10)  # Other users have their own buckets
+
+    clock.now += 29
+    with pytest.raises(LLMRateLimited) as error:
+        budget.charge('a', 10)
+    assert error.value.retry_after == 1
+    clock.now += 1
+    budget.charge('a', 10)
+
+def test_budget_refills_tokens_continuously(clock):
+    budget = Budget(requests_per_minute=0, tokens_per_minute=100)
+    budget.charge('a', 80)
+
+    with pytest.raises(LLMRateLimited) as error:
+        budget.charge('a', 50)
+    assert error.value.retry_after == 18  # 30 missing tokens at 100 a minute
+
+    clock.now += 18
+    budget.charge('a', 50)
+    budget.spend('a', 200)  # Replies may overdraw the bucket
+    with pytest.raises(LLMRateLimited) as error:
+        budget.charge('a', 1)
+    assert error.value.retry_after == 121  # 201 missing tokens
+
+def test_limiter_slot_is_released_when_the_call_raises(app, monkeypatch):
+    app.config['LLM_MAX_RETRIES'] = 0
+
+    def generate(contents):
+        raise ValueError("upstream broke")
+
+    async def agenerate(contents):
+        raise ValueError("upstream broke")
+
+    monkeypatch.setattr(llm.backend, 'generate', generate)
+    monkeypatch.setattr(llm.backend, 'agenerate', agenerate)
+    for _ in range(llm.limiter.max_concurrency + 1):
+        with pytest.raises(LLMError):
+            llm.generate('prompt', user='a')
+
+    async def agenerate_all():
+        for _ in range(llm.async_limiter.max_concurrency + 1):
+            with pytest.raises(LLMError):
+                await llm.agenerate('prompt', user='a')
+
+    asyncio.run(agenerate_all())
+    assert llm.limiter.in_flight == 0 and llm.limiter.waiting == 0
+    assert llm.async_limiter.in_flight == 0 and llm.async_limiter.waiting == 0
@@ -0,0 +1,18 @@
+import pytest
+
+@pytest.mark.parametrize("token, remote_addr, headers, status", [
+    (None, '127.0.0.1', {}, 200),
+    (None, '::1', {}, 200),
+    (None, '203.0.113.5', {}, 403),
+    ('secret', '127.0.0.1', {}, 401),
+    ('secret', '203.0.113.5', {'Authorization': 'Bearer wrong'}, 401),
+    ('secret', '203.0.113.5', {'Authorization': 'Bearer secret'}, 200),
+])
+def test_metrics_are_closed_by_default(app, token, remote_addr, headers, status):
+    app.config['METRICS_TOKEN'] = token
+
+    response = app.test_client().get('/metrics', headers=headers, environ_base={'REMOTE_ADDR': remote_addr})
+
+    assert response.status_code == status
+    if status == 200:
+        assert b'# TYPE' in response.data
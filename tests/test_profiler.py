@@ -0,0 +1,11 @@
+from chatbot import profiler
+
+def test_profiles_are_keyed_by_a_server_generated_id(app, client):
+    app.config['PROFILE_REQUESTS'] = True
+
+    response = client.get('/api/load_chat/1', headers={'X-Request-Id': 'chosen-by-client'})
+
+    request_id = response.headers['X-Request-Id']
+    assert request_id != 'chosen-by-client'
+    assert profiler.get('chosen-by-client') is None
+    assert profiler.get(request_id)['client_request_id'] == 'chosen-by-client'
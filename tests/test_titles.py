@@ -0,0 +1,66 @@
+import pytest
+from chatbot import db, llm
+from chatbot.models import ChatMessages, RecentChats
+from chatbot.titles import MAX_TITLE_LENGTH, generate_titles_batch, parse_batch_titles, shorten_title
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"1": "Python decorators", "2": "Trip to Rome"}', {1: "Python decorators", 2: "Trip to Rome"}),
+    ('```json\n{"1": "Python decorators", "2": "Trip to Rome"}\n```', {1: "Python decorators", 2: "Trip to Rome"}),
+    ("1. Python decorators\n2) Trip to Rome", {1: "Python decorators", 2: "Trip to Rome"}),
+    ("Conversation 1: Python decorators\nConversation 2 - Trip to Rome", {1: "Python decorators", 2: "Trip to Rome"}),
+    # Missing lines: only the chats that got a title are returned
+    ('{"2": "Trip to Rome"}', {2: "Trip to Rome"}),
+    ("1: Python decorators", {1: "Python decorators"}),
+    ("", {}),
+    # Extra lines and unknown ids are ignored
+    ("Here are the titles:\n1: Python decorators\n2: Trip to Rome\n3: Not asked for\nHope this helps!",
+     {1: "Python decorators", 2: "Trip to Rome"}),
+    # Bad numbering drops only the entries it affects
+    ("one: Python decorators\n#2 Trip to Rome\n2: Trip to Rome", {2: "Trip to Rome"}),
+    ("a: Python decorators\nb: Trip to Rome", {}),
+    # Unparseable JSON falls back to the numbered lines
+    ('{"1": "Python decorators",\n2: Trip to Rome', {2: "Trip to Rome"}),
+    # One bad entry doesn't drop the others
+    ('{"1": "error", "2": "Trip to Rome"}', {2: "Trip to Rome"}),
+    ('{"1": null, "2": "Trip to Rome"}', {2: "Trip to Rome"}),
+    ('{"1": "  ", "2": "Trip to Rome"}', {2: "Trip to Rome"}),
+    # Over-long titles are shortened, not dropped
+    ('{"1": "How to configure an nginx reverse proxy", "2": "Trip to Rome"}',
+     {1: "How to configure an", 2: "Trip to Rome"}),
+])
+def test_parse_batch_titles(text, expected):
+    assert parse_batch_titles(text, [1, 2]) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Trip to Rome", "Trip to Rome"),
+    ('  "Trip   to\nRome"  ', "Trip to Rome"),
+    ("**Trip to Rome**", "Trip to Rome"),
+    ("How to configure an nginx reverse proxy", "How to configure an"),
+    ("Supercalifragilisticexpialidocious", "Supercalifragilistic"),
+    ("Python decorators, explained", "Python decorators"),
+    ('""', None),
+    ("", None),
+])
+def test_shorten_title(text, expected):
+    title = shorten_title(text)
+    assert title == expected
+    assert title is None or len(title) <= MAX_TITLE_LENGTH
+
+def test_batch_falls_back_per_chat(app, user, monkeypatch):
+    chats = []
+    for question in ("What are decorators?", "Plan a trip to Rome for me please", "Tides?"):
+        chat = RecentChats(user_id=user.id, title='New Chat')
+        db.session.add(chat)
+        db.session.commit()
+        db.session.add_all([ChatMessages(recent_id=chat.recent_id, sender='user', message=question),
+                            ChatMessages(recent_id=chat.recent_id, sender='ai', message='An answer.')])
+        chats.append(chat)
+    db.session.commit()
+    first, second, third = (chat.recent_id for chat in chats)
+    reply = f'{{"{first}": "Python decorators", "{second}": "error"}}'  # Nothing for the third chat
+    monkeypatch.setattr(llm, 'generate', lambda prompt, user=None: reply)
+
+    titles = generate_titles_batch(10)
+
+    assert titles == {first: "Python decorators", second: "Plan a trip to Rome", third: "Tides?"}
+    assert [chat.title for chat in RecentChats.query.order_by(RecentChats.recent_id)] == list(titles.values())
@@ -0,0 +1,129 @@
+from datetime import datetime
+from werkzeug.security import generate_password_hash
+from chatbot import db, llm
+from chatbot.llm import LLMError
+from chatbot.models import ChatMessages, RecentChats, User
+
+def add_message(chat, text):
+    message = ChatMessages(recent_id=chat.recent_id, sender='user', message=text)
+    db.session.add(message)
+    db.session.commit()
+    return message
+
+def test_load_chat_returns_own_history(client, chat):
+    add_message(chat, 'hello')
+
+    response = client.get(f'/api/load_chat/{chat.recent_id}')
+
+    assert response.status_code == 200
+    assert [msg['message'] for msg in response.get_json()['chat_history']] == ['hello']
+
+def test_load_chat_of_another_user_is_not_found(app, client):
+    other = User(email='other@gmail.com', name='Other', password_hash=generate_password_hash('other'))
+    db.session.add(other)
+    db.session.commit()
+    chat = RecentChats(user_id=other.id, title='Private')
+    db.session.add(chat)
+    db.session.commit()
+    add_message(chat, 'secret')
+
+    response = client.get(f'/api/load_chat/{chat.recent_id}')
+
+    assert response.status_code == 404
+    assert b'secret' not in response.data
+
+def test_load_chat_requires_login(app, chat):
+    add_message(chat, 'secret')
+
+    response = app.test_client().get(f'/api/load_chat/{chat.recent_id}')
+
+    assert response.status_code == 302
+    assert b'secret' not in response.data
+
+def test_load_chat_etag_changes_when_a_chat_id_is_reused(client, user):
+    first = RecentChats(user_id=user.id, title='First', recent_time=datetime(2026, 1, 1))
+    db.session.add(first)
+    db.session.commit()
+    recent_id = first.recent_id
+    etag = client.get(f'/api/load_chat/{recent_id}').headers['ETag']
+
+    assert client.delete(f'/api/delete_chat/{recent_id}').status_code == 200
+    db.session.expunge_all()
+    second = RecentChats(user_id=user.id, title='Second', recent_time=datetime(2026, 1, 2))
+    db.session.add(second)
+    db.session.commit()
+    assert second.recent_id == recent_id  # SQLite hands out the freed id again
+
+    response = client.get(f'/api/load_chat/{recent_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+def test_title_backfill_is_charged_to_the_user(client, user, monkeypatch):
+    chat = RecentChats(user_id=user.id, title='New Chat')
+    db.session.add(chat)
+    db.session.commit()
+    db.session.add_all([ChatMessages(recent_id=chat.recent_id, sender='user', message='How do tides work?'),
+                        ChatMessages(recent_id=chat.recent_id, sender='ai', message='The moon pulls the oceans.')])
+    db.session.commit()
+    charged = []
+    monkeypatch.setattr(llm, '_charge', lambda user, contents: charged.append(user))
+
+    response = client.post('/api/titles/backfill', json={'batch_size': 5})
+
+    assert response.status_code == 200
+    assert chat.recent_id in {int(recent_id) for recent_id in response.get_json()['titles']}
+    assert charged == [user.id]
+
+def failing_stream(*chunks):
+    def stream(contents, user=None):
+        yield from chunks
+        raise LLMError("model unavailable")
+    return stream
+
+def chat_messages(recent_id):
+    db.session.expire_all()
+    return [(msg.sender, msg.message) for msg in
+            ChatMessages.query.filter_by(recent_id=recent_id).order_by(ChatMessages.id)]
+
+def test_failed_replies_keep_the_user_message(client, chat, monkeypatch):
+    def generate(contents, user=None):
+        raise LLMError("model unavailable")
+    monkeypatch.setattr(llm, 'generate', generate)
+    monkeypatch.setattr(llm, 'stream', failing_stream())
+
+    assert client.post('/chat', json={'message': 'one', 'recent_id': chat.recent_id}).status_code == 502
+    assert client.post('/chat/stream', json={'message': 'two', 'recent_id': chat.recent_id}).status_code == 502
+
+    assert chat_messages(chat.recent_id) == [('user', 'one'), ('user', 'two')]
+
+def test_stream_cut_off_keeps_what_arrived(client, chat, monkeypatch):
+    monkeypatch.setattr(llm, 'stream', failing_stream('Half ', 'a reply'))
+
+    response = client.post('/chat/stream', json={'message': 'question', 'recent_id': chat.recent_id})
+
+    assert response.get_data(as_text=True) == 'Half a reply'
+    assert chat_messages(chat.recent_id) == [('user', 'question'), ('ai', 'Half a reply')]
+
+def test_empty_stream_is_saved_like_an_empty_reply(client, chat, monkeypatch):
+    def stream(contents, user=None):
+        yield from ()
+    monkeypatch.setattr(llm, 'stream', stream)
+
+    response = client.post('/chat/stream', json={'message': 'question', 'recent_id': chat.recent_id})
+
+    assert response.status_code == 200 and response.get_data() == b''
+    assert chat_messages(chat.recent_id) == [('user', 'question'), ('ai', '')]
+
+def test_repeated_loads_send_fewer_bytes(client, chat):
+    for index in range(40):
+        add_message(chat, f"message {index}: the tide comes in twice a day, pulled by the moon")
+    url = f'/api/load_chat/{chat.recent_id}'
+
+    raw = client.get(url)
+    gzipped = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    revalidated = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']})
+
+    assert raw.status_code == 200 and 'Content-Encoding' not in raw.headers
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert len(gzipped.data) < len(raw.data)
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''